@@ -0,0 +1,45 @@
+# Benchmark AlternatingLeastSquares against the keras ExplicitMatrixFactorisation:
+# training time and train RMSE on synthetic low rank ratings
+#
+# Usage: python benchmarks/bench_als.py [n_ratings]
+
+import sys
+import time
+import numpy as np
+import pandas as pd
+from recoflow.models import AlternatingLeastSquares, ExplicitMatrixFactorisation
+
+
+def _RMSE(model, df):
+    predictions = model.predict([df.USER.values, df.ITEM.values], verbose=0).ravel()
+    return np.sqrt(np.mean((predictions - df.RATING.values) ** 2))
+
+
+if __name__ == "__main__":
+    n_ratings = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    n_users, n_items, n_factors = n_ratings // 50, n_ratings // 100, 16
+    rng = np.random.RandomState(42)
+
+    user_factors = rng.normal(size=(n_users, n_factors)) / 2
+    item_factors = rng.normal(size=(n_items, n_factors)) / 2
+    df = pd.DataFrame({
+        "USER": rng.randint(n_users, size=n_ratings),
+        "ITEM": rng.randint(n_items, size=n_ratings),
+    }).drop_duplicates()
+    df["RATING"] = (user_factors[df.USER] * item_factors[df.ITEM]).sum(axis=1)
+
+    print("{:>28} {:>10} {:>10}".format("model", "time (s)", "RMSE"))
+    for n_iter in [5, 10, 20]:
+        start = time.perf_counter()
+        model = AlternatingLeastSquares(df, n_factors=n_factors, n_iter=n_iter)
+        print("{:>28} {:>10.2f} {:>10.4f}".format(
+            "ALS, {} iterations".format(n_iter), time.perf_counter() - start, _RMSE(model, df)))
+
+    model = ExplicitMatrixFactorisation(n_users, n_items, n_factors)
+    start = time.perf_counter()
+    for epoch in range(1, 11):
+        model.fit([df.USER.values, df.ITEM.values], df.RATING.values,
+                  batch_size=1024, epochs=1, verbose=0)
+        if epoch in (1, 5, 10):
+            print("{:>28} {:>10.2f} {:>10.4f}".format(
+                "keras, {} epochs".format(epoch), time.perf_counter() - start, _RMSE(model, df)))
@@ -0,0 +1,48 @@
+# Benchmark the user x item cross-join against the nested python loop
+#
+# Usage: python benchmarks/bench_crossjoin.py
+
+import time
+import numpy as np
+import pandas as pd
+from recoflow.utils import _UserItemCrossJoin
+
+
+def _LoopCrossJoin(df):
+    crossjoin_list = []
+    for user in df.USER.unique():
+        for item in df.ITEM.unique():
+            crossjoin_list.append([user, item])
+
+    return pd.DataFrame(data=crossjoin_list, columns=["USER", "ITEM"])
+
+
+def _Timeit(func, *args, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _Chunked(df, chunk_size):
+    for chunk in _UserItemCrossJoin(df, chunk_size=chunk_size):
+        pass
+
+
+if __name__ == "__main__":
+    print("{:>8} {:>8} {:>12} {:>12} {:>12} {:>8}".format(
+        "users", "items", "loop (s)", "grid (s)", "chunked (s)", "speedup"))
+    for n_users, n_items in [(100, 100), (500, 1000), (943, 1682)]:
+        df = pd.DataFrame({
+            "USER": np.repeat(np.arange(n_users), 2),
+            "ITEM": np.resize(np.arange(n_items), 2 * n_users),
+        })
+        df = pd.concat([df, pd.DataFrame({"USER": 0, "ITEM": np.arange(n_items)})])
+
+        loop = _Timeit(_LoopCrossJoin, df, repeat=1)
+        grid = _Timeit(_UserItemCrossJoin, df)
+        chunked = _Timeit(_Chunked, df, 1_000_000)
+        print("{:>8} {:>8} {:>12.4f} {:>12.4f} {:>12.4f} {:>7.0f}x".format(
+            n_users, n_items, loop, grid, chunked, loop / grid))
@@ -0,0 +1,68 @@
+# Benchmark the import time of recoflow entry points, in fresh interpreters, and
+# list the heavy modules they load. Then check the start time of serving: importing
+# recoflow.serving, loading an exported model and scoring a first request
+#
+# Usage: python benchmarks/bench_import.py
+
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+ENTRY_POINTS = [
+    "import recoflow",
+    "from recoflow.metrics import RankingMetrics",
+    "from recoflow.preprocessing import EncodeUserItem, LeaveLastNSplit",
+    "from recoflow.serving import LoadModel",
+    "from recoflow.recommend import LoadModel, GetRankingTopK",
+    "from recoflow.models import AlternatingLeastSquares",
+    "from recoflow.models import ExplicitMatrixFactorisation; ExplicitMatrixFactorisation(10, 10, 2)",
+]
+
+HEAVY = ["tensorflow", "keras", "sklearn", "matplotlib", "PIL", "altair", "pandas", "scipy"]
+
+# Target start time of serving (seconds)
+SERVING_START = 0.2
+
+SCRIPT = """
+import sys, time
+start = time.perf_counter()
+{}
+elapsed = time.perf_counter() - start
+print(elapsed, ",".join(name for name in {!r} if name in sys.modules))
+"""
+
+
+def _ImportTime(statement, repeat=3):
+    """Best time (seconds) of a statement in a fresh interpreter, and the heavy modules loaded"""
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, "-c", SCRIPT.format(statement, HEAVY)],
+            capture_output=True, text=True, check=True,
+        ).stdout.split()
+        runs.append((float(output[0]), output[1] if len(output) > 1 else ""))
+    return min(runs)
+
+
+if __name__ == "__main__":
+    print("{:<96} {:>9}  {}".format("statement", "time (s)", "heavy modules"))
+    for statement in ENTRY_POINTS:
+        elapsed, heavy = _ImportTime(statement)
+        print("{:<96} {:>9.3f}  {}".format(statement, elapsed, heavy))
+    
+    from recoflow.encoder import IdEncoder
+    from recoflow.serving import FactorScorer, ExportModel
+    
+    rng = np.random.default_rng(0)
+    model = FactorScorer(rng.normal(size=(100000, 64)), rng.normal(size=(50000, 64)),
+                         user_encoder=IdEncoder().fit(np.arange(100000) * 7))
+    with tempfile.TemporaryDirectory() as path:
+        ExportModel(model, path)
+        statement = ("from recoflow.serving import LoadModel; model = LoadModel({!r}); "
+                     "model.score(model.user_encoder.transform([700]))").format(path)
+        elapsed, heavy = _ImportTime(statement)
+    
+    print("\nserving start (import, LoadModel, first request): {:.3f}s, target {:.3f}s: {}  {}".format(
+        elapsed, SERVING_START, "ok" if elapsed < SERVING_START else "SLOW", heavy))
@@ -0,0 +1,29 @@
+# Benchmark negative sampling at a 1:4 ratio for a growing number of positives
+#
+# Usage: python benchmarks/bench_negative_sampling.py
+
+import time
+import numpy as np
+import pandas as pd
+from recoflow.utils import NegativeSamples
+
+
+if __name__ == "__main__":
+    rng = np.random.RandomState(42)
+    n_items = 20_000
+
+    print("{:>12} {:>10} {:>12} {:>14}".format("positives", "users", "time (s)", "us / positive"))
+    for n_ratings in [100_000, 1_000_000, 10_000_000]:
+        n_users = n_ratings // 50
+        df = pd.DataFrame({
+            "USER": rng.randint(n_users, size=n_ratings),
+            "ITEM": rng.zipf(1.3, size=n_ratings) % n_items,
+            "RATING": rng.randint(1, 6, size=n_ratings),
+            "TIMESTAMP": 0,
+        }).drop_duplicates(["USER", "ITEM"])
+        n_pos = (df.RATING >= 4).sum()
+
+        start = time.perf_counter()
+        NegativeSamples(df, 4, ratio_neg_per_user=4)
+        elapsed = time.perf_counter() - start
+        print("{:>12} {:>10} {:>12.3f} {:>14.3f}".format(n_pos, n_users, elapsed, 1e6 * elapsed / n_pos))
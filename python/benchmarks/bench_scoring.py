@@ -0,0 +1,38 @@
+# Benchmark scoring the full catalog with keras predict against the FactorScorer
+#
+# Usage: python benchmarks/bench_scoring.py
+
+import time
+import numpy as np
+import pandas as pd
+from recoflow.models import ExplicitMatrixFactorisationBias
+from recoflow.recommend import GetFactorScorer, GetPredictions
+
+
+def _Timeit(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return time.perf_counter() - start, result
+
+
+if __name__ == "__main__":
+    print("{:>8} {:>8} {:>14} {:>14} {:>10} {:>10}".format(
+        "users", "items", "predict (s)", "scorer (s)", "speedup", "max diff"))
+    for n_users, n_items in [(100, 500), (943, 1682)]:
+        data = pd.DataFrame({
+            "USER": np.resize(np.arange(n_users), max(n_users, n_items)),
+            "ITEM": np.resize(np.arange(n_items), max(n_users, n_items)),
+        })
+        model = ExplicitMatrixFactorisationBias(n_users, n_items, 40, 1, 5)
+        scorer = GetFactorScorer(model, 1, 5)
+
+        keras_time, keras_pred = _Timeit(GetPredictions, model, data)
+        scorer_time, scorer_pred = _Timeit(GetPredictions, scorer, data)
+        # Dense scoring of the whole catalog in one matrix multiply
+        dense_time, _ = _Timeit(scorer.score, np.arange(n_users))
+
+        diff = np.abs(keras_pred.RATING.values - scorer_pred.RATING.values).max()
+        print("{:>8} {:>8} {:>14.4f} {:>14.4f} {:>9.0f}x {:>10.2e}".format(
+            n_users, n_items, keras_time, scorer_time, keras_time / scorer_time, diff))
+        print("{:>8} {:>8} {:>14} {:>14.4f} {:>9.0f}x   (dense score)".format(
+            "", "", "", dense_time, keras_time / dense_time))
@@ -0,0 +1,42 @@
+# Benchmark the blocked exact similarity engine against sklearn NearestNeighbors
+#
+# Usage: python benchmarks/bench_similar.py [max_items]
+
+import sys
+import time
+import numpy as np
+from sklearn.neighbors import NearestNeighbors
+from recoflow.recommend import GetSimilar
+
+
+def _NearestNeighborsSimilar(embedding, k):
+    model = NearestNeighbors(n_neighbors=k + 1, metric="cosine").fit(embedding)
+    return model.kneighbors(embedding)[1]
+
+
+def _Timeit(func, *args, **kwargs):
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    max_items = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    n_factors, k = 32, 10
+    rng = np.random.RandomState(42)
+
+    print("{:>10} {:>18} {:>14} {:>14}".format(
+        "items", "sklearn (s)", "blocked (s)", "4 threads (s)"))
+    for n_items in [1_000, 10_000, 50_000, 100_000, 1_000_000]:
+        if n_items > max_items:
+            break
+        embedding = rng.normal(size=(n_items, n_factors))
+        sklearn_time = (
+            _Timeit(_NearestNeighborsSimilar, embedding, k) if n_items <= 50_000 else float("nan")
+        )
+        print("{:>10} {:>18.3f} {:>14.3f} {:>14.3f}".format(
+            n_items,
+            sklearn_time,
+            _Timeit(GetSimilar, embedding, k),
+            _Timeit(GetSimilar, embedding, k, n_jobs=4),
+        ))
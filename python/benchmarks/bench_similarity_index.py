@@ -0,0 +1,21 @@
+# Benchmark the IVF SimilarityIndex against an exact search: recall and query time
+#
+# Usage: python benchmarks/bench_similarity_index.py [n_vectors]
+
+import sys
+import time
+import numpy as np
+from recoflow.recommend import SimilarityIndex
+
+
+if __name__ == "__main__":
+    n_vectors = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    n_factors, k = 32, 10
+    embedding = np.random.RandomState(42).normal(size=(n_vectors, n_factors))
+
+    start = time.perf_counter()
+    index = SimilarityIndex(metric="cosine").build(embedding)
+    print("build: {:.2f}s, {} lists".format(time.perf_counter() - start, index.n_lists))
+
+    report = index.recall(k=k, n_probe=[1, 4, 8, 16, 32, 64], n_sample=1000)
+    print(report.to_string(index=False))
@@ -0,0 +1,49 @@
+# Benchmark per-user top k selection against groupby.apply(nlargest)
+#
+# Usage: python benchmarks/bench_topk.py [max_users]
+
+import sys
+import time
+import numpy as np
+import pandas as pd
+from recoflow.utils import _GetTopKItems, _TopKDense
+
+
+def _NLargestTopKItems(df, col_user, col_rating, k):
+    top_k_items = (
+        df.groupby(col_user, as_index=False)
+        .apply(lambda x: x.nlargest(k, col_rating))
+        .reset_index(drop=True)
+    )
+    top_k_items["rank"] = top_k_items.groupby(col_user, sort=False).cumcount() + 1
+    return top_k_items
+
+
+def _Timeit(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    max_users = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    n_items, k = 50, 10
+    rng = np.random.RandomState(42)
+
+    print("{:>10} {:>14} {:>14} {:>14}".format(
+        "users", "nlargest (s)", "long (s)", "dense (s)"))
+    for n_users in [1_000, 10_000, 100_000, 1_000_000]:
+        if n_users > max_users:
+            break
+        scores = rng.rand(n_users, n_items).astype(np.float32)
+        df = pd.DataFrame({
+            "USER": np.repeat(np.arange(n_users, dtype=np.int32), n_items),
+            "ITEM": np.tile(np.arange(n_items, dtype=np.int16), n_users),
+            "RATING": scores.ravel(),
+        })
+
+        # The groupby.apply runs a python lambda per user, so only time it for small sizes
+        nlargest = _Timeit(_NLargestTopKItems, df, "USER", "RATING", k) if n_users <= 10_000 else np.nan
+        long = _Timeit(_GetTopKItems, df, "USER", "RATING", k)
+        dense = _Timeit(_TopKDense, scores, k)
+        print("{:>10} {:>14.4f} {:>14.4f} {:>14.4f}".format(n_users, nlargest, long, dense))
@@ -1,12 +1,34 @@
-from . import datasets
-from . import utils
-from . import preprocessing
-from . import recommend
-from . import models
-from . import metrics
-from . import vis
+import importlib
+
+# Submodules are imported when first used (e.g. `recoflow.metrics`), so that using
+# a metric or a splitter does not import keras, matplotlib or altair. `sequence` 
+# (a keras Sequence subclass) and `vis` still import them when they are imported
+_SUBMODULES = [
+    "datasets",
+    "utils",
+    "encoder",
+    "preprocessing",
+    "recommend",
+    "serving",
+    "models",
+    "sequence",
+    "metrics",
+    "vis",
+]
 
 __version__ = '0.0.7'
+__all__ = _SUBMODULES
+
+
+def __getattr__(name):
+    if name in _SUBMODULES:
+        return importlib.import_module("." + name, __name__)
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+def __dir__():
+    return sorted(list(globals()) + _SUBMODULES)
+
 
 if __name__ == "__main__":
     print("Welcome to RecoFlow")
@@ -4,11 +4,149 @@
 
 import numpy as np
 import pandas as pd
-import requests, zipfile, io
-from utils import create_directory
+import os, zipfile, io, warnings
 
 import typing
 
+MOVIELENS_100K_URL = "http://files.grouplens.org/datasets/movielens/ml-100k.zip"
+
+GENRE_COLS = [
+    "genre_unknown", "Action", "Adventure", "Animation", "Children", "Comedy",
+    "Crime", "Documentary", "Drama", "Fantasy", "FilmNoir", "Horror",
+    "Musical", "Mystery", "Romance", "SciFi", "Thriller", "War", "Western"
+]
+
+# Columns of the MovieLens files (see the ml-100k README)
+MOVIELENS_COLS = {
+    "users": ["user_id", "age", "sex", "occupation", "zip_code"],
+    "items": ["movie_id", "title", "release_date", "video_release_date", "imdb_url"] + GENRE_COLS,
+    "ratings": ["user_id", "movie_id", "rating", "unix_timestamp"],
+}
+
+MOVIELENS_FILES = {"users": ("u.user", "|"), "items": ("u.item", "|"), "ratings": ("u.data", "\t")}
+
+MOVIELENS_DTYPES = {
+    "users": {"user_id": "int32", "age": "int8", "sex": "category", "occupation": "category",
+              "zip_code": "category"},
+    "items": dict({"movie_id": "int32", "title": "object", "imdb_url": "object",
+                   "video_release_date": "float32"}, **{col: "int8" for col in GENRE_COLS}),
+    "ratings": {"user_id": "int32", "movie_id": "int32", "rating": "int8", "unix_timestamp": "int32"},
+}
+
+
+def _ReadMovieLensTable(data_dir, table):
+    """Parse a MovieLens table from the raw ml-100k files, or else from `data/*.csv.gz`"""
+    raw_name, sep = MOVIELENS_FILES[table]
+    raw_path = os.path.join(data_dir, "ml-100k", raw_name)
+    csv_path = os.path.join(data_dir, table + ".csv.gz")
+    
+    if os.path.exists(raw_path):
+        df = pd.read_csv(raw_path, sep=sep, names=MOVIELENS_COLS[table], encoding="latin-1")
+    elif os.path.exists(csv_path):
+        df = pd.read_csv(csv_path)
+    else:
+        raise FileNotFoundError("No MovieLens {} data in {}".format(table, data_dir))
+    
+    df = df.astype(MOVIELENS_DTYPES[table])
+    if table == "items":
+        df["release_date"] = pd.to_datetime(df.release_date, format="%d-%b-%Y")
+    return df
+
+
+def _CachePath(cache_dir, table, cache_format):
+    return os.path.join(cache_dir, "movielens_100k_{}.{}".format(table, cache_format))
+
+
+def _WriteCache(df, path, cache_format):
+    """Write a table to a Parquet or Feather file (needs pyarrow)"""
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+    
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if cache_format == "parquet":
+        pq.write_table(table, path)
+    else:
+        feather.write_feather(table, path)
+
+
+def _ReadCache(path, cache_format, columns=None, memory_map=True):
+    """Read a table from a Parquet or Feather file, with optional column projection"""
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+    
+    if cache_format == "parquet":
+        table = pq.read_table(path, columns=columns, memory_map=memory_map)
+    else:
+        table = feather.read_table(path, columns=columns, memory_map=memory_map)
+    return table.to_pandas()
+
+
+def DownloadMovieLens(data_dir="data", url=MOVIELENS_100K_URL):
+    """Download and extract ml-100k to `data_dir/ml-100k` (the only network access)"""
+    import requests
+    
+    response = requests.get(url, stream=True)
+    response.raise_for_status()
+    zipfile.ZipFile(io.BytesIO(response.content)).extractall(data_dir)
+
+
+def LoadMovieLens(data_dir="data", cache_dir=None, tables=("users", "items", "ratings"),
+                  columns=None, cache_format="parquet", memory_map=True, download=False):
+    """Load the MovieLens 100k users, items and ratings with compact dtypes
+    
+    The raw ml-100k files (or else the `*.csv.gz` files of `data_dir`) are parsed
+    once and cached as typed Parquet or Feather files (int32 ids, int8 ratings and 
+    genres, category for the demographics). Later loads read the cache, only the 
+    requested columns and memory-mapped. Without pyarrow, the files are parsed 
+    every time. It works offline: the data is only downloaded if `download`.
+
+    Params:
+        data_dir (string): Directory with `ml-100k/` or the `*.csv.gz` files
+        cache_dir (string): Directory of the cache. Defaults to `data_dir/cache`
+        tables (iterable of string): Tables to load among users, items and ratings
+        columns (dict): Columns to load for some tables, e.g. {"ratings": ["user_id"]}
+        cache_format (string): "parquet" or "feather"
+        memory_map (boolean): Whether to memory-map the cache files when reading them
+        download (boolean): Whether to download ml-100k if there is no local data
+    
+    Returns:
+        tuple of pd.DataFrame: The tables, in the order of `tables`
+    """
+    if cache_format not in ("parquet", "feather"):
+        raise ValueError("cache_format should be parquet or feather: " + str(cache_format))
+    cache_dir = os.path.join(data_dir, "cache") if cache_dir is None else cache_dir
+    columns = columns or {}
+    
+    try:
+        import pyarrow
+        has_pyarrow = True
+    except ImportError:
+        has_pyarrow = False
+        warnings.warn("pyarrow is not available: MovieLens files are parsed without a cache")
+    
+    dfs = []
+    for table in tables:
+        path = _CachePath(cache_dir, table, cache_format)
+        if has_pyarrow and os.path.exists(path):
+            dfs.append(_ReadCache(path, cache_format, columns.get(table), memory_map))
+            continue
+        
+        try:
+            df = _ReadMovieLensTable(data_dir, table)
+        except FileNotFoundError:
+            if not download:
+                raise
+            DownloadMovieLens(data_dir)
+            df = _ReadMovieLensTable(data_dir, table)
+        
+        if has_pyarrow:
+            os.makedirs(cache_dir, exist_ok=True)
+            _WriteCache(df, path, cache_format)
+        dfs.append(df[columns[table]] if table in columns else df)
+    
+    return tuple(dfs)
+
 
 
 
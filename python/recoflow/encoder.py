@@ -9,4 +9,175 @@
 # - Text (Tokenizer, Spacy) - Timeseries (Session) # - Date
 # - Image
 # - Spatial (Lat + Lon, H3)
-# - Graph (later...)
\ No newline at end of file
+# - Graph (later...)
+
+import numpy as np
+
+
+def _SmallestIntDtype(values, min_dtype=np.int8):
+    """Get the smallest signed integer dtype which can hold the values
+    
+    Params:
+        values (np.array): Integer values (e.g. codes, encoded USER or ITEM, ratings)
+        min_dtype (np.dtype): Narrowest dtype returned (e.g. np.int16)
+
+    Returns:
+        np.dtype: int8, int16, int32 or int64, at least min_dtype (or the original 
+            dtype for non integer values)
+    """
+    values = np.asarray(values)
+    if values.dtype.kind not in "iu" or values.size == 0:
+        return values.dtype
+    
+    low, high = values.min(), values.max()
+    for dtype in (np.int8, np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if info.bits >= np.iinfo(min_dtype).bits and low >= info.min and high <= info.max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+def _ClassesArray(classes):
+    """Classes as an array saved without pickle: an object array (e.g. the classes of a 
+    LabelEncoder fitted on a pandas column) takes the dtype of its ids, so integer ids 
+    stay integers. Only mixed ids are saved as strings."""
+    classes = np.asarray(classes)
+    if classes.dtype == object:
+        classes = np.array(classes.tolist())
+        if classes.dtype == object:
+            classes = classes.astype(str)
+    return classes
+
+
+class IdEncoder:
+    """Encode ids (of users or items) as integer codes 0..n-1
+    
+    A drop-in replacement for `sklearn.preprocessing.LabelEncoder` (`fit`, `transform`,
+    `fit_transform`, `inverse_transform` and `classes_`) built on hash tables: 
+    `fit_transform` is a single `pd.factorize` pass, forward lookups go through one 
+    id -> code hash map (each distinct id of a batch is looked up once) and reverse 
+    lookups index `classes_`. New ids are appended with `partial_fit`, which extends 
+    the hash map in place, so the codes of known ids never change and growing the 
+    vocabulary chunk by chunk costs only the new ids. Codes use the smallest integer 
+    dtype for the number of classes. pandas is only imported to fit, or to transform 
+    large batches, so a loaded encoder serves requests with numpy only.
+
+    Params:
+        sort (boolean): If True, the first fit sorts the classes (as LabelEncoder).
+            Otherwise they are in order of appearance.
+    """
+
+    def __init__(self, sort=True):
+        self.sort = sort
+        self._classes = []
+        self._n_classes = 0
+        self._lookup = None
+
+    def __len__(self):
+        return self._n_classes
+
+    @property
+    def classes_(self):
+        """Classes (ids) in the order of their codes"""
+        if not self._classes:
+            return None
+        # partial_fit appends segments, joined when the classes are read
+        if len(self._classes) > 1:
+            self._classes = [np.concatenate(self._classes)]
+        return self._classes[0]
+
+    @classes_.setter
+    def classes_(self, classes):
+        self._SetClasses(classes)
+
+    @property
+    def dtype(self):
+        """dtype of the codes"""
+        # Codes go from -1 (unseen ids) to n_classes - 1
+        return _SmallestIntDtype([-1, len(self)], np.int16)
+
+    def _SetClasses(self, classes):
+        classes = np.asarray(classes)
+        self._classes = [classes]
+        self._n_classes = len(classes)
+        self._lookup = None
+
+    def _BuildLookup(self):
+        """Hash map of id -> code of all the classes"""
+        return dict(zip(self.classes_.tolist(), range(len(self))))
+
+    def _Lookup(self):
+        """Hash map of id -> code, built when first needed and then extended by `partial_fit`"""
+        if self._lookup is None:
+            self._lookup = self._BuildLookup()
+        return self._lookup
+
+    def _Codes(self, values):
+        """Codes of the ids (-1 for unseen ids), with one hash lookup per distinct id"""
+        values = np.asarray(values)
+        # Small batches (e.g. requests) are deduplicated with numpy, without pandas
+        if values.dtype == object or len(values) > 100000:
+            import pandas as pd
+            inverse, uniques = pd.factorize(values)
+        else:
+            uniques, inverse = np.unique(values, return_inverse=True)
+        lookup = self._Lookup()
+        codes = np.fromiter((lookup.get(v, -1) for v in uniques.tolist()), dtype=np.int64, count=len(uniques))
+        # Missing values have inverse -1, which picks the trailing -1
+        return np.append(codes, -1)[inverse]
+
+    def fit(self, values):
+        """Fit the encoder on the ids"""
+        self.fit_transform(values)
+        return self
+
+    def fit_transform(self, values):
+        """Fit the encoder on the ids and return their codes"""
+        import pandas as pd
+        
+        codes, classes = pd.factorize(np.asarray(values), sort=self.sort)
+        self._SetClasses(classes)
+        return codes.astype(self.dtype, copy=False)
+
+    def partial_fit(self, values):
+        """Add the new ids (in order of appearance), keeping the codes of known ids"""
+        if self.classes_ is None:
+            return self.fit(values)
+        
+        import pandas as pd
+        
+        uniques = pd.factorize(np.asarray(values))[1]
+        lookup = self._Lookup()
+        new = uniques[np.fromiter((v not in lookup for v in uniques.tolist()), dtype=bool, count=len(uniques))]
+        if len(new):
+            lookup.update(zip(new.tolist(), range(len(self), len(self) + len(new))))
+            self._classes.append(new)
+            self._n_classes += len(new)
+        return self
+
+    def transform(self, values):
+        """Get the codes of the ids
+        
+        Raises:
+            ValueError: If some ids have not been fitted
+        """
+        codes = self._Codes(values)
+        if (codes < 0).any():
+            unseen = np.asarray(values)[codes < 0]
+            raise ValueError("values contain previously unseen labels: " + str(unseen[:10]))
+        return codes.astype(self.dtype, copy=False)
+
+    def inverse_transform(self, codes):
+        """Get the ids of the codes"""
+        return self.classes_[np.asarray(codes)]
+
+    def save(self, path):
+        """Save the classes to a .npy file"""
+        np.save(path, _ClassesArray(self.classes_), allow_pickle=False)
+
+    @classmethod
+    def load(cls, path, mmap=False):
+        """Load an encoder saved with `save` (memory-mapping the classes if mmap)"""
+        encoder = cls()
+        encoder._SetClasses(np.load(path, mmap_mode="r" if mmap else None, allow_pickle=False))
+        return encoder
@@ -1,11 +1,12 @@
 import numpy as np
 import pandas as pd
-from sklearn.metrics import mean_squared_error, mean_absolute_error
+from .preprocessing import InteractionMatrix
 from .utils import (
     _UserItemCrossJoin,
     _FilterBy,
     _GetTopKItems,
     _GetHitDF,
+    _GetHitMatrix,
     _MergeRatingTruePred,
 )
 
@@ -20,6 +21,7 @@ def MeanSquaredError(rating_true, rating_pred):
   Returns:
   float: Mean Squared Error
   """
+    from sklearn.metrics import mean_squared_error
 
     y_true, y_pred = _MergeRatingTruePred(
         rating_true=rating_true, rating_pred=rating_pred
@@ -38,6 +40,7 @@ def RootMeanSquaredError(rating_true, rating_pred):
   Returns:
   float: Root Mean Squared Error
   """
+    from sklearn.metrics import mean_squared_error
 
     y_true, y_pred = _MergeRatingTruePred(
         rating_true=rating_true, rating_pred=rating_pred
@@ -56,6 +59,7 @@ def MeanAbsoluteError(rating_true, rating_pred):
   Returns:
   float: Mean Absolute Error
   """
+    from sklearn.metrics import mean_absolute_error
 
     y_true, y_pred = _MergeRatingTruePred(
         rating_true=rating_true, rating_pred=rating_pred
@@ -104,36 +108,70 @@ def RecallK(rating_true, rating_pred, k=5):
     return (df_hit_count["hit"] / df_hit_count["actual"]).sum() / n_users
 
 
-def NDCGK(rating_true, rating_pred, k=5):
+def _IDCGTable(k):
+    """Get the ideal discounted cumulative gain for 0 to k relevant items
+    
+    Params:
+    k (int): Number of items presented
+
+    Returns:
+    np.array: Cumulative discount of length k + 1, indexed by min(actual, k)
+    """
+    return np.r_[0, np.cumsum(1 / np.log1p(np.arange(1, k + 1)))]
+
+
+def _GradedIDCG(rating_true, rating_pred, k):
+    """Get the ideal discounted cumulative gain, with the true RATING as the gain
+    
+    Params:
+    rating_true (pd.DataFrame): Ground Truth Ratings. There should be no duplicate
+    rating_pred (pd.DataFrame): Predicated Ratings.
+    k (int): Number of items presented
+
+    Returns:
+    np.array: Ideal DCG for each user in both rating_true and rating_pred (sorted by USER)
+    """
+    if isinstance(rating_true, InteractionMatrix):
+        rating_true = rating_true.to_df()
+    
+    rating_true_common = rating_true[rating_true["USER"].isin(rating_pred["USER"].unique())]
+    
+    # The ideal ranking presents the items with the highest true rating first
+    df_ideal = _GetTopKItems(rating_true_common, "USER", "RATING", k)
+    users, user_index = np.unique(df_ideal["USER"].values, return_inverse=True)
+    gain = df_ideal["RATING"].values / np.log1p(df_ideal["rank"].values)
+    
+    return np.bincount(user_index, weights=gain, minlength=len(users))
+
+
+def NDCGK(rating_true, rating_pred, k=5, graded=False):
     """Calculate NDCG at K
     
     Params:
     rating_true (pd.DataFrame): Ground Truth Ratings. There should be no duplicate
     rating_pred (pd.DataFrame): Predicated Ratings.
     k (int): Number of items presented
+    graded (boolean): If True, the true RATING is the gain of a hit. Else the gain is 1.
 
     Returns:
     float: NDCG at K
     """
-    df_hit, df_hit_count, n_users = _GetHitDF(rating_true, rating_pred, k)
+    hits, actual, n_users = _GetHitMatrix(rating_true, rating_pred, k, gain=graded)
 
-    if df_hit.shape[0] == 0:
+    if not hits.any():
         return 0.0
 
-    # calculate discounted gain for hit items
-    df_dcg = df_hit.copy()
-    # relevance in this case is always 1
-    df_dcg["dcg"] = 1 / np.log1p(df_dcg["rank"])
-    # sum up discount gained to get discount cumulative gain
-    df_dcg = df_dcg.groupby("USER", as_index=False, sort=False).agg({"dcg": "sum"})
+    # calculate discounted cumulative gain over the ranks
+    dcg = (hits / np.log1p(np.arange(1, k + 1))).sum(axis=1)
+    
     # calculate ideal discounted cumulative gain
-    df_ndcg = pd.merge(df_dcg, df_hit_count, on=["USER"])
-    df_ndcg["idcg"] = df_ndcg["actual"].apply(
-        lambda x: sum(1 / np.log1p(range(1, min(x, k) + 1)))
-    )
+    if graded:
+        idcg = _GradedIDCG(rating_true, rating_pred, k)
+    else:
+        idcg = _IDCGTable(k)[np.minimum(actual, k)]
 
     # DCG over IDCG is the normalized DCG
-    return (df_ndcg["dcg"] / df_ndcg["idcg"]).sum() / n_users
+    return (dcg / idcg).sum() / n_users
 
 
 def MeanAveragePrecisionK(rating_true, rating_pred, k=5):
@@ -216,33 +254,70 @@ def RatingMetrics(rating_true, rating_pred):
     return rating_metrics
 
 
+def _RankingMetricsFromHits(hits, actual, n_users, k):
+    """Calculate all ranking metrics at K from the hit matrix
+    
+    Params:
+    hits (np.array): Boolean hit matrix (n_users, >= k), see `_GetHitMatrix`
+    actual (np.array): Number of relevant items for each user
+    n_users (int): Number of users
+    k (int): Number of items presented
+    
+    Returns:
+    dict: Precision, Recall, MAP, MRR and NDCG at K
+    """
+    if n_users == 0 or not hits[:, :k].any():
+        return {"Precision": 0.0, "Recall": 0.0, "MAP": 0.0, "MRR": 0.0, "NDCG": 0.0}
+    
+    hits = hits[:, :k]
+    rank = np.arange(1, k + 1)
+    hit_count = hits.sum(axis=1)
+    
+    # Reciprocal rank of each hit: number of hits so far over the rank
+    r_rank = (np.cumsum(hits, axis=1) / rank * hits).sum(axis=1)
+    
+    # Discounted cumulative gain (relevance is always 1) and the ideal one
+    dcg = (hits / np.log1p(rank)).sum(axis=1)
+    idcg = _IDCGTable(k)[np.minimum(actual, k)]
+    
+    return {
+        "Precision": (hit_count / k).sum() / n_users,
+        "Recall": (hit_count / actual).sum() / n_users,
+        "MAP": (r_rank / actual).sum() / n_users,
+        "MRR": r_rank.sum() / (n_users * k),
+        "NDCG": (dcg / idcg).sum() / n_users,
+    }
+
+
 def RankingMetrics(rating_true, rating_pred, k=5):
     """Get all rating metrics
     
+    The hit matrix is computed once (for the largest k) and all the metrics are 
+    derived from it.
+    
     Params:
     rating_true (pd.DataFrame): Ground Truth Ratings. There should be no duplicate
     rating_pred (pd.DataFrame): Predicated Ratings.
-    k (int): Number of items presented
+    k (int or list of int): Number of items presented, e.g. 5 or [1, 5, 10, 20]
     
     Returns:
-    ranking_metrics (pd.DataFrame): Ranking metrics MAE, MSE, RMSE
+    ranking_metrics (pd.DataFrame): Ranking metrics Precision, Recall, MAP, MRR, NDCG (a row for each k)
     """
-
-    Precision = PrecisionK(rating_true, rating_pred, k)
-    Recall = RecallK(rating_true, rating_pred, k)
-    MAP = MeanAveragePrecisionK(rating_true, rating_pred, k)
-    MRR = MeanReciprocalRankK(rating_true, rating_pred, k)
-    NDCG = NDCGK(rating_true, rating_pred, k)
-
-    ranking_metrics = pd.DataFrame(
-        {
-            "k": [k],
-            "Precision@k": [float("{0:.4f}".format(Precision))],
-            "Recall@k": [float("{0:.4f}".format(Recall))],
-            "MAP@k": [float("{0:.4f}".format(MAP))],
-            "MRR@k": [float("{0:.4f}".format(MRR))],
-            "NDCG@k": [float("{0:.4f}".format(NDCG))],
-        }
-    )
+    ks = [k] if np.isscalar(k) else list(k)
+    hits, actual, n_users = _GetHitMatrix(rating_true, rating_pred, max(ks))
+
+    rows = []
+    for top_k in ks:
+        metrics = _RankingMetricsFromHits(hits, actual, n_users, top_k)
+        rows.append({
+            "k": top_k,
+            "Precision@k": float("{0:.4f}".format(metrics["Precision"])),
+            "Recall@k": float("{0:.4f}".format(metrics["Recall"])),
+            "MAP@k": float("{0:.4f}".format(metrics["MAP"])),
+            "MRR@k": float("{0:.4f}".format(metrics["MRR"])),
+            "NDCG@k": float("{0:.4f}".format(metrics["NDCG"])),
+        })
+
+    ranking_metrics = pd.DataFrame(rows)
 
     return ranking_metrics
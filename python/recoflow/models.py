@@ -1,12 +1,19 @@
-from keras.models import Model
-from keras.layers import Input, Embedding, Flatten, Dot, Add, Lambda
-from keras.layers import Activation, Reshape, Concatenate, Dense, Dropout
-from keras.regularizers import l2
-from keras.constraints import non_neg
-from keras.optimizers import Adam
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+from .utils import _FoldInFactors, _InverseRescale
+from .preprocessing import InteractionMatrix
+from .recommend import FactorScorer
 
 
 def ExplicitMatrixFactorisation(n_users, n_items, n_factors):
+    from keras.models import Model
+    from keras.layers import Input, Embedding, Flatten, Dot
+    from keras.regularizers import l2
+    from keras.optimizers import Adam
 
     # Item Layer
     item_input = Input(shape=[1], name="Item")
@@ -37,6 +44,10 @@ def ExplicitMatrixFactorisation(n_users, n_items, n_factors):
 def ExplicitMatrixFactorisationBias(
     n_users, n_items, n_factors, min_rating, max_rating
 ):
+    from keras.models import Model
+    from keras.layers import Input, Embedding, Flatten, Dot, Add, Lambda, Activation
+    from keras.regularizers import l2
+    from keras.optimizers import Adam
 
     # Item Layer
     item_input = Input(shape=[1], name="Item")
@@ -84,6 +95,11 @@ def ExplicitMatrixFactorisationBias(
 
 
 def DeepMatrixFactorisation(n_users, n_items, n_factors, min_rating, max_rating):
+    from keras.models import Model
+    from keras.layers import Input, Embedding, Flatten, Add, Lambda, Activation
+    from keras.layers import Concatenate, Dense, Dropout
+    from keras.regularizers import l2
+    from keras.optimizers import Adam
 
     # Item Layer
     item_input = Input(shape=[1], name="Item")
@@ -154,6 +170,10 @@ def DeepMatrixFactorisation(n_users, n_items, n_factors, min_rating, max_rating)
 
 
 def NeuralCollaborativeFiltering(n_users, n_items, n_factors, min_rating, max_rating):
+    from keras.models import Model
+    from keras.layers import Input, Embedding, Flatten, Dot, Add, Lambda, Activation
+    from keras.layers import Concatenate, Dense
+    from keras.regularizers import l2
 
     # Item Layer
     item_input = Input(shape=[1], name="Item")
@@ -243,3 +263,544 @@ def NeuralCollaborativeFiltering(n_users, n_items, n_factors, min_rating, max_ra
     model.compile(loss="mean_squared_error", optimizer="adam")
 
     return model
+
+
+# Builder and whether it needs min_rating and max_rating, by model name
+_BUILDERS = {
+    "ExplicitMatrixFactorisation": (ExplicitMatrixFactorisation, False),
+    "ExplicitMatrixFactorisationBias": (ExplicitMatrixFactorisationBias, True),
+    "DeepFM": (DeepMatrixFactorisation, True),
+    "NeuralCF": (NeuralCollaborativeFiltering, True),
+}
+
+
+def _NewRows(weights, n_rows, init):
+    """Grow an embedding matrix to n_rows, new rows at the mean or 0"""
+    new_rows = np.zeros((n_rows - weights.shape[0], weights.shape[1]), dtype=weights.dtype)
+    if init != "zeros":
+        new_rows += weights.mean(axis=0)
+    return np.vstack([weights, new_rows])
+
+
+def _FoldIn(weights, interactions, n_old_users, n_old_items, min_rating, max_rating, reg):
+    """Solve the new user and item rows of a dot product model (with biases or not)
+    
+    The new users are solved against the old items, then the new items against all 
+    the users. Rows without interactions cannot be solved: they keep their mean 
+    initialisation, with a warning.
+    """
+    has_bias = "UserBias" in weights
+    users = interactions.USER.values
+    items = interactions.ITEM.values
+    targets = interactions.RATING.values.astype(np.float64)
+    if has_bias:
+        # Invert the sigmoid rescaling, and fit the bias with a constant factor
+        targets = _InverseRescale(targets, min_rating, max_rating)
+    
+    sides = [
+        ("User", users, n_old_users, "Item", items, n_old_items),
+        ("Item", items, n_old_items, "User", users, None),
+    ]
+    for name, rows, n_old, fixed_name, cols, n_fixed in sides:
+        embedding = weights[name + "Embedding"]
+        new = rows >= n_old
+        if n_fixed is not None:
+            new &= cols < n_fixed
+        n_new = embedding.shape[0] - n_old
+        n_missing = n_new - len(np.unique(rows[new]))
+        if n_missing:
+            warnings.warn("{} new {} rows have no interactions to fold in: they keep the mean of the "
+                          "trained rows".format(n_missing, name.lower()))
+        if not new.any():
+            continue
+        
+        fixed = weights[fixed_name + "Embedding"]
+        target = targets[new]
+        if has_bias:
+            fixed = np.hstack([fixed, np.ones((len(fixed), 1))])
+            target = target - weights[fixed_name + "Bias"][cols[new], 0]
+        
+        factors, counts = _FoldInFactors(fixed, rows[new] - n_old, cols[new], target, n_new, reg)
+        solved = n_old + np.flatnonzero(counts)
+        factors = factors[counts > 0]
+        if has_bias:
+            weights[name + "Bias"][solved, 0] = factors[:, -1]
+            factors = factors[:, :-1]
+        embedding[solved] = factors
+
+
+def GrowModel(model, n_users, n_items, min_rating=None, max_rating=None, init="mean",
+              interactions=None, epochs=0, batch_size=64, reg=0.1, verbose=0):
+    """Grow a trained model for new users and items, without training it from scratch
+    
+    The model is rebuilt with the larger number of users and items, all the trained 
+    weights are copied, and the rows of the new users and items are initialised. New
+    ids are expected at the end of the codes, as given by `IdEncoder.partial_fit`.
+
+    Params:
+        model (keras model): Trained model built by one of the builders of this module
+        n_users (int): New number of users (at least the current one)
+        n_items (int): New number of items (at least the current one)
+        min_rating (float): Minimum rating used to build the model (if it needs one)
+        max_rating (float): Maximum rating used to build the model (if it needs one)
+        init (string): "mean" of the trained rows, "zeros", or "fold_in" to solve the 
+            new rows by least squares against the fixed trained factors (for the 
+            dot product models, with the rest at the mean). New users and items
+            without interactions are left at the mean, with a warning.
+        interactions (pd.DataFrame): New interactions (USER, ITEM, RATING), used by
+            "fold_in" and to fine-tune
+        epochs (int): Number of epochs to fine-tune the model on the new interactions
+        batch_size (int): Batch size to fine-tune the model
+        reg (float): L2 regularisation of the fold-in
+        verbose (int): Verbosity to fine-tune the model
+    
+    Returns:
+        keras model: The grown model
+    """
+    if model.name not in _BUILDERS:
+        raise ValueError("Unknown model: " + model.name)
+    builder, needs_range = _BUILDERS[model.name]
+    if needs_range and (min_rating is None or max_rating is None):
+        raise ValueError("min_rating and max_rating are needed to rebuild " + model.name)
+    if init not in ("mean", "zeros", "fold_in"):
+        raise ValueError("init should be mean, zeros or fold_in: " + str(init))
+    
+    weights = {layer.name: layer.get_weights() for layer in model.layers if layer.get_weights()}
+    user_layer = "UserEmbedding" if "UserEmbedding" in weights else "UserEmbeddingMF"
+    n_old_users, n_factors = weights[user_layer][0].shape
+    n_old_items = weights[user_layer.replace("User", "Item")][0].shape[0]
+    if n_users < n_old_users or n_items < n_old_items:
+        raise ValueError("The model can only grow")
+    
+    # Copy the weights and add the new rows
+    for name, layer_weights in weights.items():
+        if name.startswith("User"):
+            weights[name] = [_NewRows(layer_weights[0], n_users, init)]
+        elif name.startswith("Item"):
+            weights[name] = [_NewRows(layer_weights[0], n_items, init)]
+    
+    layer_names = [layer.name for layer in model.layers]
+    if init == "fold_in" and interactions is not None and "DotProduct" in layer_names:
+        embeddings = {name: layer_weights[0] for name, layer_weights in weights.items()
+                      if name.startswith(("User", "Item"))}
+        _FoldIn(embeddings, interactions, n_old_users, n_old_items, min_rating, max_rating, reg)
+    
+    args = (n_users, n_items, n_factors) + ((min_rating, max_rating) if needs_range else ())
+    grown = builder(*args)
+    for name, layer_weights in weights.items():
+        grown.get_layer(name).set_weights(layer_weights)
+    
+    if epochs > 0 and interactions is not None:
+        grown.fit(
+            [interactions.USER.values, interactions.ITEM.values], interactions.RATING.values,
+            epochs=epochs, batch_size=batch_size, verbose=verbose,
+        )
+    
+    return grown
+
+
+def _ALSSolve(R, X, Y, reg, implicit, alpha, cg_steps, block_size, n_jobs):
+    """Update the factors X of the rows of R in place, with the factors Y fixed
+    
+    Every row solves (Y'C Y + reg I) x = Y'C p with a few conjugate gradient steps 
+    started from its current factors. A block of rows is solved at once: the product
+    of the block with A is a sparse (block x n_cols) times dense (n_cols x f) product.
+    """
+    n_rows = R.shape[0]
+    YtY = np.dot(Y.T, Y) if implicit else None
+    
+    def _Block(start):
+        block = R[start : start + block_size]
+        indptr, indices, ratings = block.indptr, block.indices, block.data
+        nz_rows = np.repeat(np.arange(block.shape[0]), np.diff(indptr))
+        V = Y[indices]
+        
+        if implicit:
+            # Confidence c = 1 + alpha * r: YtY covers the 1, the interactions the rest
+            weights = alpha * ratings
+            b = sp.csr_matrix((1 + weights, indices, indptr), shape=block.shape).dot(Y)
+        else:
+            weights = np.ones_like(ratings)
+            b = block.dot(Y)
+        
+        def _A(x):
+            d = np.einsum("ij,ij->i", V, x[nz_rows]) * weights
+            Ax = sp.csr_matrix((d, indices, indptr), shape=block.shape).dot(Y) + reg * x
+            if implicit:
+                Ax += np.dot(x, YtY)
+            return Ax
+        
+        x = X[start : start + block_size].copy()
+        r = b - _A(x)
+        p = r.copy()
+        rs_old = np.einsum("ij,ij->i", r, r)
+        for _ in range(cg_steps):
+            if rs_old.max() < 1e-12:
+                break
+            Ap = _A(p)
+            pAp = np.einsum("ij,ij->i", p, Ap)
+            step = np.where(pAp > 0, rs_old / np.where(pAp > 0, pAp, 1), 0)
+            x += step[:, None] * p
+            r -= step[:, None] * Ap
+            rs_new = np.einsum("ij,ij->i", r, r)
+            p = r + np.where(rs_old > 0, rs_new / np.where(rs_old > 0, rs_old, 1), 0)[:, None] * p
+            rs_old = rs_new
+        X[start : start + block_size] = x
+    
+    starts = range(0, n_rows, block_size)
+    if n_jobs > 1:
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            list(executor.map(_Block, starts))
+    else:
+        for start in starts:
+            _Block(start)
+
+
+def AlternatingLeastSquares(interactions, n_factors=10, reg=0.1, n_iter=10, implicit=False,
+                            alpha=40.0, cg_steps=3, block_size=4096, n_jobs=1, seed=42, verbose=0):
+    """Train a matrix factorisation by alternating least squares
+    
+    Explicit ALS fits the ratings of the interactions. Implicit ALS (Hu, Koren & 
+    Volinsky) fits a preference of 1 for the interactions and 0 elsewhere, with a 
+    confidence of 1 + alpha * rating. Users and items are solved in turn with a 
+    conjugate gradient, by blocks of rows which can run on a thread pool.
+
+    Params:
+        interactions (InteractionMatrix or pd.DataFrame): Encoded USER, ITEM, RATING
+        n_factors (int): Number of factors
+        reg (float): L2 regularisation
+        n_iter (int): Number of passes over users and items
+        implicit (boolean): Whether to train an implicit feedback model
+        alpha (float): Confidence scale of implicit ALS
+        cg_steps (int): Conjugate gradient steps per solve
+        block_size (int): Rows solved together
+        n_jobs (int): Number of threads
+        seed (int): Random seed of the initial factors
+        verbose (int): If 1, print the training RMSE (explicit ALS) after each pass
+    
+    Returns:
+        FactorScorer: Scorer with the UserEmbedding and ItemEmbedding, usable with
+            `GetRankingTopK`, `GetSimilar`, `UserEmbedding` and `ItemEmbedding`
+    """
+    if not isinstance(interactions, InteractionMatrix):
+        interactions = InteractionMatrix.from_df(interactions)
+    R = interactions.csr.astype(np.float32)
+    RT = R.T.tocsr()
+    
+    rng = np.random.RandomState(seed)
+    X = rng.normal(scale=0.1, size=(R.shape[0], n_factors)).astype(np.float32)
+    Y = rng.normal(scale=0.1, size=(R.shape[1], n_factors)).astype(np.float32)
+    
+    for iteration in range(n_iter):
+        _ALSSolve(R, X, Y, reg, implicit, alpha, cg_steps, block_size, n_jobs)
+        _ALSSolve(RT, Y, X, reg, implicit, alpha, cg_steps, block_size, n_jobs)
+        
+        if verbose and not implicit:
+            users = np.repeat(np.arange(R.shape[0]), np.diff(R.indptr))
+            errors = np.einsum("ij,ij->i", X[users], Y[R.indices]) - R.data
+            print("Iteration {}: RMSE {:.4f}".format(iteration + 1, np.sqrt(np.mean(errors ** 2))))
+    
+    return FactorScorer(X, Y, name="AlternatingLeastSquares")
+
+
+def _SparseTopK(S, k):
+    """Keep the k largest values of every row of a CSR matrix (ties by column)"""
+    S = S.tocsr()
+    S.sort_indices()
+    rows = np.repeat(np.arange(S.shape[0]), np.diff(S.indptr))
+    order = np.lexsort((S.indices, -S.data, rows))
+    rank = np.arange(len(order)) - S.indptr[rows[order]]
+    keep = np.sort(order[rank < k])
+    
+    return sp.csr_matrix(
+        (S.data[keep], S.indices[keep], np.r_[0, np.cumsum(np.bincount(rows[keep], minlength=S.shape[0]))]),
+        shape=S.shape,
+    )
+
+
+class SARScorer:
+    """Score users and items with Smart Adaptive Recommendations (SAR)
+    
+    The score of a user for an item is the affinity of the user to the items (their
+    possibly time decayed ratings) times the similarity of these items to the item.
+
+    Params:
+        affinity (scipy.sparse.csr_matrix): User x item affinity (n_users, n_items)
+        similarity (scipy.sparse.csr_matrix): Item x item similarity (n_items, n_items)
+    """
+
+    def __init__(self, affinity, similarity):
+        self.affinity = affinity
+        self.similarity = similarity
+        self.name = "SAR"
+
+    @property
+    def n_users(self):
+        return self.affinity.shape[0]
+
+    @property
+    def n_items(self):
+        return self.similarity.shape[0]
+
+    def score(self, users, items=None):
+        """Score every user in users against every item in items
+        
+        Returns:
+            np.array: Matrix of scores with shape (len(users), len(items))
+        """
+        similarity = self.similarity if items is None else self.similarity[:, np.asarray(items)]
+        scores = self.affinity[np.asarray(users)].dot(similarity)
+        return scores.toarray()
+
+    def predict(self, X, block_size=None, **kwargs):
+        """Score (user, item) pairs, with the same inputs and output as `model.predict`
+        
+        Every distinct user is scored once against all the items (a block of users at 
+        a time, as in `score`), then the scores of the requested items are picked.
+        """
+        users, items = np.asarray(X[0]), np.asarray(X[1])
+        unique_users, inverse = np.unique(users, return_inverse=True)
+        block_size = block_size or max(1, 2 ** 22 // self.n_items)
+        
+        # Pairs grouped by user, so a block of users is a range of pairs
+        order = np.argsort(inverse, kind="stable")
+        sorted_inverse = inverse[order]
+        scores = np.empty(len(users), dtype=np.float32)
+        for start in range(0, len(unique_users), block_size):
+            block_scores = self.score(unique_users[start : start + block_size])
+            low, high = np.searchsorted(sorted_inverse, [start, start + block_size])
+            pairs = order[low:high]
+            scores[pairs] = block_scores[inverse[pairs] - start, items[pairs]]
+        return scores.reshape(-1, 1)
+
+
+def SAR(interactions, similarity="jaccard", time_decay=None, k=None, threshold=1,
+        n_users=None, n_items=None):
+    """Build a SAR item-item recommender (no training)
+    
+    The item co-occurrence matrix is the sparse product X'X of the binary user x 
+    item matrix, normalised to a similarity. Users are scored with `SARScorer`.
+
+    Params:
+        interactions (pd.DataFrame): Encoded USER, ITEM, RATING (and TIMESTAMP)
+        similarity (string): "cooccurrence", "jaccard" or "lift"
+        time_decay (float): Half-life (in TIMESTAMP units) of the affinity of a rating, 
+            counted back from the latest TIMESTAMP. If None, there is no decay.
+        k (int): If given, keep only the k most similar items of each item
+        threshold (int): Minimum co-occurrence count of a pair of items
+        n_users (int): Number of users. Defaults to the largest USER + 1
+        n_items (int): Number of items. Defaults to the largest ITEM + 1
+    
+    Returns:
+        SARScorer: Scorer usable with `GetRankingTopK` and `metrics.RankingMetrics`
+    """
+    if similarity not in ("cooccurrence", "jaccard", "lift"):
+        raise ValueError("similarity should be cooccurrence, jaccard or lift: " + str(similarity))
+    
+    users = interactions.USER.values.astype(np.int64)
+    items = interactions.ITEM.values.astype(np.int64)
+    n_users = users.max() + 1 if n_users is None else n_users
+    n_items = items.max() + 1 if n_items is None else n_items
+    
+    # Affinity: sum of the (decayed) ratings of each user and item
+    weights = interactions.RATING.values.astype(np.float64)
+    if time_decay is not None:
+        age = interactions.TIMESTAMP.values.max() - interactions.TIMESTAMP.values
+        weights = weights * np.power(0.5, age / time_decay)
+    affinity = sp.csr_matrix((weights, (users, items)), shape=(n_users, n_items), dtype=np.float32)
+    
+    # Co-occurrence of the items seen by the same users
+    seen = affinity.copy()
+    seen.data = np.ones_like(seen.data)
+    cooccurrence = seen.T.dot(seen).tocsr()
+    counts = cooccurrence.diagonal().astype(np.float64)
+    if threshold > 1:
+        cooccurrence.data[cooccurrence.data < threshold] = 0
+        cooccurrence.eliminate_zeros()
+    
+    # Normalise the counts of every pair (i, j)
+    S = cooccurrence.tocoo()
+    if similarity == "jaccard":
+        S.data = S.data / (counts[S.row] + counts[S.col] - S.data)
+    elif similarity == "lift":
+        S.data = S.data / (counts[S.row] * counts[S.col])
+    S = S.tocsr().astype(np.float32)
+    
+    if k is not None:
+        # Each item is scored from its k most similar items (S is symmetric)
+        S = _SparseTopK(S, k).T.tocsr()
+    
+    return SARScorer(affinity, S)
+
+
+class RankedScorer:
+    """Score items with a precomputed score per item, the same for all users (or for
+    each group of users)
+    
+    The items are ranked once, so the top k of a user are the first k unseen items
+    of its ranking (see `recommend`).
+
+    Params:
+        item_scores (np.array): Score of each item (n_items,), or of each item for 
+            each group of users (n_groups, n_items)
+        user_groups (np.array): Group of each user (n_users,), if item_scores has groups
+        name (string): Name of the baseline
+        default_group (int): Group of the users beyond user_groups (e.g. new users)
+    """
+
+    def __init__(self, item_scores, user_groups=None, name="Popularity", default_group=0):
+        self.item_scores = np.atleast_2d(np.asarray(item_scores, dtype=np.float32))
+        self.user_groups = None if user_groups is None else np.asarray(user_groups)
+        self.name = name
+        self.default_group = default_group
+        self.rankings = np.argsort(-self.item_scores, axis=1, kind="stable")
+
+    @property
+    def n_items(self):
+        return self.item_scores.shape[1]
+
+    def _Groups(self, users):
+        groups = np.full(len(users), self.default_group, dtype=np.int64)
+        if self.user_groups is not None:
+            known = users < len(self.user_groups)
+            groups[known] = self.user_groups[users[known]]
+        return groups
+
+    def score(self, users, items=None):
+        """Score every user in users against every item in items"""
+        scores = self.item_scores[self._Groups(np.asarray(users))]
+        return scores if items is None else scores[:, np.asarray(items)]
+
+    def predict(self, X, **kwargs):
+        """Score (user, item) pairs, with the same inputs and output as `model.predict`"""
+        users, items = np.asarray(X[0]), np.asarray(X[1])
+        return self.item_scores[self._Groups(users), items].reshape(-1, 1)
+
+    def recommend(self, train, k=5, users=None, block_size=10000):
+        """Get the top k unseen items of the users, from the precomputed rankings
+        
+        Params:
+            train (pd.DataFrame or InteractionMatrix): Seen interactions (USER, ITEM)
+            k (int): number of items for each user
+            users (np.array): USER ids. Defaults to all the users of train
+            block_size (int): number of users ranked together
+        
+        Returns:
+            pd.DataFrame: DataFrame of top k items for each user, sorted by USER and rank
+                (as `GetRankingTopK`)
+        """
+        if not isinstance(train, InteractionMatrix):
+            train = InteractionMatrix.from_df(train, n_items=self.n_items)
+        if users is None:
+            users = np.flatnonzero(np.diff(train.csr.indptr))
+        users = np.sort(np.asarray(users))
+        n_seen = np.zeros(len(users), dtype=np.int64)
+        known = users < train.n_users
+        n_seen[known] = np.diff(train.csr.indptr)[users[known]]
+        
+        ranking_topk = []
+        for start in range(0, len(users), block_size):
+            block_users = users[start : start + block_size]
+            groups = self._Groups(block_users)
+            
+            # The top k unseen items are within the first k + n_seen items of the ranking
+            width = min(self.n_items, k + n_seen[start : start + block_size].max())
+            candidates = self.rankings[groups, :width]
+            unseen = ~train.contains(np.repeat(block_users, width), candidates.ravel()).reshape(candidates.shape)
+            top_k = unseen & (np.cumsum(unseen, axis=1) <= k)
+            
+            items = candidates[top_k]
+            ranking_topk.append(pd.DataFrame({
+                "USER": np.repeat(block_users, top_k.sum(axis=1)),
+                "ITEM": items,
+                "RATING": self.item_scores[np.repeat(groups, top_k.sum(axis=1)), items],
+                "rank": np.cumsum(top_k, axis=1)[top_k],
+            }))
+        
+        return pd.concat(ranking_topk, ignore_index=True)
+
+
+def _ItemPopularity(interactions, n_items, time_decay=None):
+    """Number of interactions of each item, possibly with a time decay"""
+    weights = None
+    if time_decay is not None:
+        age = interactions.TIMESTAMP.values.max() - interactions.TIMESTAMP.values
+        weights = np.power(0.5, age / time_decay)
+    return np.bincount(interactions.ITEM.values, weights=weights, minlength=n_items)
+
+
+def Popularity(interactions, time_decay=None, n_items=None):
+    """Build a popularity baseline: items ranked by their number of interactions
+    
+    Params:
+        interactions (pd.DataFrame): Encoded USER, ITEM (and TIMESTAMP)
+        time_decay (float): Half-life (in TIMESTAMP units) of an interaction, counted 
+            back from the latest TIMESTAMP. If None, there is no decay.
+        n_items (int): Number of items. Defaults to the largest ITEM + 1
+    
+    Returns:
+        RankedScorer: Scorer usable with `GetRankingTopK`, with a fast `recommend`
+    """
+    n_items = interactions.ITEM.max() + 1 if n_items is None else n_items
+    return RankedScorer(_ItemPopularity(interactions, n_items, time_decay), name="Popularity")
+
+
+def GenrePopularity(interactions, genres, time_decay=None, n_users=None, n_items=None):
+    """Build a per genre popularity baseline
+    
+    Every user gets the items of its most frequent genre first, then the other items,
+    each ranked by popularity. Genres are counted one by one: an "Action|Thriller" 
+    item counts for both Action and Thriller, and is among the first items of the 
+    users whose most frequent genre is either. Users without genre interactions, or 
+    not seen in interactions, get the global popularity ranking.
+
+    Params:
+        interactions (pd.DataFrame): Encoded USER, ITEM (and TIMESTAMP)
+        genres (pd.DataFrame): ITEM and genre, the string of 0/1 genre flags (see 
+            `preprocessing.GetGenre`). Without a genre column, the genre_label of
+            each item is its only genre.
+        time_decay (float): Half-life (in TIMESTAMP units) of an interaction
+        n_users (int): Number of users. Defaults to the largest USER + 1
+        n_items (int): Number of items. Defaults to the largest ITEM + 1
+    
+    Returns:
+        RankedScorer: Scorer with one ranking per genre, and the global ranking
+    """
+    n_users = interactions.USER.max() + 1 if n_users is None else n_users
+    n_items = max(interactions.ITEM.max(), genres.ITEM.max()) + 1 if n_items is None else n_items
+    popularity = _ItemPopularity(interactions, n_items, time_decay)
+    
+    # Genre flags of each item (n_items, n_genres)
+    if "genre" in genres:
+        flags = np.array([list(genre) for genre in genres.genre.values]) == "1"
+    else:
+        labels = genres.genre_label.values
+        flags = labels[:, None] == np.arange(labels.max() + 1)
+    rows, n_genres = np.nonzero(flags), flags.shape[1]
+    item_genres = sp.csr_matrix(
+        (np.ones(len(rows[0])), (genres.ITEM.values[rows[0]], rows[1])), shape=(n_items, n_genres))
+    
+    # Most frequent genre of each user (ties to the first genre)
+    user_items = sp.csr_matrix(
+        (np.ones(len(interactions)), (interactions.USER.values, interactions.ITEM.values)), shape=(n_users, n_items))
+    counts = (user_items @ item_genres).toarray()
+    user_groups = np.where(counts.max(axis=1) > 0, counts.argmax(axis=1), n_genres)
+    
+    # Items of the genre first: they score above the most popular item. The last 
+    # group is the global popularity
+    item_scores = np.vstack([
+        popularity[None, :] + item_genres.T.toarray() * (popularity.max() + 1),
+        popularity[None, :],
+    ])
+    
+    return RankedScorer(item_scores, user_groups, name="GenrePopularity", default_group=n_genres)
+
+
+def RandomRecommender(n_items, seed=42):
+    """Build a random baseline: a random ranking of the items, the same for all users
+    
+    Returns:
+        RankedScorer: Scorer with random item scores
+    """
+    item_scores = np.random.RandomState(seed).permutation(n_items)
+    return RankedScorer(item_scores, name="Random")
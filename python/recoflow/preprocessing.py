@@ -1,9 +1,34 @@
 import numpy as np
 import pandas as pd
-from sklearn.preprocessing import LabelEncoder
+import scipy.sparse as sp
+import os, json, tempfile
+from .encoder import IdEncoder, _SmallestIntDtype
 
 
-def EncodeUserItem(df, user_col, item_col, rating_col, time_col):
+def _LeanDtype(values):
+    """Smallest safe dtype of a column: the smallest signed integer type for integers,
+    float32 for floats (other dtypes are kept)"""
+    values = np.asarray(values)
+    if values.dtype.kind == "f":
+        return np.dtype(np.float32)
+    return _SmallestIntDtype(values)
+
+
+def Downcast(df, columns=None):
+    """Function to downcast columns to their smallest safe dtype (see `_LeanDtype`)
+    
+    Params:
+        df (pd.DataFrame): Pandas data frame
+        columns (list of string): Columns to downcast. Defaults to all the columns.
+    
+    Returns:
+        pd.DataFrame: DataFrame with the downcast columns
+    """
+    columns = df.columns if columns is None else columns
+    return df.astype({col: _LeanDtype(df[col].values) for col in columns}, copy=False)
+
+
+def EncodeUserItem(df, user_col, item_col, rating_col, time_col, lean=False):
     """Function to encode users and items
     
     Params:     
@@ -12,29 +37,40 @@ def EncodeUserItem(df, user_col, item_col, rating_col, time_col):
         item_col (string): Name of the item column.
         rating_col (string): Name of the rating column.
         timestamp_col (string): Name of the timestamp column.
+        lean (boolean): If True, drop the raw user and item columns and downcast 
+            RATING and TIMESTAMP to their smallest safe dtypes. Only the kept columns
+            are copied.
     
     Returns: 
         encoded_df (pd.DataFrame): Modifed dataframe with the users and items index
         n_users (int): number of users
         n_items (int): number of items
-        user_encoder (sklearn.LabelEncoder): Encoder for users.
-        item_encoder (sklearn.LabelEncoder): Encoder for items.
+        user_encoder (IdEncoder): Encoder for users.
+        item_encoder (IdEncoder): Encoder for items.
     """
     
-    interaction = df.copy()
+    user_encoder = IdEncoder()
+    item_encoder = IdEncoder()
+    users = user_encoder.fit_transform(df[user_col].values)
+    items = item_encoder.fit_transform(df[item_col].values)
+    n_users = len(user_encoder)
+    n_items = len(item_encoder)
     
-    user_encoder = LabelEncoder()
-    user_encoder.fit(interaction[user_col].values)
-    n_users = len(user_encoder.classes_)
-    
-    item_encoder = LabelEncoder()
-    item_encoder.fit(interaction[item_col].values)
-    n_items = len(item_encoder.classes_)
-
-    interaction["USER"] = user_encoder.transform(interaction[user_col])
-    interaction["ITEM"] = item_encoder.transform(interaction[item_col])
-    
-    interaction.rename({rating_col: "RATING", time_col: "TIMESTAMP"}, axis=1, inplace=True)
+    if lean:
+        # Build the result from the kept columns only (RATING and TIMESTAMP already
+        # downcast), instead of copying the whole frame and dropping columns
+        names = {rating_col: "RATING", time_col: "TIMESTAMP"}
+        columns = {}
+        for col in df.columns.drop([user_col, item_col]):
+            values = df[col].values
+            if col in names:
+                values = values.astype(_LeanDtype(values), copy=False)
+            columns[names.get(col, col)] = values
+        columns.update(USER=users, ITEM=items)
+        interaction = pd.DataFrame(columns, index=df.index)
+    else:
+        interaction = df.assign(USER=users, ITEM=items)
+        interaction.rename({rating_col: "RATING", time_col: "TIMESTAMP"}, axis=1, inplace=True)
     
     print("Number of users: ", n_users)
     print("Number of items: ", n_items)
@@ -42,13 +78,143 @@ def EncodeUserItem(df, user_col, item_col, rating_col, time_col):
     return interaction, n_users, n_items, user_encoder, item_encoder
 
 
-def RandomSplit (df, ratios, shuffle=False):
+class InteractionMatrix:
+    """Sparse user x item interaction matrix
+    
+    Holds the interactions as a CSR matrix (rows are users) with int32 indices and
+    float32 ratings, and a CSC view (columns are items) built when first used.
+    
+    Params:
+        csr (scipy.sparse.csr_matrix): Interactions with sorted indices
+    """
+
+    def __init__(self, csr):
+        self.csr = csr
+        self._csc = None
+        self._keys = None
+
+    @classmethod
+    def from_df(cls, df, n_users=None, n_items=None, col_user="USER", col_item="ITEM", col_rating="RATING"):
+        """Build the interaction matrix from encoded interactions (see `EncodeUserItem`)
+        
+        Params:
+            df (pd.DataFrame): Interactions with encoded USER and ITEM
+            n_users (int): Number of users. Defaults to the largest USER + 1
+            n_items (int): Number of items. Defaults to the largest ITEM + 1
+            col_user (string): Name of the user column
+            col_item (string): Name of the item column
+            col_rating (string): Name of the rating column. If it is missing, the rating is 1.
+        
+        Returns:
+            InteractionMatrix: Interaction matrix of shape (n_users, n_items). For duplicate 
+                (user, item) pairs the last rating is kept.
+        """
+        df = df.drop_duplicates([col_user, col_item], keep="last")
+        users = df[col_user].values.astype(np.int64)
+        items = df[col_item].values.astype(np.int64)
+        if col_rating in df:
+            ratings = df[col_rating].values.astype(np.float32)
+        else:
+            ratings = np.ones(len(df), dtype=np.float32)
+        
+        n_users = users.max() + 1 if n_users is None else n_users
+        n_items = items.max() + 1 if n_items is None else n_items
+        
+        # Sort by user and item, which is the order of the CSR arrays
+        order = np.lexsort((items, users))
+        indptr = np.r_[0, np.cumsum(np.bincount(users, minlength=n_users))]
+        csr = sp.csr_matrix(
+            (ratings[order], items[order].astype(np.int32), indptr), shape=(n_users, n_items)
+        )
+        
+        return cls(csr)
+
+    @property
+    def shape(self):
+        return self.csr.shape
+
+    @property
+    def n_users(self):
+        return self.csr.shape[0]
+
+    @property
+    def n_items(self):
+        return self.csr.shape[1]
+
+    @property
+    def nnz(self):
+        return self.csr.nnz
+
+    @property
+    def csc(self):
+        """CSC view of the interactions, for per item lookups"""
+        if self._csc is None:
+            self._csc = self.csr.tocsc()
+        return self._csc
+
+    def seen(self, user):
+        """Get the items of a user (sorted)"""
+        return self.csr.indices[self.csr.indptr[user] : self.csr.indptr[user + 1]]
+
+    def ratings(self, user):
+        """Get the ratings of a user (in the order of `seen`)"""
+        return self.csr.data[self.csr.indptr[user] : self.csr.indptr[user + 1]]
+
+    def rows(self, users):
+        """Get the interaction matrix of a subset (or slice) of users"""
+        return InteractionMatrix(self.csr[users])
+
+    def keys(self):
+        """Get the sorted int64 key (USER * n_items + ITEM) of every interaction"""
+        if self._keys is None:
+            users = np.repeat(np.arange(self.n_users, dtype=np.int64), np.diff(self.csr.indptr))
+            self._keys = users * self.n_items + self.csr.indices
+        return self._keys
+
+    def find(self, users, items):
+        """Find the position of each (user, item) pair in the CSR arrays
+        
+        Params:
+            users (np.array): USER ids
+            items (np.array): ITEM ids
+        
+        Returns:
+            np.array: Position in `csr.indices` / `csr.data`, or -1 if the pair is not an interaction
+        """
+        users = np.asarray(users, dtype=np.int64)
+        items = np.asarray(items, dtype=np.int64)
+        inside = (users >= 0) & (users < self.n_users) & (items >= 0) & (items < self.n_items)
+        
+        keys = self.keys()
+        if len(keys) == 0:
+            return np.full(len(users), -1, dtype=np.int64)
+        
+        query = users * self.n_items + items
+        position = np.minimum(np.searchsorted(keys, query), len(keys) - 1)
+        
+        return np.where(inside & (keys[position] == query), position, -1)
+
+    def contains(self, users, items):
+        """Check whether each (user, item) pair is an interaction"""
+        return self.find(users, items) >= 0
+
+    def to_df(self):
+        """Convert back to a DataFrame with USER, ITEM and RATING"""
+        return pd.DataFrame({
+            "USER": np.repeat(np.arange(self.n_users), np.diff(self.csr.indptr)),
+            "ITEM": self.csr.indices,
+            "RATING": self.csr.data,
+        })
+
+
+def RandomSplit (df, ratios, shuffle=False, lean=False):
     
     """Function to split pandas DataFrame into train, validation and test
     
     Params:     
         df (pd.DataFrame): Pandas data frame to be split.
         ratios (list of floats): list of ratios for split. The ratios have to sum to 1.
+        lean (boolean): If True, the split_index column is int8
     
     Returns: 
         list: List of pd.DataFrame split by the given specifications.
@@ -64,17 +230,48 @@ def RandomSplit (df, ratios, shuffle=False):
     # Get the rounded integer split index
     split_index = [round(x * samples) for x in split_ratio]
     
-    # split the data
-    splits = np.split(df, split_index)
-    
-    # Add split index (this makes splitting by group more efficient).
-    for i in range(len(ratios)):
-        splits[i]["split_index"] = i
+    # split the data and add split index (this makes splitting by group more efficient).
+    bounds = [0] + split_index + [samples]
+    split_dtype = np.int8 if lean else np.int64
+    splits = [
+        df.iloc[bounds[i] : bounds[i + 1]].assign(split_index=split_dtype(i)) for i in range(len(ratios))
+    ]
 
     return splits
 
 
-def _splitter (df, ratios, by="USER", chrono=False):
+def _SplitIndex(groups, ratios=None, leave_n=None):
+    """Function to get the split index of each row, splitting every group by the ratios
+    
+    Params:     
+        groups (np.array): Group of each row. Rows of a group are contiguous and in split order.
+        ratios (list of floats): list of ratios for split. The ratios have to sum to 1.
+        leave_n (int): If given (instead of ratios), the last leave_n rows of each group 
+            have split index 1 and the others 0. Groups with leave_n rows or less are 
+            kept in split 0.
+    
+    Returns: 
+        np.array: Split index of each row
+    """
+    samples = len(groups)
+    
+    # Position of each row within its group, and the size of its group
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    sizes = np.diff(np.r_[starts, samples])
+    position = np.arange(samples) - np.repeat(starts, sizes)
+    group_size = np.repeat(sizes, sizes)
+    
+    if leave_n is not None:
+        return ((position >= group_size - leave_n) & (group_size > leave_n)).astype(np.int64)
+    
+    # Rounded split index of every group, as in RandomSplit: [0.7, 0.2, 0.1] -> [0.7, 0.9]
+    split_ratio = np.cumsum(ratios)[:-1]
+    split_bounds = np.round(group_size[:, None] * split_ratio[None, :])
+    
+    return (position[:, None] >= split_bounds).sum(axis=1)
+
+
+def _splitter (df, ratios, by="USER", chrono=False, leave_n=None, lean=False):
     
     """Function to split pandas DataFrame into train, validation and test (by user or item and in chronological order if needed)
     
@@ -83,49 +280,35 @@ def _splitter (df, ratios, by="USER", chrono=False):
         ratios (list of floats): list of ratios for split. The ratios have to sum to 1.
         by (string): split by USER or ITEM
         chrono (boolean): whether to sort in chronological order or not by TIMESTAMP
+        leave_n (int): If given, ignore the ratios and split the last leave_n rows of every group
+        lean (boolean): If True, the split_index column is int8
     
     Returns: 
         list: List of pd.DataFrame split by the given specifications.
     """
-    seed = 42                  # Set random seed
-    samples = df.shape[0]      # Number of samples
     col_time = "TIMESTAMP"
-    col_user = "USER"
-    col_item = "ITEM"
+    col_group = "USER" if by == "USER" else "ITEM"
+    n_splits = 2 if leave_n is not None else len(ratios)
     
-    # Split by each group and aggregate splits together.
-    splits = []
-
-    # Sort in chronological order, the split by user or item.      
+    # Stable sort by user or item (and in chronological order within each of them)
+    groups = pd.factorize(df[col_group], sort=True)[0]
     if chrono == True:
-      if by == "USER":
-        df_grouped = df.sort_values(col_time).groupby(col_user)
-      else: 
-        df_grouped = df.sort_values(col_time).groupby(col_item)
-    
-    # Split by user or item.      
-    if chrono == False:
-      if by == "USER":
-        df_grouped = df.groupby(col_user)
-      else: 
-        df_grouped = df.groupby(col_item)
-    
-    for name, group in df_grouped:
-        group_splits = RandomSplit(df_grouped.get_group(name), ratios, shuffle=False)
-        
-        # Concatenate the list of split dataframes.
-        concat_group_splits = pd.concat(group_splits)
-        splits.append(concat_group_splits)
+        order = np.lexsort((df[col_time].values, groups))
+    else:
+        order = np.argsort(groups, kind="stable")
     
-    # Concatenate splits for all the groups together.
-    splits_all = pd.concat(splits)
+    # Split each group by its position and size
+    split_index = _SplitIndex(groups[order], ratios, leave_n)
+    if lean:
+        split_index = split_index.astype(np.int8)
+    splits_all = df.iloc[order].assign(split_index=split_index)
 
     # Take split by split_index
-    splits_list = [ splits_all[splits_all["split_index"] == x] for x in range(len(ratios))]
+    splits_list = [splits_all[split_index == x] for x in range(n_splits)]
 
     return splits_list
 
-def ChronoSplit (df, ratios, by="USER"):
+def ChronoSplit (df, ratios, by="USER", lean=False):
     
     """Function to split pandas DataFrame into train, validation and test (by user or item) in chronological order
     
@@ -133,16 +316,17 @@ def ChronoSplit (df, ratios, by="USER"):
         df (pd.DataFrame): Pandas data frame to be split.
         ratios (list of floats): list of ratios for split. The ratios have to sum to 1.
         by (string): split by USER or ITEM
+        lean (boolean): If True, the split_index column is int8
 
     Returns: 
         list: List of pd.DataFrame split by the given specifications.
     """
-    splits_list = _splitter(df, ratios, by, True)
+    splits_list = _splitter(df, ratios, by, True, lean=lean)
 
     return splits_list
 
 
-def StratifiedSplit (df, ratios, by="USER"):
+def StratifiedSplit (df, ratios, by="USER", lean=False):
     
     """Function to split pandas DataFrame into train, validation and test (by user or item)
     
@@ -150,15 +334,256 @@ def StratifiedSplit (df, ratios, by="USER"):
         df (pd.DataFrame): Pandas data frame to be split.
         ratios (list of floats): list of ratios for split. The ratios have to sum to 1.
         by (string): split by USER or ITEM
+        lean (boolean): If True, the split_index column is int8
 
     Returns: 
         list: List of pd.DataFrame split by the given specifications.
     """
-    splits_list = _splitter(df, ratios, by, False)
+    splits_list = _splitter(df, ratios, by, False, lean=lean)
 
     return splits_list
 
 
+def LeaveLastNSplit (df, n=1, by="USER", lean=False):
+    
+    """Function to split pandas DataFrame into train and test, leaving the last n interactions of each user (or item) for test
+    
+    Params:     
+        df (pd.DataFrame): Pandas data frame to be split.
+        n (int): Number of the latest interactions (by TIMESTAMP) in test. Users (or 
+            items) with n interactions or less are kept in train.
+        by (string): split by USER or ITEM
+        lean (boolean): If True, the split_index column is int8
+
+    Returns: 
+        list: List of pd.DataFrame [train, test].
+    """
+    splits_list = _splitter(df, None, by, True, leave_n=n, lean=lean)
+
+    return splits_list
+
+
+# On-disk dtype of each encoded column
+_STORE_DTYPES = {"USER": np.int32, "ITEM": np.int32, "RATING": np.float32, "TIMESTAMP": np.int64}
+
+
+def _ReadChunks(source, columns, chunk_size, sep=","):
+    """Read a CSV or Parquet file (or an iterable of DataFrames) in chunks of rows"""
+    if not isinstance(source, str):
+        for chunk in source:
+            yield chunk[columns]
+    elif source.endswith(".parquet"):
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(source).iter_batches(batch_size=chunk_size, columns=columns):
+            yield batch.to_pandas()
+    else:
+        for chunk in pd.read_csv(source, sep=sep, usecols=columns, chunksize=chunk_size):
+            yield chunk
+
+
+def _WriteNpyFromRaw(raw_path, npy_path, dtype, n_rows, block_size=2 ** 24):
+    """Turn a raw binary column into a .npy file (header, then the data)"""
+    header = {"descr": np.lib.format.dtype_to_descr(np.dtype(dtype)), "fortran_order": False, "shape": (n_rows,)}
+    with open(npy_path, "wb") as out, open(raw_path, "rb") as raw:
+        np.lib.format.write_array_header_1_0(out, header)
+        while True:
+            block = raw.read(block_size)
+            if not block:
+                break
+            out.write(block)
+    os.remove(raw_path)
+
+
+def IngestInteractions(source, path, user_col, item_col, rating_col=None, time_col=None,
+                       chunk_size=1000000, user_encoder=None, item_encoder=None, sep=",", lean=False):
+    """Encode an interaction log larger than memory into an `InteractionStore`
+    
+    The log is read in chunks. The user and item vocabularies grow with 
+    `IdEncoder.partial_fit` (ids are coded in order of appearance), and the encoded 
+    int32 USER / ITEM, float32 RATING and int64 TIMESTAMP columns are appended to 
+    files on disk. Only one chunk is in memory at a time.
+
+    Params:
+        source (string or iterable of pd.DataFrame): CSV or .parquet file, or chunks
+        path (string): Directory of the store (created if needed)
+        user_col (string): Name of the user column
+        item_col (string): Name of the item column
+        rating_col (string): Name of the rating column. If None, the rating is 1.
+        time_col (string): Name of the timestamp column, optional
+        chunk_size (int): Number of rows per chunk
+        user_encoder (IdEncoder): Encoder to extend (e.g. from a previous ingestion)
+        item_encoder (IdEncoder): Encoder to extend
+        sep (string): Separator of a CSV file
+        lean (boolean): If True, the split_index of the store is int8
+    
+    Returns:
+        InteractionStore: The store, memory-mapped
+    """
+    if user_encoder is None:
+        user_encoder = IdEncoder(sort=False)
+    if item_encoder is None:
+        item_encoder = IdEncoder(sort=False)
+    source_cols = {"USER": user_col, "ITEM": item_col, "RATING": rating_col, "TIMESTAMP": time_col}
+    source_cols = {name: col for name, col in source_cols.items() if col is not None}
+    
+    os.makedirs(path, exist_ok=True)
+    files = {name: open(os.path.join(path, name + ".raw"), "wb") for name in source_cols}
+    n_rows = 0
+    try:
+        for chunk in _ReadChunks(source, list(source_cols.values()), chunk_size, sep):
+            encoded = {}
+            for name, encoder in [("USER", user_encoder), ("ITEM", item_encoder)]:
+                values = chunk[source_cols[name]].values
+                encoded[name] = encoder.partial_fit(values).transform(values)
+            for name in ["RATING", "TIMESTAMP"]:
+                if name in source_cols:
+                    encoded[name] = chunk[source_cols[name]].values
+            
+            for name, values in encoded.items():
+                files[name].write(np.ascontiguousarray(values, dtype=_STORE_DTYPES[name]).tobytes())
+            n_rows += len(chunk)
+    finally:
+        for f in files.values():
+            f.close()
+    
+    for name in source_cols:
+        _WriteNpyFromRaw(os.path.join(path, name + ".raw"), os.path.join(path, name + ".npy"),
+                         _STORE_DTYPES[name], n_rows)
+    user_encoder.save(os.path.join(path, "user_classes.npy"))
+    item_encoder.save(os.path.join(path, "item_classes.npy"))
+    
+    manifest = {
+        "type": "InteractionStore", "n_rows": n_rows,
+        "n_users": len(user_encoder), "n_items": len(item_encoder), "lean": lean,
+        "arrays": sorted(list(source_cols) + ["user_classes", "item_classes"]),
+    }
+    with open(os.path.join(path, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+    
+    return InteractionStore(path, lean=lean)
+
+
+def _BucketRows(column, bucket_of_value, offsets, chunk_size, out):
+    """Counting sort of the rows by the bucket of their value, in one chunked pass
+    
+    Params:
+        column (np.array): Values of the rows (e.g. a memory-mapped USER column)
+        bucket_of_value (np.array): Bucket of every value
+        offsets (np.array): Offset of each bucket in out (n_buckets + 1,), from the 
+            number of rows of each bucket
+        chunk_size (int): Rows read at once
+        out (np.array): Filled with the rows of each bucket, bucket after bucket, e.g. 
+            a np.memmap. Within a bucket, the rows keep their order.
+    """
+    n_buckets = len(offsets) - 1
+    cursor = offsets[:-1].copy()
+    for start in range(0, len(column), chunk_size):
+        buckets = bucket_of_value[column[start : start + chunk_size]]
+        order = np.argsort(buckets, kind="stable")
+        buckets = buckets[order]
+        rank = np.arange(len(buckets)) - np.searchsorted(buckets, buckets)
+        out[cursor[buckets] + rank] = start + order
+        cursor += np.bincount(buckets, minlength=n_buckets)
+
+
+class InteractionStore:
+    """Encoded interactions stored as memory-mapped columns (see `IngestInteractions`)
+    
+    USER, ITEM, RATING (and TIMESTAMP) are read only memory-maps, so the splitters, 
+    the interaction matrix and the evaluators only read the columns they need.
+
+    Params:
+        path (string): Directory of the store
+        mmap (boolean): If True, memory-map the columns instead of reading them
+        lean (boolean): If True, the split_index is int8. If None, as ingested.
+    """
+
+    def __init__(self, path, mmap=True, lean=None):
+        from .utils import _LoadArrays
+        
+        arrays, manifest = _LoadArrays(path, mmap)
+        self.path = path
+        self.columns = {name: arrays[name] for name in _STORE_DTYPES if name in arrays}
+        self.n_users = manifest["n_users"]
+        self.n_items = manifest["n_items"]
+        self.lean = manifest.get("lean", False) if lean is None else lean
+        self.user_encoder = IdEncoder.load(os.path.join(path, "user_classes.npy"), mmap=mmap)
+        self.item_encoder = IdEncoder.load(os.path.join(path, "item_classes.npy"), mmap=mmap)
+
+    def __len__(self):
+        return len(self.columns["USER"])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def to_df(self, rows=None):
+        """Read the interactions (or a subset of rows: a slice, a mask or indices) in a DataFrame"""
+        rows = slice(None) if rows is None else rows
+        return pd.DataFrame({name: column[rows] for name, column in self.columns.items()})
+
+    def chunks(self, chunk_size=1000000):
+        """Read the interactions in DataFrames of chunk_size rows"""
+        for start in range(0, len(self), chunk_size):
+            yield self.to_df(slice(start, start + chunk_size))
+
+    def interaction_matrix(self, rows=None):
+        """Build the InteractionMatrix of the interactions (or a subset of rows)"""
+        columns = ["USER", "ITEM"] + (["RATING"] if "RATING" in self.columns else [])
+        rows = slice(None) if rows is None else rows
+        df = pd.DataFrame({name: self.columns[name][rows] for name in columns})
+        return InteractionMatrix.from_df(df, self.n_users, self.n_items)
+
+    def split_index(self, ratios=None, by="USER", chrono=False, leave_n=None, chunk_size=1000000):
+        """Split index of every row, as the splitters (`StratifiedSplit`, `ChronoSplit`,
+        `LeaveLastNSplit`) do, computed from the USER or ITEM and TIMESTAMP columns only
+        
+        The groups (users or items) are split one partition at a time: a partition is a
+        range of groups with about chunk_size rows. The rows are bucketed by partition 
+        with one pass over the group column (a counting sort into a temporary memory-map
+        in the store directory), then only the keys of a partition are sorted in memory.
+        
+        Params:
+            chunk_size (int): Number of rows of a partition (a group is never divided)
+        
+        Returns:
+            np.array: Split index of each row (in the order of the store), int8 if lean
+        """
+        groups = self.columns["USER" if by == "USER" else "ITEM"]
+        n_groups = self.n_users if by == "USER" else self.n_items
+        split_index = np.empty(len(self), dtype=np.int8 if self.lean else np.int64)
+        
+        # Partitions of consecutive groups, from the number of rows of each group
+        counts = np.zeros(n_groups, dtype=np.int64)
+        for start in range(0, len(self), chunk_size):
+            counts += np.bincount(groups[start : start + chunk_size], minlength=n_groups)
+        ends = np.cumsum(counts)
+        bounds = np.unique(np.r_[0, np.searchsorted(ends, np.arange(chunk_size, len(self), chunk_size)) + 1, n_groups])
+        n_partitions = len(bounds) - 1
+        offsets = np.r_[0, ends[bounds[1:] - 1]]
+        
+        with tempfile.TemporaryFile(dir=self.path) as f:
+            if n_partitions == 1:
+                rows_by_partition = np.arange(len(self))
+            else:
+                rows_by_partition = np.memmap(f, dtype=np.int64, mode="w+", shape=(len(self),))
+                partition_of_group = np.searchsorted(bounds, np.arange(n_groups), side="right") - 1
+                _BucketRows(groups, partition_of_group, offsets, chunk_size, rows_by_partition)
+            
+            for partition in range(n_partitions):
+                rows = np.asarray(rows_by_partition[offsets[partition] : offsets[partition + 1]])
+                if len(rows) == 0:
+                    continue
+                
+                row_groups = groups[rows]
+                if chrono:
+                    order = np.lexsort((self.columns["TIMESTAMP"][rows], row_groups))
+                else:
+                    order = np.argsort(row_groups, kind="stable")
+                split_index[rows[order]] = _SplitIndex(row_groups[order], ratios, leave_n)
+            del rows_by_partition
+        return split_index
+
+
 def GetGenre(items, item_encoder):
     cols = ['movie_id', 'genre_unknown', 'Action', 'Adventure',
        'Animation', 'Children', 'Comedy', 'Crime', 'Documentary', 'Drama',
@@ -173,6 +598,6 @@ def GetGenre(items, item_encoder):
     df_genre.drop_duplicates(inplace=True)
     df_genre.sort_values("ITEM", inplace=True)
     
-    df_genre["genre_label"] = LabelEncoder().fit_transform(df_genre.genre)
+    df_genre["genre_label"] = IdEncoder().fit_transform(df_genre.genre)
     
     return df_genre
\ No newline at end of file
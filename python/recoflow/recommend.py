@@ -1,11 +1,14 @@
 import numpy as np
 import pandas as pd
-from .utils import _UserItemCrossJoin, _FilterBy, _GetTopKItems, _GetHitDF
-
-from sklearn.neighbors import NearestNeighbors
-import matplotlib.pyplot as plt
-import matplotlib.image as mpimg
-import PIL
+import time
+import warnings
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from .utils import _UserItemCrossJoin, _UserItemGrid, _FilterBy, _GetTopKItems, _GetHitDF
+from .utils import _MaskSeen, _FoldInFactors, _InverseRescale
+from .preprocessing import InteractionMatrix
+from .encoder import _ClassesArray
+from .serving import _TopKDense, _SaveArrays, _LoadArrays, FactorScorer, ExportModel, LoadModel
 
 def _GetEmbedding(model, name):
     """Function to get embedding for users or items
@@ -46,27 +49,142 @@ def ItemEmbedding(model, name="ItemEmbedding"):
     return _GetEmbedding(model, name)
 
 
+def GetFactorScorer(model, min_rating=None, max_rating=None):
+    """Export a trained factorisation model to a FactorScorer
+    
+    Works for `ExplicitMatrixFactorisation` and `ExplicitMatrixFactorisationBias`,
+    whose score is the dot product of the user and item embedding (plus biases).
+
+    Params:     
+        model (keras model): Trained factorisation model
+        min_rating (float): Minimum rating used to build a model with biases
+        max_rating (float): Maximum rating used to build a model with biases
+    
+    Returns: 
+        FactorScorer: Scorer with the user and item embeddings of the model
+    """
+    layer_names = [layer.name for layer in model.layers]
+    if "DotProduct" not in layer_names:
+        raise ValueError("Model does not score with a dot product: " + model.name)
+    
+    user_bias, item_bias = None, None
+    if "UserBias" in layer_names:
+        if min_rating is None or max_rating is None:
+            raise ValueError("min_rating and max_rating are needed for a model with bias")
+        user_bias = _GetEmbedding(model, "UserBias")
+        item_bias = _GetEmbedding(model, "ItemBias")
+    else:
+        min_rating, max_rating = None, None
+    
+    return FactorScorer(
+        UserEmbedding(model), ItemEmbedding(model), user_bias, item_bias,
+        min_rating, max_rating, name=model.name
+    )
+
+
 def _GetSimilar(embedding, k):
-    model_similar_items = NearestNeighbors(n_neighbors=k, algorithm="ball_tree").fit(embedding)
-    distances, indices = model_similar_items.kneighbors(embedding)
+    # k nearest rows (euclidean), the row itself first
+    indices, scores = _SimilarTopK(embedding, k - 1, metric="euclidean")
+    indices = np.hstack([np.arange(len(indices))[:, None], indices])
+    distances = np.hstack([np.zeros((len(scores), 1)), np.sqrt(np.maximum(-scores, 0))])
     
     return distances, indices
 
 
 
-def GetRankingTopK(model, data, train, k=5):
+def _ScoreBlock(model, users, items):
+    """Score a block of users against a set of items
+    
+    Params:
+        model (Keras.model): Trained keras model (or a scorer with a `score` method, 
+            e.g. FactorScorer)
+        users (np.array): USER ids in the block
+        items (np.array): ITEM ids to be scored
+    
+    Returns:
+        np.array: Matrix of scores with shape (len(users), len(items))
+    """
+    if hasattr(model, "score"):
+        return model.score(users, items)
+    
+    user_grid, item_grid = next(_UserItemGrid(users, items))
+    scores = model.predict([user_grid, item_grid], verbose=0)
+    
+    return np.asarray(scores).reshape(len(users), len(items))
+
+
+def _GetRankingTopKStream(model, data, train, k, block_size):
+    """Get top k items for all users, scoring the users in blocks
+
+    Each block is scored into a dense (block_size, n_items) matrix, the items seen 
+    by its users are set to -inf in place and only the top k items are kept, so the
+    peak memory depends on the block_size (and not on the number of users).
+
+    Params:
+        model (Keras.model): Trained keras model
+        data (pandas.DataFrame): DataFrame of entire rating data
+        train (pandas.DataFrame or InteractionMatrix): DataFrame of train rating data
+        k (int): number of items for each user
+        block_size (int): number of users scored together
+
+    Returns:
+        pd.DataFrame: DataFrame of top k items for each user, sorted by `col_user` and `rank`
+    """
+    users = np.sort(data.USER.unique())
+    items = data.ITEM.unique()
+    
+    # Seen items of every user and the column of each item in the score matrix
+    if isinstance(train, InteractionMatrix):
+        seen = train
+    else:
+        seen = InteractionMatrix.from_df(
+            train, n_users=max(users.max(), train.USER.max()) + 1,
+            n_items=max(items.max(), train.ITEM.max()) + 1
+        )
+    item_columns = np.full(max(items.max() + 1, seen.n_items), -1)
+    item_columns[items] = np.arange(len(items))
+    
+    ranking_topk = []
+    for start in range(0, len(users), block_size):
+        block_users = users[start : start + block_size]
+        
+        # Score the block of users against all items
+        scores = _ScoreBlock(model, block_users, items)
+        scores[np.isnan(scores)] = 0
+        
+        # Mask the items already seen by the users in the block and take the top k
+        _MaskSeen(scores, block_users, seen, item_columns)
+        top_k, top_k_scores = _TopKDense(scores, k)
+        unseen = top_k_scores > -np.inf
+        
+        ranking_topk.append(pd.DataFrame({
+            "USER": np.repeat(block_users, unseen.sum(axis=1)),
+            "ITEM": items[top_k[unseen]],
+            "RATING": top_k_scores[unseen],
+            "rank": np.nonzero(unseen)[1] + 1,
+        }))
+    
+    return pd.concat(ranking_topk, ignore_index=True)
+
+
+def GetRankingTopK(model, data, train, k=5, block_size=None):
     """Get predictions for all users, removing train data
 
     Params:
         data (pandas.DataFrame): DataFrame of entire rating data
         train (pandas.DataFrame): DataFrame of train rating data
         k (int): number of items for each user
+        block_size (int): If given, score users in blocks of block_size users and 
+            only keep the running top k items, instead of scoring all users at once
 
     Returns:
         pd.DataFrame: DataFrame of top k items for each user, sorted by `col_user` and `rank`
     
     """
     
+    if block_size is not None:
+        return _GetRankingTopKStream(model, data, train, k, block_size)
+    
     # Get predictions for all user-item combination
     all_predictions = GetPredictions(model, data)
     
@@ -76,22 +194,31 @@ def GetRankingTopK(model, data, train, k=5):
     # Filter already seen items
     all_predictions_unseen = _FilterBy(all_predictions, train, ["USER", "ITEM"])
     
-    ranking_topk_df = _GetTopKItems(all_predictions_unseen, "USER", "RATING", k=5)
+    ranking_topk_df = _GetTopKItems(all_predictions_unseen, "USER", "RATING", k=k)
     
     return ranking_topk_df
 
 
-def GetPredictions(model, data):
+def GetPredictions(model, data, chunk_size=None):
     """Get predictions for all user-item combinations
     
     Params:
         data (pandas.DataFrame): DataFrame of entire rating data
         model (Keras.model): Trained keras model
+        chunk_size (int): If given, score the user-item combinations in chunks of 
+            chunk_size rows
         
     Returns:
         pd.DataFrame: DataFrame of rating predictions for each user and each item
         
     """
+    if chunk_size is not None:
+        chunks = []
+        for user_item in _UserItemCrossJoin(data, chunk_size=chunk_size):
+            user_item["RATING"] = model.predict([user_item.USER, user_item.ITEM], verbose=0)
+            chunks.append(user_item)
+        return pd.concat(chunks, ignore_index=True)
+    
     # Create the crossjoin for user-item
     user_item = _UserItemCrossJoin(data)
     
@@ -100,32 +227,589 @@ def GetPredictions(model, data):
     
     return user_item
 
-def GetSimilar(embedding, k=5, metric="cosine"):
+
+class FoldInRecommender:
+    """Recommend items to users who are not in the model, from their interactions
+    
+    The user vector (and bias) is solved at request time by regularised least squares
+    against the fixed item embedding (and biases), then the whole catalog is scored 
+    with one matrix-vector product. Solved users are cached for `ttl` seconds, with a 
+    hash of their interactions: a user who has new interactions is solved again.
+
+    Params:
+        model (keras model or FactorScorer): Trained dot product model (see 
+            `GetFactorScorer`)
+        min_rating (float): Minimum rating used to build a model with biases
+        max_rating (float): Maximum rating used to build a model with biases
+        reg (float): L2 regularisation of the user vector
+        ttl (float): Seconds a solved user is kept in the cache
+        max_size (int): Maximum number of users in the cache
+    """
+
+    def __init__(self, model, min_rating=None, max_rating=None, reg=0.1, ttl=600, max_size=10000):
+        if not isinstance(model, FactorScorer):
+            model = GetFactorScorer(model, min_rating, max_rating)
+        self.scorer = model
+        self.reg = reg
+        self.ttl = ttl
+        self.max_size = max_size
+        self._cache = OrderedDict()
+
+    def _Solve(self, items, ratings):
+        scorer = self.scorer
+        items = np.asarray(items, dtype=np.int64)
+        fixed = scorer.item_embedding[items]
+        targets = np.asarray(ratings, dtype=np.float64)
+        if scorer.min_rating is not None:
+            targets = _InverseRescale(targets, scorer.min_rating, scorer.max_rating)
+        if scorer.user_bias is not None:
+            fixed = np.hstack([fixed, np.ones((len(fixed), 1), dtype=fixed.dtype)])
+            targets = targets - scorer.item_bias[items, 0]
+        
+        n_items = len(items)
+        if n_items == 0:
+            warnings.warn("No interactions to fold in: the user vector (and bias) is 0")
+        factors = _FoldInFactors(fixed, np.zeros(n_items), np.arange(n_items), targets, 1, self.reg)[0][0]
+        if scorer.user_bias is not None:
+            return factors[:-1], factors[-1]
+        return factors, None
+
+    def fold_in(self, items, ratings, user=None):
+        """Solve the vector (and bias) of a user from its (ITEM, RATING) interactions
+        
+        A user without interactions gets a 0 vector and bias (so the items are ranked
+        by their bias), with a warning.
+        
+        Params:
+            items (np.array): ITEM ids rated by the user
+            ratings (np.array): Ratings of the items
+            user (hashable): Key of the user in the cache. If None, it is not cached.
+                The cached vector is used only while the interactions are the same.
+        
+        Returns:
+            np.array: User vector (n_factors,)
+            float: User bias (None for a model without biases)
+        """
+        now = time.monotonic()
+        if user is not None:
+            key = hash((np.asarray(items, dtype=np.int64).tobytes(), np.asarray(ratings, dtype=np.float64).tobytes()))
+            cached = self._cache.get(user)
+            if cached is not None and cached[0] > now and cached[1] == key:
+                self._cache.move_to_end(user)
+                return cached[2]
+        
+        solved = self._Solve(items, ratings)
+        
+        if user is not None:
+            self._cache[user] = (now + self.ttl, key, solved)
+            self._cache.move_to_end(user)
+            # Evict the expired users, then the least recently used ones
+            while self._cache and (len(self._cache) > self.max_size or next(iter(self._cache.values()))[0] <= now):
+                self._cache.popitem(last=False)
+        return solved
+
+    def invalidate(self, user=None):
+        """Remove a user (or all the users if None) from the cache"""
+        if user is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(user, None)
+
+    def score(self, items, ratings, user=None):
+        """Score every item of the catalog for a user given its interactions"""
+        factors, bias = self.fold_in(items, ratings, user)
+        scorer = self.scorer
+        scores = np.dot(scorer.item_embedding, factors.astype(scorer.item_embedding.dtype))
+        if bias is not None:
+            scores += bias + scorer.item_bias[:, 0]
+        return scorer._Rescale(scores)
+
+    def recommend(self, items, ratings, k=5, user=None, exclude_seen=True):
+        """Get the top k items for a user given its interactions
+        
+        Params:
+            items (np.array): ITEM ids rated by the user
+            ratings (np.array): Ratings of the items
+            k (int): number of items
+            user (hashable): Key of the user in the cache
+            exclude_seen (boolean): Whether to remove the rated items
+        
+        Returns:
+            pd.DataFrame: ITEM, RATING (predicted) and rank of the top k items
+        """
+        scores = self.score(items, ratings, user)[None, :]
+        if exclude_seen:
+            scores[0, np.asarray(items)] = -np.inf
+        top_k, top_k_scores = _TopKDense(scores, k)
+        keep = top_k_scores[0] > -np.inf
+        
+        return pd.DataFrame({
+            "ITEM": top_k[0][keep],
+            "RATING": top_k_scores[0][keep],
+            "rank": np.arange(1, keep.sum() + 1),
+        })
+
+
+def _PrepareVectors(embedding, metric):
+    """Cast the embedding to float32 (and L2 normalise it for cosine)"""
+    if metric not in ("cosine", "dot", "euclidean"):
+        raise ValueError("metric should be cosine, dot or euclidean: " + str(metric))
+    
+    vectors = np.asarray(embedding, dtype=np.float32)
+    if metric == "cosine":
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = vectors / np.maximum(norms, np.finfo(np.float32).tiny)
+    return vectors
+
+
+def _Similarity(queries, vectors, metric, vector_sq_norms=None):
+    """Similarity of every query to every vector (higher is more similar)
+    
+    Params:
+        queries (np.array): Prepared query vectors (n_queries, n_factors)
+        vectors (np.array): Prepared vectors (n_vectors, n_factors)
+        metric (string): cosine, dot or euclidean (minus the squared distance)
+        vector_sq_norms (np.array): Squared norm of the vectors, for euclidean
+    
+    Returns:
+        np.array: Similarity matrix (n_queries, n_vectors)
+    """
+    scores = np.dot(queries, vectors.T)
+    if metric == "euclidean":
+        if vector_sq_norms is None:
+            vector_sq_norms = np.einsum("ij,ij->i", vectors, vectors)
+        scores *= 2
+        scores -= vector_sq_norms[None, :]
+        scores -= np.einsum("ij,ij->i", queries, queries)[:, None]
+    return scores
+
+
+def _SimilarTopK(embedding, k=5, metric="cosine", exclude_self=True, block_size=None, n_jobs=1):
+    """Exact k most similar rows for every row of an embedding
+    
+    The embedding is prepared once (float32, L2 normalised for cosine), then the 
+    similarities are computed in blocks of rows with a matmul, keeping only the top k
+    of each block. Memory is bounded by the block size, not by n_rows squared.
+    
+    Params:
+        embedding (np.array): Embedding for ITEM or USER (n_rows, n_factors)
+        k (int): Number of similar rows
+        metric (string): cosine, dot or euclidean (score is minus the squared distance)
+        exclude_self (bool): Whether to exclude each row from its own neighbours
+        block_size (int): Rows per block. Defaults to about 64M scores per block
+        n_jobs (int): Number of threads computing blocks
+    
+    Returns:
+        np.array: Row ids of the neighbours (n_rows, k), sorted by score
+        np.array: Scores of the neighbours (n_rows, k)
+    """
+    vectors = _PrepareVectors(embedding, metric)
+    n_rows = vectors.shape[0]
+    k = min(k, n_rows - 1 if exclude_self else n_rows)
+    sq_norms = np.einsum("ij,ij->i", vectors, vectors) if metric == "euclidean" else None
+    
+    if block_size is None:
+        block_size = max(1, 2 ** 26 // (n_rows * max(n_jobs, 1)))
+    
+    indices = np.empty((n_rows, k), dtype=np.int64)
+    scores = np.empty((n_rows, k), dtype=np.float32)
+    
+    def _Block(start):
+        block = _Similarity(vectors[start : start + block_size], vectors, metric, sq_norms)
+        if exclude_self:
+            rows = np.arange(len(block))
+            block[rows, start + rows] = -np.inf
+        indices[start : start + block_size], scores[start : start + block_size] = _TopKDense(block, k)
+    
+    starts = range(0, n_rows, block_size)
+    if n_jobs > 1:
+        with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+            list(executor.map(_Block, starts))
+    else:
+        for start in starts:
+            _Block(start)
+    
+    return indices, scores
+
+
+class SimilarityIndex:
+    """Approximate nearest neighbour index for user or item embeddings
+    
+    An inverted file index: the vectors are clustered with k-means into n_lists 
+    lists, and a query only scores the vectors of its n_probe closest lists. More 
+    probes give a better recall for a longer query time. The index is saved as .npy
+    files that can be memory-mapped, so it is built once and shared by processes.
+
+    Params:
+        metric (string): cosine, dot or euclidean. Scores are higher for more similar
+            vectors (for euclidean the score is minus the squared distance).
+        n_lists (int): Number of lists. Defaults to sqrt(n_vectors)
+        n_probe (int): Default number of lists scored for a query
+        seed (int): Random seed for k-means
+    """
+
+    def __init__(self, metric="cosine", n_lists=None, n_probe=8, seed=42):
+        self.metric = metric
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.seed = seed
+
+    def build(self, embedding, n_iter=10, max_train=100000):
+        """Build the index from an embedding (e.g. `ItemEmbedding(model)`)
+        
+        Params:
+            embedding (np.array): Embedding (n_vectors, n_factors)
+            n_iter (int): Number of k-means iterations
+            max_train (int): Maximum number of vectors used to train k-means
+        
+        Returns:
+            SimilarityIndex: The index itself
+        """
+        vectors = _PrepareVectors(embedding, self.metric)
+        n_vectors = vectors.shape[0]
+        n_lists = self.n_lists or max(1, int(np.sqrt(n_vectors)))
+        n_lists = min(n_lists, n_vectors)
+        rng = np.random.default_rng(self.seed)
+        
+        # k-means on a sample of the vectors
+        sample = vectors[rng.choice(n_vectors, size=min(n_vectors, max(max_train, n_lists)), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)].copy()
+        for _ in range(n_iter):
+            labels = self._Assign(sample, centroids)
+            counts = np.bincount(labels, minlength=n_lists)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            empty = counts == 0
+            centroids[~empty] = sums[~empty] / counts[~empty, None]
+            # Restart empty lists from random vectors
+            centroids[empty] = sample[rng.choice(len(sample), size=empty.sum())]
+        
+        # Store the vectors grouped by list
+        labels = self._Assign(vectors, centroids)
+        order = np.argsort(labels, kind="stable")
+        self.centroids = centroids
+        self.vectors = vectors[order]
+        self.ids = order.astype(np.int64)
+        self.offsets = np.r_[0, np.cumsum(np.bincount(labels, minlength=n_lists))]
+        self.sq_norms = np.einsum("ij,ij->i", self.vectors, self.vectors)
+        self.n_lists = n_lists
+        return self
+
+    def _Assign(self, vectors, centroids, block_size=4096):
+        """Closest centroid (euclidean) of every vector"""
+        centroid_sq_norms = np.einsum("ij,ij->i", centroids, centroids)
+        labels = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), block_size):
+            block = vectors[start : start + block_size]
+            scores = _Similarity(block, centroids, "euclidean", centroid_sq_norms)
+            labels[start : start + block_size] = scores.argmax(axis=1)
+        return labels
+
+    def _Probe(self, queries, n_probe):
+        """Lists to be scored for every query"""
+        if self.metric == "euclidean":
+            centroid_sq_norms = np.einsum("ij,ij->i", self.centroids, self.centroids)
+            scores = _Similarity(queries, self.centroids, "euclidean", centroid_sq_norms)
+        else:
+            scores = _Similarity(queries, self.centroids, "dot")
+        return _TopKDense(scores, n_probe)[0]
+
+    def query(self, vectors, k=5, n_probe=None, exclude=None, block_size=1024):
+        """Get the approximate k nearest neighbours of query vectors
+        
+        When the probed lists cover a large part of the index (a small catalog, or many
+        probes), they are concatenated and scored with one product per block of queries.
+        Otherwise every list is scored once, against the queries that probe it.
+        
+        Params:
+            vectors (np.array): Query vectors (n_queries, n_factors), or a single vector
+            k (int): Number of neighbours
+            n_probe (int): Number of lists scored for a query. Defaults to the index n_probe
+            exclude (np.array): Row id excluded for each query (e.g. the query item itself)
+            block_size (int): Queries scored at once against the concatenated lists
+        
+        Returns:
+            np.array: Row ids of the neighbours (n_queries, k), -1 if there are fewer than k
+            np.array: Scores of the neighbours (n_queries, k)
+        """
+        queries = _PrepareVectors(np.atleast_2d(vectors), self.metric)
+        n_probe = min(n_probe or self.n_probe, self.n_lists)
+        exclude = None if exclude is None else np.asarray(exclude)
+        
+        best_ids = np.full((len(queries), k), -1, dtype=np.int64)
+        best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        
+        probe = self._Probe(queries, n_probe)
+        list_sizes = np.diff(self.offsets)
+        lists = np.unique(probe)
+        # Rows scored by one product per block, relative to the rows of the own lists
+        waste = len(queries) * list_sizes[lists].sum() / max(1, list_sizes[probe].sum())
+        if waste <= 4:
+            for start in range(0, len(queries), block_size):
+                block = slice(start, start + block_size)
+                self._ScoreConcatenated(queries[block], probe[block], lists, None if exclude is None else exclude[block],
+                                        best_ids[block], best_scores[block])
+        else:
+            self._ScoreByList(queries, probe, exclude, best_ids, best_scores)
+        
+        best_ids[np.isinf(best_scores)] = -1
+        return best_ids, best_scores
+
+    def _ScoreConcatenated(self, queries, probe, lists, exclude, best_ids, best_scores):
+        """Score the queries against the concatenated rows of the lists, in one product"""
+        sizes = np.diff(self.offsets)[lists]
+        n_rows = sizes.sum()
+        if n_rows == 0:
+            return
+        if n_rows == len(self.ids):
+            rows = slice(None)
+        else:
+            rows = np.repeat(self.offsets[lists] - np.r_[0, np.cumsum(sizes)[:-1]], sizes) + np.arange(n_rows)
+        scores = _Similarity(queries, self.vectors[rows], self.metric, self.sq_norms[rows])
+        
+        # Each query only keeps the rows of its own lists
+        probed = np.zeros((len(queries), len(lists)), dtype=bool)
+        probed[np.arange(len(queries))[:, None], np.searchsorted(lists, probe)] = True
+        scores[~np.repeat(probed, sizes, axis=1)] = -np.inf
+        ids = self.ids[rows]
+        if exclude is not None:
+            position = np.full(len(self.ids), -1, dtype=np.int64)
+            position[ids] = np.arange(n_rows)
+            excluded = position[exclude]
+            scores[np.flatnonzero(excluded >= 0), excluded[excluded >= 0]] = -np.inf
+        
+        n_top = min(best_ids.shape[1], n_rows)
+        top_k, best_scores[:, :n_top] = _TopKDense(scores, n_top)
+        best_ids[:, :n_top] = ids[top_k]
+
+    def _ScoreByList(self, queries, probe, exclude, best_ids, best_scores):
+        """Score every list once against the queries that probe it"""
+        n_queries, n_probe = probe.shape
+        k = best_ids.shape[1]
+        
+        # Group the (query, list) pairs by list
+        pair_query = np.repeat(np.arange(n_queries), n_probe)
+        pair_list = probe.ravel()
+        order = np.argsort(pair_list, kind="stable")
+        pair_query, pair_list = pair_query[order], pair_list[order]
+        bounds = np.searchsorted(pair_list, np.arange(self.n_lists + 1))
+        
+        for l in range(self.n_lists):
+            rows = pair_query[bounds[l] : bounds[l + 1]]
+            low, high = self.offsets[l], self.offsets[l + 1]
+            if len(rows) == 0 or low == high:
+                continue
+            
+            scores = _Similarity(queries[rows], self.vectors[low:high], self.metric, self.sq_norms[low:high])
+            ids = np.broadcast_to(self.ids[low:high], scores.shape)
+            if exclude is not None:
+                scores[ids == exclude[rows, None]] = -np.inf
+            
+            # Merge with the best neighbours so far
+            scores = np.hstack([best_scores[rows], scores])
+            ids = np.hstack([best_ids[rows], ids])
+            top_k, top_k_scores = _TopKDense(scores, k)
+            best_ids[rows] = np.take_along_axis(ids, top_k, axis=1)
+            best_scores[rows] = top_k_scores
+
+    def _ExactQuery(self, vectors, k, exclude=None, block_size=1024):
+        """Get the exact k nearest neighbours, by scoring all the vectors"""
+        queries = _PrepareVectors(np.atleast_2d(vectors), self.metric)
+        indices = np.empty((len(queries), k), dtype=np.int64)
+        for start in range(0, len(queries), block_size):
+            scores = _Similarity(queries[start : start + block_size], self.vectors, self.metric, self.sq_norms)
+            if exclude is not None:
+                block_exclude = np.asarray(exclude)[start : start + block_size]
+                scores[self.ids[None, :] == block_exclude[:, None]] = -np.inf
+            indices[start : start + block_size] = self.ids[_TopKDense(scores, k)[0]]
+        return indices
+
+    def recall(self, vectors=None, k=10, n_probe=None, n_sample=1000):
+        """Report the recall at k (and query time) against an exact search
+        
+        Params:
+            vectors (np.array): Query vectors. Defaults to a sample of the indexed vectors
+                (each excluding itself)
+            k (int): Number of neighbours
+            n_probe (int or list of int): Number(s) of lists scored for a query
+            n_sample (int): Number of indexed vectors sampled as queries
+        
+        Returns:
+            pd.DataFrame: Recall at k, and the query time (seconds) of the index and of 
+                the exact search, for each n_probe
+        """
+        exclude = None
+        if vectors is None:
+            rng = np.random.default_rng(self.seed)
+            sample = rng.choice(len(self.ids), size=min(n_sample, len(self.ids)), replace=False)
+            vectors, exclude = self.vectors[sample], self.ids[sample]
+        
+        start = time.perf_counter()
+        exact = self._ExactQuery(vectors, k, exclude)
+        exact_time = time.perf_counter() - start
+        
+        n_probes = [n_probe or self.n_probe] if np.isscalar(n_probe) or n_probe is None else n_probe
+        rows = []
+        for probes in n_probes:
+            start = time.perf_counter()
+            approx = self.query(vectors, k, probes, exclude)[0]
+            query_time = time.perf_counter() - start
+            
+            found = (approx[:, :, None] == exact[:, None, :]).any(axis=2).sum()
+            rows.append({
+                "n_probe": probes, "Recall@k": found / exact.size,
+                "query_time": query_time, "exact_time": exact_time,
+            })
+        
+        return pd.DataFrame(rows)
+
+    def save(self, path):
+        """Save the index to a directory of .npy files"""
+        _SaveArrays(
+            path,
+            {"centroids": self.centroids, "vectors": self.vectors, "ids": self.ids,
+             "offsets": self.offsets, "sq_norms": self.sq_norms},
+            {"type": "SimilarityIndex", "metric": self.metric, "n_lists": self.n_lists,
+             "n_probe": self.n_probe, "seed": self.seed},
+        )
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Load an index saved with `save`, memory-mapping the arrays by default"""
+        arrays, manifest = _LoadArrays(path, mmap)
+        index = cls(manifest["metric"], manifest["n_lists"], manifest["n_probe"], manifest["seed"])
+        for name, array in arrays.items():
+            setattr(index, name, array)
+        return index
+
+
+def _SimilarMetric(metric, index):
+    """Metric of a similarity search: the given one (which the index must use), the 
+    metric of the index, or cosine"""
+    if index is None:
+        return metric or "cosine"
+    if metric is not None and metric != index.metric:
+        raise ValueError("metric is {} but the index was built with {}".format(metric, index.metric))
+    return index.metric
+
+
+def GetSimilar(embedding, k=5, metric=None, index=None, block_size=None, n_jobs=1):
     """Get Similiar ITEMS or USER
     
     Params:
     embedding (np.array): Embedding for ITEM or USER
     k (int): No. of similar items to be presented
-    metric (string): distance metrics to be used to find nearest neighbour
+    metric (string): cosine, dot or euclidean similarity to find nearest neighbour. 
+        Defaults to the metric of the index, or cosine
+    index (SimilarityIndex): Approximate index built on the embedding, used instead
+        of an exact search (it must use the metric)
+    block_size (int): Rows scored at once by the exact search
+    n_jobs (int): Number of threads for the exact search
     
     Returns:
-    indices (int): index of the nearest ITEM or USER
+    indices (int): index of the ITEM or USER followed by its k nearest ones
     
     """
-    neighbors = k + 1
+    metric = _SimilarMetric(metric, index)
     
-    model_similar_items = NearestNeighbors(n_neighbors=neighbors).fit(embedding)
-    distances, indices = model_similar_items.kneighbors(embedding)
+    if index is not None:
+        indices = index.query(embedding, k=k, exclude=np.arange(len(embedding)))[0]
+    else:
+        indices, _ = _SimilarTopK(embedding, k, metric, block_size=block_size, n_jobs=n_jobs)
     
-    return indices
+    return np.hstack([np.arange(len(indices))[:, None], indices])
+
+def BuildSimilarItems(embedding, path, k=10, metric=None, item_encoder=None, index=None,
+                      block_size=None, n_jobs=1):
+    """Precompute the k most similar items of every item and save them to disk
+    
+    The table is saved as .npy files (neighbours as int32, scores as float16, and the
+    classes of the item encoder) with a json manifest, to be served with `SimilarItems`.
+    
+    Params:
+        embedding (np.array): Embedding for ITEM (or USER)
+        path (string): Directory to save the table to
+        k (int): No. of similar items for each item
+        metric (string): cosine, dot or euclidean. Defaults to the metric of the index,
+            or cosine
+        item_encoder (IdEncoder): Encoder for Items, saved with the table
+        index (SimilarityIndex): Approximate index built on the embedding, used instead
+            of an exact search (it must use the metric)
+        block_size (int): Rows scored at once by the exact search
+        n_jobs (int): Number of threads for the exact search
+    
+    Returns:
+        SimilarItems: The saved table, memory-mapped
+    """
+    metric = _SimilarMetric(metric, index)
+    if index is not None:
+        neighbors, scores = index.query(embedding, k=k, exclude=np.arange(len(embedding)))
+    else:
+        neighbors, scores = _SimilarTopK(embedding, k, metric, block_size=block_size, n_jobs=n_jobs)
+    
+    # Each row is the item itself followed by its neighbours, as in `GetSimilar`
+    neighbors = np.hstack([np.arange(len(neighbors))[:, None], neighbors]).astype(np.int32)
+    
+    arrays = {"neighbors": neighbors, "scores": scores.astype(np.float16)}
+    if item_encoder is not None:
+        arrays["classes"] = _ClassesArray(item_encoder.classes_)
+    
+    _SaveArrays(path, arrays, {"type": "SimilarItems", "metric": metric, "k": int(scores.shape[1])})
+    
+    return SimilarItems(path)
+
+
+class SimilarItems:
+    """Read a similar items table saved with `BuildSimilarItems`
+    
+    The arrays are memory-mapped (read only), so loading is instant whatever the 
+    catalog size, and worker processes share the same pages of the OS cache. It can 
+    be used in place of both `item_similar_indices` and `item_encoder` in 
+    `ShowSimilarItems`.
+
+    Params:
+        path (string): Directory of the table
+        mmap (boolean): If True, memory-map the arrays instead of reading them
+    """
+
+    def __init__(self, path, mmap=True):
+        arrays, manifest = _LoadArrays(path, mmap)
+        self.neighbors = arrays["neighbors"]
+        self.scores = arrays["scores"]
+        self.classes_ = arrays.get("classes")
+        self.metric = manifest["metric"]
+        self.k = manifest["k"]
+
+    def __len__(self):
+        return len(self.neighbors)
+
+    def __getitem__(self, item_index):
+        """Index of the item followed by its k most similar items (as in `GetSimilar`)"""
+        return self.neighbors[item_index]
+
+    def similar(self, item_index):
+        """Get the k most similar items of an item, with their scores
+        
+        Returns:
+            np.array: Indices of the similar items
+            np.array: Scores of the similar items (float16)
+        """
+        return self.neighbors[item_index, 1:], self.scores[item_index]
+
+    def inverse_transform(self, indices):
+        """Transform item indices back to the original item ids"""
+        if self.classes_ is None:
+            raise ValueError("The table was built without an item_encoder")
+        return self.classes_[indices]
+
 
 def ShowSimilarItems(item_index, item_similar_indices, item_encoder, items, image_path="data/posters/"):
     """Show Similiar Items
     
     Params:
     item_index (int): Index of the Item
-    item_similar_indices (np.array): Similar Item Indices
-    item_encoder (sklearn.LabelEncoder): Label Encoder for Items
+    item_similar_indices (np.array): Similar Item Indices (or SimilarItems)
+    item_encoder (IdEncoder): Encoder for Items (or SimilarItems)
     items (pd.DataFrame): ITEMS DataFrame
     image_path (string): Relative path to image folder
     
@@ -133,6 +817,9 @@ def ShowSimilarItems(item_index, item_similar_indices, item_encoder, items, imag
     indices (int): index of the nearest ITEM or USER
     
     """
+    import matplotlib.pyplot as plt
+    import matplotlib.image as mpimg
+    
     movie_title = items.iloc[0].title
     
     s = item_similar_indices[item_index]
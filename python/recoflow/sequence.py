@@ -0,0 +1,76 @@
+import numpy as np
+# Imported at load time, as the base class: importing this module imports keras
+from keras.utils import Sequence
+from .preprocessing import InteractionMatrix
+from .utils import _ItemWeights, _SampleNegatives
+
+
+class NegativeSamplingSequence(Sequence):
+    """Keras Sequence of shuffled (USER, ITEM) and label batches for implicit feedback.
+
+    Only the positive interactions are kept in memory. Fresh negatives are sampled 
+    for every epoch (ratio_neg per positive of each user), so the training set does
+    not need to be materialised with `NegativeSamples` beforehand. It can be used 
+    with `model.fit(sequence, epochs=..., workers=..., use_multiprocessing=True)`.
+
+    Params:
+        interactions (pd.DataFrame or InteractionMatrix): Encoded USER, ITEM (and RATING) interactions
+        n_items (int): Number of items. Defaults to the largest ITEM + 1
+        ratio_neg (int): Number of negatives for each positive of a user
+        batch_size (int): Number of rows per batch
+        rating_threshold (float): If given, only interactions with RATING >= rating_threshold are positive
+        sampling (str): "uniform" or "popularity" sampling of the negative items (as in
+            `NegativeSamples`)
+        shuffle (boolean): Whether to shuffle the rows every epoch
+        seed (int): Random seed
+    """
+
+    def __init__(self, interactions, n_items=None, ratio_neg=4, batch_size=256,
+                 rating_threshold=None, sampling="uniform", shuffle=True, seed=42):
+        if isinstance(interactions, InteractionMatrix):
+            n_items = interactions.n_items if n_items is None else n_items
+            interactions = interactions.to_df()
+        self.n_items = int(interactions["ITEM"].max()) + 1 if n_items is None else n_items
+        # Popularity counts all the interactions, as in NegativeSamples
+        self.item_weights = _ItemWeights(interactions["ITEM"].values, self.n_items, sampling)
+        if rating_threshold is not None:
+            interactions = interactions[interactions["RATING"] >= rating_threshold]
+        
+        # Compact positive index: sorted unique (USER, ITEM) keys
+        keys = np.unique(interactions["USER"].values.astype(np.int64) * self.n_items + interactions["ITEM"].values)
+        self.pos_keys = keys
+        self.pos_users = (keys // self.n_items).astype(np.int32)
+        self.pos_items = (keys % self.n_items).astype(np.int32)
+        
+        n_pos = np.bincount(self.pos_users)
+        self.n_neg = np.minimum(n_pos * ratio_neg, self.n_items - n_pos)
+        
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self._Sample()
+
+    def _Sample(self):
+        """Sample the negatives and shuffle the rows for the current epoch"""
+        neg_users, neg_items = _SampleNegatives(
+            self.n_neg, self.pos_keys, self.n_items, self.seed + self.epoch, self.item_weights
+        )
+        self.users = np.r_[self.pos_users, neg_users.astype(np.int32)]
+        self.items = np.r_[self.pos_items, neg_items.astype(np.int32)]
+        self.labels = np.r_[np.ones(len(self.pos_users), np.float32), np.zeros(len(neg_users), np.float32)]
+        
+        if self.shuffle:
+            order = np.random.default_rng(self.seed + self.epoch).permutation(len(self.labels))
+            self.users, self.items, self.labels = self.users[order], self.items[order], self.labels[order]
+
+    def __len__(self):
+        return int(np.ceil(len(self.labels) / self.batch_size))
+
+    def __getitem__(self, idx):
+        batch = slice(idx * self.batch_size, (idx + 1) * self.batch_size)
+        return [self.users[batch], self.items[batch]], self.labels[batch]
+
+    def on_epoch_end(self):
+        self.epoch += 1
+        self._Sample()
@@ -0,0 +1,319 @@
+# Serving of exported models with numpy only: importing this module (to load a model 
+# with `LoadModel` and score it) does not import pandas, scipy or keras
+
+import numpy as np
+import os, json
+from .encoder import IdEncoder, _ClassesArray
+
+
+def _SaveArrays(path, arrays, manifest):
+    """Save numpy arrays as .npy files in a directory, with a json manifest
+    
+    Params:
+        path (string): Directory to save to (created if needed)
+        arrays (dict): Name and np.array of each array
+        manifest (dict): json serialisable metadata
+    """
+    os.makedirs(path, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(os.path.join(path, name + ".npy"), array, allow_pickle=False)
+    
+    manifest = dict(manifest, arrays=sorted(arrays))
+    with open(os.path.join(path, "manifest.json"), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+
+def _LoadArrays(path, mmap=True):
+    """Load the arrays and the manifest saved with `_SaveArrays`
+    
+    Params:
+        path (string): Directory to load from
+        mmap (boolean): If True, memory-map the arrays (read only) instead of reading them
+    
+    Returns:
+        dict: Name and np.array of each array
+        dict: The manifest
+    """
+    with open(os.path.join(path, "manifest.json")) as f:
+        manifest = json.load(f)
+    
+    mmap_mode = "r" if mmap else None
+    arrays = {
+        name: np.load(os.path.join(path, name + ".npy"), mmap_mode=mmap_mode, allow_pickle=False)
+        for name in manifest["arrays"]
+    }
+    return arrays, manifest
+
+
+def _TopKCandidates(scores, k, max_candidates=8):
+    """Top k columns of a wide score matrix, sorting only a few candidates per row
+
+    The columns are cut into groups, and the k-th largest group maximum is a lower 
+    bound for the k-th largest score of the row. A row usually has few scores above
+    the bound, so only they are sorted (much faster than np.argpartition on wide rows).
+
+    Returns None if the rows have too many candidates (e.g. many ties or -inf).
+    """
+    n_rows, n_cols = scores.shape
+    if k <= 0:
+        return np.empty((n_rows, 0), dtype=np.int64), scores[:, :0]
+    n_groups = 4 * k
+    group_size = n_cols // n_groups
+    
+    # Maximum of every group (the remaining columns form the last group)
+    group_max = np.empty((n_rows, n_groups + 1), dtype=scores.dtype)
+    group_max[:, :n_groups] = scores[:, : n_groups * group_size].reshape(n_rows, n_groups, group_size).max(axis=2)
+    group_max[:, n_groups] = scores[:, n_groups * group_size :].max(axis=1) if n_cols > n_groups * group_size else -np.inf
+    bound = np.partition(group_max, n_groups + 1 - k, axis=1)[:, n_groups + 1 - k, None]
+    
+    rows, cols = np.nonzero(scores >= bound)
+    if len(rows) > max_candidates * k * n_rows or np.isneginf(bound).any():
+        return None
+    
+    # Sort the candidates by row, score and column
+    values = scores[rows, cols]
+    order = np.lexsort((cols, -values, rows))
+    rows, cols, values = rows[order], cols[order], values[order]
+    rank = np.arange(len(rows)) - np.searchsorted(rows, rows)
+    keep = rank < k
+    
+    return cols[keep].reshape(n_rows, k), values[keep].reshape(n_rows, k)
+
+
+def _TopKDense(scores, k):
+    """Get the top k columns for each row of a score matrix.
+
+    The k winners are found with np.argpartition and only they are sorted. Ties are 
+    broken by the column order (as in `pd.DataFrame.nlargest(keep="first")`).
+
+    Params:
+        scores (np.array): Matrix of scores (n_rows, n_cols), without NaN
+        k (int): number of columns for each row
+
+    Returns:
+        np.array: Column index of the top k scores (n_rows, min(k, n_cols)), sorted by score
+        np.array: Top k scores (n_rows, min(k, n_cols))
+    """
+    n_rows, n_cols = scores.shape
+    k = min(k, n_cols)
+    
+    if k <= 0:
+        return np.empty((n_rows, 0), dtype=np.int64), scores[:, :0]
+    
+    if 64 * k <= n_cols:
+        top_k = _TopKCandidates(scores, k)
+        if top_k is not None:
+            return top_k
+    
+    if k < n_cols:
+        # The k-th largest score is in place after the partition
+        partition = np.argpartition(scores, n_cols - k, axis=1)
+        kth = np.take_along_axis(scores, partition[:, n_cols - k : n_cols - k + 1], axis=1)
+        
+        # Take all scores above the k-th score, and the first of the ties with it
+        winners = scores > kth
+        ties = scores == kth
+        n_ties = k - winners.sum(axis=1, keepdims=True)
+        winners |= ties & (np.cumsum(ties, axis=1) <= n_ties)
+        top_k = np.nonzero(winners)[1].reshape(n_rows, k)
+    else:
+        top_k = np.tile(np.arange(n_cols), (n_rows, 1))
+    
+    # Sort the winners by score, keeping column order for ties
+    top_k_scores = np.take_along_axis(scores, top_k, axis=1)
+    order = np.argsort(-top_k_scores, axis=1, kind="stable")
+    
+    return np.take_along_axis(top_k, order, axis=1), np.take_along_axis(top_k_scores, order, axis=1)
+
+
+class _LayerWeights:
+    """Minimal stand-in for a keras layer, so that `get_layer(name).get_weights()` works"""
+    
+    def __init__(self, weights):
+        self.weights = weights
+
+    def get_weights(self):
+        return [self.weights]
+
+
+class FactorScorer:
+    """Score users and items with the dot product of their embeddings (plus biases)
+    
+    This is the closed-form version of `ExplicitMatrixFactorisation` and
+    `ExplicitMatrixFactorisationBias`. Blocks of users are scored against the items
+    with a single matrix multiply and no keras / tensorflow is needed.
+
+    Params:
+        user_embedding (np.array): User embedding of shape (n_users, n_factors)
+        item_embedding (np.array): Item embedding of shape (n_items, n_factors)
+        user_bias (np.array): User bias of shape (n_users, 1), optional
+        item_bias (np.array): Item bias of shape (n_items, 1), optional
+        min_rating (float): Minimum rating, if the scores are rescaled with a sigmoid
+        max_rating (float): Maximum rating, if the scores are rescaled with a sigmoid
+        name (string): Name of the model type
+        user_encoder (IdEncoder): Encoder of the user ids, optional
+        item_encoder (IdEncoder): Encoder of the item ids, optional
+    """
+
+    def __init__(self, user_embedding, item_embedding, user_bias=None, item_bias=None,
+                 min_rating=None, max_rating=None, name="ExplicitMatrixFactorisation",
+                 user_encoder=None, item_encoder=None):
+        self.user_embedding = user_embedding
+        self.item_embedding = item_embedding
+        self.user_bias = user_bias
+        self.item_bias = item_bias
+        self.min_rating = min_rating
+        self.max_rating = max_rating
+        self.name = name
+        self.user_encoder = user_encoder
+        self.item_encoder = item_encoder
+
+    @property
+    def n_users(self):
+        return self.user_embedding.shape[0]
+
+    @property
+    def n_items(self):
+        return self.item_embedding.shape[0]
+
+    def _Rescale(self, scores):
+        """Apply the sigmoid and rescale to [min_rating, max_rating] in place"""
+        if self.min_rating is None or self.max_rating is None:
+            return scores
+        
+        # sigmoid(x) = (tanh(x / 2) + 1) / 2, which does not overflow
+        np.multiply(scores, 0.5, out=scores)
+        np.tanh(scores, out=scores)
+        np.add(scores, 1, out=scores)
+        np.multiply(scores, 0.5 * (self.max_rating - self.min_rating), out=scores)
+        np.add(scores, self.min_rating, out=scores)
+        return scores
+
+    def score(self, users, items=None):
+        """Score every user in users against every item in items
+        
+        Params:
+            users (np.array): USER ids
+            items (np.array): ITEM ids. If None, all the items are scored.
+        
+        Returns:
+            np.array: Matrix of scores with shape (len(users), len(items))
+        """
+        users = np.asarray(users)
+        item_embedding = self.item_embedding
+        item_bias = self.item_bias
+        if items is not None:
+            items = np.asarray(items)
+            item_embedding = item_embedding[items]
+            item_bias = item_bias[items] if item_bias is not None else None
+        
+        scores = np.dot(self.user_embedding[users], item_embedding.T)
+        if self.user_bias is not None:
+            scores += self.user_bias[users].reshape(-1, 1)
+        if item_bias is not None:
+            scores += item_bias.reshape(1, -1)
+        
+        return self._Rescale(scores)
+
+    def predict(self, X, **kwargs):
+        """Score (user, item) pairs, with the same inputs and output as `model.predict`
+        
+        Params:
+            X (list): [USER ids, ITEM ids] of the same length
+        
+        Returns:
+            np.array: Scores with shape (n, 1)
+        """
+        users, items = np.asarray(X[0]), np.asarray(X[1])
+        
+        scores = np.einsum("ij,ij->i", self.user_embedding[users], self.item_embedding[items])
+        if self.user_bias is not None:
+            scores += self.user_bias[users].ravel()
+        if self.item_bias is not None:
+            scores += self.item_bias[items].ravel()
+        
+        return self._Rescale(scores).reshape(-1, 1)
+
+    def get_layer(self, name):
+        layers = {
+            "UserEmbedding": self.user_embedding,
+            "ItemEmbedding": self.item_embedding,
+            "UserBias": self.user_bias,
+            "ItemBias": self.item_bias,
+        }
+        if layers.get(name) is None:
+            raise ValueError("No such layer: " + name)
+        return _LayerWeights(layers[name])
+
+
+def ExportModel(model, path, min_rating=None, max_rating=None, user_encoder=None,
+                item_encoder=None, dtype="float32"):
+    """Export a trained factorisation model as an artifact for serving
+    
+    The embeddings and biases are saved as .npy files, with the classes of the 
+    encoders and a json manifest (model name, min and max rating). `LoadModel` 
+    memory-maps them and needs no keras.
+
+    Params:
+        model (keras model or FactorScorer): Trained dot product model
+        path (string): Directory to save the artifact to
+        min_rating (float): Minimum rating used to build a model with biases
+        max_rating (float): Maximum rating used to build a model with biases
+        user_encoder (IdEncoder or sklearn.LabelEncoder): Encoder for users, optional
+        item_encoder (IdEncoder or sklearn.LabelEncoder): Encoder for items, optional
+        dtype (string): float32, or float16 to halve the size on disk
+    """
+    if not isinstance(model, FactorScorer):
+        from .recommend import GetFactorScorer
+        model = GetFactorScorer(model, min_rating, max_rating)
+    
+    arrays = {"user_embedding": model.user_embedding, "item_embedding": model.item_embedding}
+    if model.user_bias is not None:
+        arrays.update(user_bias=model.user_bias, item_bias=model.item_bias)
+    arrays = {name: np.asarray(array, dtype=dtype) for name, array in arrays.items()}
+    
+    for name, encoder in [("user_classes", model.user_encoder if user_encoder is None else user_encoder),
+                          ("item_classes", model.item_encoder if item_encoder is None else item_encoder)]:
+        if getattr(encoder, "classes_", None) is not None:
+            arrays[name] = _ClassesArray(encoder.classes_)
+    
+    min_rating = None if model.min_rating is None else float(model.min_rating)
+    max_rating = None if model.max_rating is None else float(model.max_rating)
+    _SaveArrays(path, arrays, {
+        "type": "FactorScorer", "name": model.name, "dtype": dtype,
+        "min_rating": min_rating, "max_rating": max_rating,
+    })
+
+
+def LoadModel(path, mmap=True):
+    """Load an artifact saved with `ExportModel`, without keras
+    
+    The float32 arrays are memory-mapped (read only) by default, so loading is 
+    instant and worker processes share the same pages. float16 arrays are read and 
+    cast to float32 for scoring.
+
+    Params:
+        path (string): Directory of the artifact
+        mmap (boolean): If True, memory-map the arrays instead of reading them
+    
+    Returns:
+        FactorScorer: Scorer with the embeddings, biases and encoders of the model
+    """
+    arrays, manifest = _LoadArrays(path, mmap)
+    
+    factors = {}
+    for name in ["user_embedding", "item_embedding", "user_bias", "item_bias"]:
+        array = arrays.get(name)
+        factors[name] = None if array is None else array.astype(np.float32, copy=False)
+    
+    encoders = {}
+    for name in ["user", "item"]:
+        encoders[name + "_encoder"] = None
+        if name + "_classes" in arrays:
+            encoders[name + "_encoder"] = IdEncoder()
+            encoders[name + "_encoder"]._SetClasses(arrays[name + "_classes"])
+    
+    return FactorScorer(
+        min_rating=manifest["min_rating"], max_rating=manifest["max_rating"],
+        name=manifest["name"], **factors, **encoders
+    )
@@ -1,6 +1,9 @@
 import numpy as np
 import pandas as pd
-import os, time, sys, math
+import os, time, sys, math, json
+from .preprocessing import InteractionMatrix, Downcast
+from .encoder import _SmallestIntDtype
+from .serving import _SaveArrays, _LoadArrays, _TopKCandidates, _TopKDense
 
 
 def CreateDirectory(directory_path):
@@ -41,46 +44,151 @@ def _MergeRatingTruePred(rating_true, rating_pred):
   np.array: Array with true ratings
   np.array: Array with predicted ratings
   """
+  if isinstance(rating_true, InteractionMatrix):
+    rating_true = rating_true.to_df()
+  
   suffixes = ["_TRUE", "_PRED"]
   rating_true_pred = pd.merge(rating_true, rating_pred, on=["USER", "ITEM"], suffixes=suffixes)
 
   return rating_true_pred["RATING_TRUE"], rating_true_pred["RATING_PRED"]
 
 
-def _UserItemCrossJoin(df):
+def _UserItemGrid(users, items, chunk_size=None):
+    """Generate the cross-join of users and items as numpy arrays
+    
+    The grid is ordered by user and then by item, i.e. the same order as a nested
+    loop over users and items. Ids are cast to the smallest integer dtype that 
+    holds them.
+
+    Params:
+        users (np.array): Unique user ids
+        items (np.array): Unique item ids
+        chunk_size (int): Number of (user, item) pairs per chunk. If None, the 
+            whole grid is generated as a single chunk.
+
+    Yields:
+        np.array: USER ids for the chunk
+        np.array: ITEM ids for the chunk
+    """
+    users = np.asarray(users)
+    items = np.asarray(items)
+    users = users.astype(_SmallestIntDtype(users, np.int16), copy=False)
+    items = items.astype(_SmallestIntDtype(items, np.int16), copy=False)
+    n_users, n_items = len(users), len(items)
+    n_pairs = n_users * n_items
+
+    if chunk_size is None:
+        yield np.repeat(users, n_items), np.tile(items, n_users)
+        return
+    
+    for start in range(0, n_pairs, chunk_size):
+        pairs = np.arange(start, min(start + chunk_size, n_pairs), dtype=np.int64)
+        yield users[pairs // n_items], items[pairs % n_items]
+
+
+def _UserItemCrossJoin(df, chunk_size=None):
     """
     Get cross-join of all users and items
     
     Args:
         df (pd.DataFrame): Source dataframe.
+        chunk_size (int): Number of rows per chunk. If None, the whole cross-join
+            is returned as one DataFrame, else a generator of DataFrames is returned.
 
     Returns:
-        pd.DataFrame: Dataframe with crossjoins
+        pd.DataFrame: Dataframe with crossjoins (or a generator of chunks)
     
     """
+    grid = _UserItemGrid(df.USER.unique(), df.ITEM.unique(), chunk_size)
+
+    if chunk_size is None:
+        users, items = next(grid)
+        return pd.DataFrame({"USER": users, "ITEM": items})
     
-    crossjoin_list = []
-    for user in df.USER.unique():
-        for item in df.ITEM.unique():
-            crossjoin_list.append([user, item])
+    return (pd.DataFrame({"USER": users, "ITEM": items}) for users, items in grid)
+    
+
+def _PairKeys(df, filter_by_df, filter_by_cols):
+    """Encode (USER, ITEM) pairs of both dataframes as a single int64 key
+    
+    Args:
+        df (pd.DataFrame): Source dataframe.
+        filter_by_df (pd.DataFrame): Filter dataframe.
+        filter_by_cols (iterable of str): The two (user, item) columns.
 
-    cross_join_df = pd.DataFrame(data=crossjoin_list, columns=["USER", "ITEM"])
+    Returns:
+        np.array: Keys of df (or None if the columns are not non-negative integer ids)
+        np.array: Keys of filter_by_df
+    """
+    if len(filter_by_cols) != 2:
+        return None, None
     
-    return cross_join_df
+    col_user, col_item = filter_by_cols
+    columns = [df[col_user], df[col_item], filter_by_df[col_user], filter_by_df[col_item]]
+    if any(column.dtype.kind not in "iu" for column in columns) or min(map(len, columns)) == 0:
+        return None, None
+    if min(column.min() for column in columns) < 0:
+        return None, None
     
+    # Sizes are Python ints and keys int64, so compact (e.g. uint8) ids cannot overflow
+    n_users = int(max(columns[0].max(), columns[2].max())) + 1
+    n_items = int(max(columns[1].max(), columns[3].max())) + 1
+    if n_users * n_items >= 2 ** 62:
+        return None, None
+    
+    keys = df[col_user].values.astype(np.int64) * n_items + df[col_item].values.astype(np.int64)
+    filter_keys = (filter_by_df[col_user].values.astype(np.int64) * n_items 
+                   + filter_by_df[col_item].values.astype(np.int64))
+    return keys, filter_keys
+
+
+def _IsIn(keys, filter_keys, assume_unique=False):
+    """Check whether each key is in filter_keys, with a sorted search
+    
+    Args:
+        keys (np.array): int64 keys
+        filter_keys (np.array): int64 keys to look for
+        assume_unique (boolean): If True, filter_keys are already sorted and unique
 
-def _FilterBy(df, filter_by_df, filter_by_cols):
+    Returns:
+        np.array: Boolean array, True where the key is in filter_keys
+    """
+    if not assume_unique:
+        filter_keys = np.unique(filter_keys)
+    if len(filter_keys) == 0:
+        return np.zeros(np.shape(keys), dtype=bool)
+    
+    position = np.minimum(np.searchsorted(filter_keys, keys), len(filter_keys) - 1)
+    return filter_keys[position] == keys
+
+
+def _FilterBy(df, filter_by_df, filter_by_cols, method="auto"):
     """From the input DataFrame (df), remove the records whose target column (filter_by_cols) values are
     exist in the filter-by DataFrame (filter_by_df)
 
     Args:
         df (pd.DataFrame): Source dataframe.
-        filter_by_df (pd.DataFrame): Filter dataframe.
+        filter_by_df (pd.DataFrame or InteractionMatrix): Filter dataframe (or the
+            interaction matrix, for filter_by_cols [USER, ITEM]).
         filter_by_cols (iterable of str): Filter columns.
+        method (str): "key" encodes a (user, item) pair of integer ids as one int64 key 
+            and uses a sorted search, "index" uses a pandas MultiIndex. "auto" uses 
+            "key" when the columns allow it.
 
     Returns:
         pd.DataFrame: Dataframe filtered by filter_by_df on filter_by_cols
     """
+    
+    if isinstance(filter_by_df, InteractionMatrix):
+        col_user, col_item = filter_by_cols
+        return df.loc[~filter_by_df.contains(df[col_user].values, df[col_item].values)]
+
+    if method in ("auto", "key"):
+        keys, filter_keys = _PairKeys(df, filter_by_df, filter_by_cols)
+        if keys is not None:
+            return df.loc[~_IsIn(keys, filter_keys)]
+        if method == "key":
+            raise ValueError("key filtering needs two columns of non-negative integer ids")
 
     return df.loc[
         ~df.set_index(filter_by_cols).index.isin(
@@ -89,9 +197,41 @@ def _FilterBy(df, filter_by_df, filter_by_cols):
     ]
 
 
+def _MaskSeen(scores, users, seen, item_columns=None):
+    """Set the scores of the items already seen by the users to -inf, in place
+    
+    Args:
+        scores (np.array): Score matrix (len(users), n_columns) of a block of users
+        users (np.array): USER ids of the rows of the block
+        seen (InteractionMatrix): Seen items of all users
+        item_columns (np.array): Column of each ITEM id in scores (-1 if not scored). 
+            If None, the column is the ITEM id.
+
+    Returns:
+        np.array: The scores, with the seen items masked
+    """
+    users = np.asarray(users)
+    inside = users < seen.n_users
+    block = seen.csr[users[inside]]
+    
+    rows = np.repeat(np.flatnonzero(inside), np.diff(block.indptr))
+    columns = block.indices
+    if item_columns is not None:
+        columns = item_columns[columns]
+        rows, columns = rows[columns >= 0], columns[columns >= 0]
+    
+    scores[rows, columns] = -np.inf
+    return scores
+
+
 def _GetTopKItems(df, col_user, col_rating, k):
     """Get the top k items for each user.
 
+    The rows of each user form a segment of the table sorted by user. Segments of
+    similar length are stacked into a dense matrix, so the top k of every segment 
+    is selected at once with `_TopKDense`. Ties keep the order of the dataframe 
+    and missing ratings are ranked last (as in `pd.DataFrame.nlargest`).
+
     Params:
         dataframe (pandas.DataFrame): DataFrame of rating data
         col_user (str): column name for user
@@ -101,30 +241,66 @@ def _GetTopKItems(df, col_user, col_rating, k):
     Returns:
         pd.DataFrame: DataFrame of top k items for each user, sorted by `col_user` and `rank`
     """
-    # Sort dataframe by col_user and (top k) col_rating
-    top_k_items = (
-        df.groupby(col_user, as_index=False)
-        .apply(lambda x: x.nlargest(k, col_rating))
-        .reset_index(drop=True)
-    )
-    # Add ranks
-    top_k_items["rank"] = top_k_items.groupby(col_user, sort=False).cumcount() + 1
+    if df.shape[0] == 0:
+        return df.assign(rank=np.array([], dtype=np.int64)).reset_index(drop=True)
+    
+    rating = df[col_rating].values.astype(np.float64)
+    rating[np.isnan(rating)] = -np.inf
+    
+    # Sort by user (stable, so the rows of a user keep their order)
+    user_codes = pd.factorize(df[col_user], sort=True)[0]
+    if np.all(user_codes[1:] >= user_codes[:-1]):
+        order = np.arange(len(user_codes))
+    else:
+        order = np.argsort(user_codes, kind="stable")
+    rating = rating[order]
+    
+    # Segment of each user in the sorted table
+    seg_length = np.bincount(user_codes)
+    seg_start = np.cumsum(seg_length) - seg_length
+    
+    # Select the top k of the segments, in buckets of similar length
+    bucket = np.ceil(np.log2(np.maximum(seg_length, 1))).astype(int)
+    top_k_rows, top_k_rank, top_k_user = [], [], []
+    for b in np.unique(bucket):
+        segs = np.flatnonzero(bucket == b)
+        cols = np.arange(seg_length[segs].max())
+        rows = seg_start[segs, None] + cols
+        valid = cols < seg_length[segs, None]
+        
+        # Padding is placed after the ratings, so it loses ties against -inf
+        dense = np.full(rows.shape, -np.inf)
+        dense[valid] = rating[rows[valid]]
+        top_k, _ = _TopKDense(dense, k)
+        
+        keep = top_k < seg_length[segs, None]
+        top_k_rows.append(np.take_along_axis(rows, top_k, axis=1)[keep])
+        top_k_rank.append(np.nonzero(keep)[1] + 1)
+        top_k_user.append(np.repeat(segs, keep.sum(axis=1)))
+    
+    top_k_rows = np.concatenate(top_k_rows)
+    top_k_rank = np.concatenate(top_k_rank)
+    by_user_rank = np.lexsort((top_k_rank, np.concatenate(top_k_user)))
+    
+    top_k_items = df.iloc[order[top_k_rows[by_user_rank]]].reset_index(drop=True)
+    top_k_items["rank"] = top_k_rank[by_user_rank]
     return top_k_items
 
 
-
-
 def _GetHitDF(rating_true, rating_pred, k):
     """Get Hit defined by relevancy, a hit usually means whether the recommended "k" items hit the "relevant" items by the user.
     
     Params:
-    rating_true (pd.DataFrame): Ground Truth Ratings. There should be no duplicate
+    rating_true (pd.DataFrame or InteractionMatrix): Ground Truth Ratings. There should be no duplicate
     rating_pred (pd.DataFrame): Predicated Ratings.
     k (int): Number of items presented
 
     Returns:
     pd.DataFrame: Whether recommended K items hit the relevant item by user
     """    
+    
+    if isinstance(rating_true, InteractionMatrix):
+        rating_true = rating_true.to_df()
 
 
     # Make sure the prediction and true data frames have the same set of users
@@ -149,72 +325,299 @@ def _GetHitDF(rating_true, rating_pred, k):
     
     return df_hit, df_hit_count, n_users
 
-def NegativeSamples(df, rating_threshold, ratio_neg_per_user=1):
+def _GetHitMatrix(rating_true, rating_pred, k, gain=False):
+    """Get the hit matrix, i.e. whether the item recommended at each rank (up to k) is relevant for the user.
+    
+    Params:
+    rating_true (pd.DataFrame or InteractionMatrix): Ground Truth Ratings. There should be no duplicate
+    rating_pred (pd.DataFrame): Predicated Ratings.
+    k (int): Number of items presented
+    gain (boolean): If True, the hit matrix holds the true RATING of the hits instead of True
+
+    Returns:
+    np.array: Matrix (n_users, k), True (or the true RATING) if the item at rank j + 1 is a hit
+    np.array: Number of relevant items for each user (users sorted by USER)
+    int: Number of users in both rating_true and rating_pred
+    """
+    
+    if isinstance(rating_true, InteractionMatrix):
+        return _GetHitMatrixSparse(rating_true, rating_pred, k, gain)
+    
+    # Make sure the prediction and true data frames have the same set of users
+    rating_true_common = rating_true[rating_true["USER"].isin(rating_pred["USER"].unique())]
+    rating_pred_common = rating_pred[rating_pred["USER"].isin(rating_true["USER"].unique())]
+    users, actual = np.unique(rating_true_common["USER"].values, return_counts=True)
+    n_users = len(users)
+
+    # Top k once, and the ranks at which it hits the relevant items
+    df_hit = _GetTopKItems(rating_pred_common, "USER", "RATING", k)
+    df_hit = pd.merge(
+        df_hit[["USER", "ITEM", "rank"]], rating_true_common[["USER", "ITEM", "RATING"]], 
+        on=["USER", "ITEM"]
+    )
+    
+    hits = np.zeros((n_users, k), dtype=np.float64 if gain else bool)
+    hits[np.searchsorted(users, df_hit["USER"].values), df_hit["rank"].values - 1] = (
+        df_hit["RATING"].values if gain else True
+    )
+
+    return hits, actual, n_users
+
+
+def _GetHitMatrixSparse(rating_true, rating_pred, k, gain=False):
+    """Get the hit matrix for ground truth ratings held in an interaction matrix (see `_GetHitMatrix`)"""
+    
+    # Users with ground truth ratings, which are also in the predictions
+    actual = np.diff(rating_true.csr.indptr)
+    pred_users = rating_pred["USER"].values
+    in_true = (pred_users >= 0) & (pred_users < rating_true.n_users)
+    in_true[in_true] = actual[pred_users[in_true]] > 0
+    users = np.unique(pred_users[in_true])
+    n_users = len(users)
+    
+    # Top k once, and the ranks at which it hits the relevant items
+    df_hit = _GetTopKItems(rating_pred[in_true], "USER", "RATING", k)
+    position = rating_true.find(df_hit["USER"].values, df_hit["ITEM"].values)
+    is_hit = position >= 0
+    
+    hits = np.zeros((n_users, k), dtype=np.float64 if gain else bool)
+    rows = np.searchsorted(users, df_hit["USER"].values[is_hit])
+    cols = df_hit["rank"].values[is_hit] - 1
+    hits[rows, cols] = rating_true.csr.data[position[is_hit]] if gain else True
+    
+    return hits, actual[users], n_users
+
+
+def _ItemWeights(items, n_items, sampling="uniform"):
+    """Sampling weight of each item for the negative samples
+    
+    Popularity weights are the number of interactions of each item plus one, so that
+    items without interactions can still be sampled.
+
+    Args:
+        items (np.array): ITEM (0 to n_items - 1) of each interaction
+        n_items (int): Number of items
+        sampling (str): "uniform" or "popularity"
+
+    Returns:
+        np.array: Weight of each item (n_items,), or None for uniform sampling
+    """
+    if sampling == "popularity":
+        return np.bincount(items, minlength=n_items) + 1.0
+    if sampling == "uniform":
+        return None
+    raise ValueError("sampling should be uniform or popularity: " + str(sampling))
+
+
+def _SampleNegatives(n_neg, pos_keys, n_items, seed=42, item_weights=None, max_rounds=10, block_size=None):
+    """Sample distinct negative items for each user, rejecting the positive items.
+
+    Candidates are drawn for all the users at once and rejected if they are positive 
+    or already drawn, and the users still short of negatives draw again. A user whose
+    remaining items hold little of the sampling weight (so rejection would draw more 
+    than half the catalog), or still short after max_rounds, samples exactly instead:
+    the remaining items of a block of such users get Gumbel keys (log weight plus 
+    Gumbel noise) and the largest keys are a weighted sample without replacement.
+
+    Args:
+        n_neg (np.array): Number of negatives for each user (0 to n_users - 1)
+        pos_keys (np.array): Sorted unique int64 keys (USER * n_items + ITEM) of the positives
+        n_items (int): Number of items (0 to n_items - 1)
+        seed (int): Random seed
+        item_weights (np.array): Sampling weight of each item. If None, sample uniformly.
+        max_rounds (int): Number of rounds of vectorized rejection sampling
+        block_size (int): Users sampled exactly at once. Defaults to 4M keys per block
+
+    Returns:
+        np.array: USER of each negative sample (sorted)
+        np.array: ITEM of each negative sample
+    """
+    rng = np.random.default_rng(seed)
+    p = None if item_weights is None else item_weights / item_weights.sum()
+    weights = np.full(n_items, 1 / n_items) if p is None else p
+    
+    need = np.asarray(n_neg, dtype=np.int64).copy()
+    pos_weight = np.bincount(pos_keys // n_items, weights=weights[pos_keys % n_items], minlength=len(need))
+    taken_keys = np.array([], dtype=np.int64)
+    
+    for _ in range(max_rounds):
+        # Draws needed per user, from the probability of a draw to be accepted
+        taken_weight = np.bincount(taken_keys // n_items, weights=weights[taken_keys % n_items], minlength=len(need))
+        accepted = np.maximum(1 - pos_weight - taken_weight, np.finfo(np.float64).tiny)
+        n_draw = need / accepted
+        active = np.flatnonzero((need > 0) & (n_draw <= n_items / 2))
+        if len(active) == 0:
+            break
+        
+        # Draw extra candidates to make up for the rejected ones
+        users = np.repeat(active, np.ceil(n_draw[active]).astype(np.int64) + 1)
+        items = rng.choice(n_items, size=len(users), p=p)
+        keys = users * n_items + items
+        
+        # Reject positives and duplicates, keeping the order in which they were drawn
+        keys = keys[~_IsIn(keys, pos_keys, True) & ~_IsIn(keys, taken_keys, True)]
+        keys = keys[np.sort(np.unique(keys, return_index=True)[1])]
+        
+        # Keep at most the needed number of candidates per user
+        users = keys // n_items
+        order = np.argsort(users, kind="stable")
+        users, keys = users[order], keys[order]
+        starts = np.searchsorted(users, users, side="left")
+        keys = keys[np.arange(len(keys)) - starts < need[users]]
+        
+        need -= np.bincount(keys // n_items, minlength=len(need))
+        taken_keys = np.union1d(taken_keys, keys)
+    
+    # Sample the remaining users exactly, a block of users at a time
+    remaining_users = np.flatnonzero(need > 0)
+    block_size = block_size or max(1, 2 ** 22 // n_items)
+    with np.errstate(divide="ignore"):
+        log_weights = np.log(weights)
+    extra_keys = []
+    for start in range(0, len(remaining_users), block_size):
+        users = remaining_users[start : start + block_size]
+        user_keys = users[:, None] * n_items + np.arange(n_items)
+        scores = log_weights + rng.gumbel(size=user_keys.shape)
+        scores[_IsIn(user_keys, pos_keys, True) | _IsIn(user_keys, taken_keys, True)] = -np.inf
+        
+        top_k, top_k_scores = _TopKDense(scores, need[users].max())
+        keep = (np.arange(top_k.shape[1]) < need[users, None]) & (top_k_scores > -np.inf)
+        extra_keys.append((users[:, None] * n_items + top_k)[keep])
+    
+    keys = np.sort(np.concatenate([taken_keys] + extra_keys))
+    return keys // n_items, keys % n_items
+
+
+def NegativeSamples(df, rating_threshold, ratio_neg_per_user=1, sampling="uniform", seed=42, lean=False):
     """ function to sample negative feedback from user-item interaction dataset.
 
     This negative sampling function will take the user-item interaction data to create 
     binarized feedback, i.e., 1 and 0 indicate positive and negative feedback, 
-    respectively. 
+    respectively. The negative items of each user are sampled (without replacement)
+    from the items the user has no positive feedback for.
 
     Args:
-        df (pandas.DataFrame): input data that contains user-item tuples.
+        df (pandas.DataFrame or InteractionMatrix): input data that contains user-item tuples.
+            The first three columns are the user, item and rating.
         rating_threshold (int): value below which feedback is set to 0 and above which feedback is set to 1
         ratio_neg_per_user (int): ratio of negative feedback w.r.t to the number of positive feedback for each user. 
+        sampling (str): "uniform" samples items uniformly, "popularity" samples items 
+            in proportion to their number of interactions plus one.
+        seed (int): Random seed
+        lean (boolean): If True, downcast the ids to their smallest safe dtype and the 
+            rating to int8
 
     Returns:
         pandas.DataFrame: data with negative feedback 
     """
     
-    df.columns = ["USER", "ITEM", "RATING", "unix_timestamp"]
-    
-    seed = 42
-    
-    df_pos = df.copy()
-    df_pos["RATING"] = df_pos["RATING"].apply(lambda x: 1 if x >= rating_threshold else 0)
-    df_pos = df_pos[df_pos.RATING>0]
-
-
-    # Create a dataframe for all user-item pairs 
-    df_neg = _UserItemCrossJoin(df)
-
-    #remove positive samples from the cross-join dataframe
-    df_neg = _FilterBy(df_neg, df_pos, ["USER", "ITEM"])    
-
-    #Add a column for rating - setting it to 0
-    df_neg["RATING"] = 0
-   
-    # Combine positive and negative samples into a single dataframe
-    df_all = pd.concat([df_pos, df_neg], ignore_index=True, sort=True)
-    df_all = df_all[["USER", "ITEM", "RATING"]]
-    
-    
-    # Sample negative feedback from the combined dataframe.
-    df_sample = (
-        df_all.groupby("USER")
-        .apply(
-            lambda x: pd.concat(
-                [
-                    x[x["RATING"] == 1],
-                    x[x["RATING"] == 0].sample(
-                        min(
-                            max(
-                                round(len(x[x["RATING"] == 1]) * ratio_neg_per_user), 1
-                            ),
-                            len(x[x["RATING"] == 0]),
-                        ),
-                        random_state=seed,
-                        replace=False,
-                    )
-                    if len(x[x["RATING"] == 0] > 0)
-                    else pd.DataFrame({}, columns=["USER", "ITEM", "RATING"]),
-                ],
-                ignore_index=True,
-                sort=True,
-            )
-        )
-        .reset_index(drop=True)
-        .sort_values("USER")
-    )
+    if isinstance(df, InteractionMatrix):
+        df = df.to_df()
+    user, item, rating = (df.iloc[:, i].values for i in range(3))
+    
+    # Encode users and items as 0..n-1
+    users, user_codes = np.unique(user, return_inverse=True)
+    items, item_codes = np.unique(item, return_inverse=True)
+    n_users, n_items = len(users), len(items)
+    
+    # Positive feedback
+    positive = rating >= rating_threshold
+    pos_users, pos_items = user_codes[positive], item_codes[positive]
+    pos_keys = np.unique(pos_users.astype(np.int64) * n_items + pos_items)
+    
+    # Number of negatives for each user (at least 1, at most the number of non positive items)
+    n_pos = np.bincount(pos_users, minlength=n_users)
+    n_available = n_items - np.bincount(pos_keys // n_items, minlength=n_users)
+    n_neg = np.minimum(np.maximum(np.round(n_pos * ratio_neg_per_user), 1), n_available)
+    
+    item_weights = _ItemWeights(item_codes, n_items, sampling)
+    neg_users, neg_items = _SampleNegatives(n_neg, pos_keys, n_items, seed, item_weights)
+    
+    # Positives and then negatives for each user, sorted by user
+    df_sample = pd.DataFrame({
+        "user_id": users[np.r_[pos_users, neg_users]],
+        "movie_id": items[np.r_[pos_items, neg_items]],
+        "rating": np.r_[np.ones(len(pos_users), dtype=np.int64), np.zeros(len(neg_users), dtype=np.int64)],
+    })
+    order = np.argsort(np.r_[pos_users, neg_users], kind="stable")
+    df_sample = df_sample.iloc[order].reset_index(drop=True)
+    
+    if lean:
+        df_sample = Downcast(df_sample)
+
+    return df_sample
+
+
+def _FoldInFactors(fixed, rows, cols, targets, n_rows, reg=0.1, chunk_size=None):
+    """Solve the factors of some rows by least squares against fixed factors
+    
+    For every row r, finds x minimising sum((fixed[c] . x - t)^2) + reg * |x|^2 over 
+    its interactions (c, t), i.e. the ALS step for the rows with the other side fixed.
+
+    Params:
+        fixed (np.array): Fixed factors (e.g. item embedding) (n_fixed, n_factors)
+        rows (np.array): Row (0..n_rows-1) of each interaction
+        cols (np.array): Index into fixed of each interaction
+        targets (np.array): Target score of each interaction
+        n_rows (int): Number of rows to solve
+        reg (float): L2 regularisation
+        chunk_size (int): Interactions per chunk when summing the normal equations
+
+    Returns:
+        np.array: Factors of the rows (n_rows, n_factors). Rows without interactions 
+            get 0 (the regularised solution): callers check the counts for a fallback
+        np.array: Number of interactions of each row
+    """
+    fixed = np.asarray(fixed, dtype=np.float64)
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    targets = np.asarray(targets, dtype=np.float64)
+    n_factors = fixed.shape[1]
+    chunk_size = chunk_size or max(1, 2 ** 24 // (n_factors * n_factors))
+    
+    # Normal equations (V'V + reg I) x = V't of every row
+    A = np.zeros((n_rows, n_factors, n_factors))
+    b = np.zeros((n_rows, n_factors))
+    for start in range(0, len(rows), chunk_size):
+        V = fixed[cols[start : start + chunk_size]]
+        row = rows[start : start + chunk_size]
+        np.add.at(A, row, V[:, :, None] * V[:, None, :])
+        np.add.at(b, row, V * targets[start : start + chunk_size, None])
+    A += reg * np.eye(n_factors)
+    
+    factors = np.linalg.solve(A, b[:, :, None])[:, :, 0]
+    return factors, np.bincount(rows, minlength=n_rows)
+
+
+def _InverseRescale(ratings, min_rating, max_rating, eps=1e-3):
+    """Invert the sigmoid rescaling of the ratings to [min_rating, max_rating]"""
+    scaled = (np.asarray(ratings, dtype=np.float64) - min_rating) / (max_rating - min_rating)
+    scaled = np.clip(scaled, eps, 1 - eps)
+    return np.log(scaled / (1 - scaled))
 
-    df_sample.columns = ["movie_id", "rating", "user_id"]
-    return df_sample[["user_id", "movie_id", "rating"]]
+
+def MemoryReport(stages):
+    """Report the memory used by the DataFrames of a pipeline
+    
+    Params:
+        stages (dict): Name and pd.DataFrame (or list of pd.DataFrame, e.g. the splits)
+            of each stage, e.g. {"encoded": df, "lean": df_lean}
+    
+    Returns:
+        pd.DataFrame: rows, bytes and bytes per interaction of each stage, with the 
+            dtypes of its columns
+    """
+    report = []
+    for name, dfs in stages.items():
+        dfs = [dfs] if isinstance(dfs, pd.DataFrame) else list(dfs)
+        rows = sum(len(df) for df in dfs)
+        n_bytes = sum(int(df.memory_usage(index=True, deep=True).sum()) for df in dfs)
+        report.append({
+            "stage": name,
+            "rows": rows,
+            "bytes": n_bytes,
+            "bytes_per_interaction": n_bytes / max(rows, 1),
+            "dtypes": ", ".join("{}:{}".format(col, dtype) for col, dtype in dfs[0].dtypes.items()) if dfs else "",
+        })
+    
+    return pd.DataFrame(report).set_index("stage")
@@ -1,5 +1,781 @@
+import os
+import pytest
+import numpy as np
+import pandas as pd
+
 from recoflow import __version__
+from recoflow.utils import _UserItemCrossJoin
 
 
 def test_version():
     assert __version__ == '0.0.7'
+
+
+def test_user_item_crossjoin():
+    df = pd.DataFrame({"USER": [2, 0, 2, 1], "ITEM": [5, 3, 4, 5]})
+    expected = [[user, item] for user in [2, 0, 1] for item in [5, 3, 4]]
+
+    cross_join = _UserItemCrossJoin(df)
+    assert cross_join[["USER", "ITEM"]].values.tolist() == expected
+    assert cross_join.USER.dtype == np.int16
+
+    chunks = list(_UserItemCrossJoin(df, chunk_size=4))
+    assert [len(chunk) for chunk in chunks] == [4, 4, 1]
+    assert pd.concat(chunks)[["USER", "ITEM"]].values.tolist() == expected
+
+
+class _DotModel:
+    """Stand-in for a trained keras model, scoring with a fixed dot product"""
+    
+    def __init__(self, n_users, n_items, n_factors=3, seed=42):
+        rng = np.random.RandomState(seed)
+        self.user_embedding = rng.normal(size=(n_users, n_factors))
+        self.item_embedding = rng.normal(size=(n_items, n_factors))
+
+    def predict(self, X, **kwargs):
+        users, items = np.asarray(X[0]), np.asarray(X[1])
+        scores = (self.user_embedding[users] * self.item_embedding[items]).sum(axis=1)
+        return scores.reshape(-1, 1)
+
+
+def _SampleInteractions(n_users=30, n_items=40, n_ratings=300, seed=42):
+    rng = np.random.RandomState(seed)
+    df = pd.DataFrame({
+        "USER": rng.randint(n_users, size=n_ratings),
+        "ITEM": rng.randint(n_items, size=n_ratings),
+        "RATING": rng.randint(1, 6, size=n_ratings),
+        "TIMESTAMP": rng.randint(10 ** 6, size=n_ratings),
+    })
+    return df.drop_duplicates(["USER", "ITEM"]).reset_index(drop=True)
+
+
+def test_ranking_topk_stream():
+    from recoflow.recommend import GetRankingTopK
+    
+    data = _SampleInteractions()
+    train = data.iloc[: len(data) // 2]
+    model = _DotModel(30, 40)
+    
+    expected = GetRankingTopK(model, data, train, k=4)
+    ranking = GetRankingTopK(model, data, train, k=4, block_size=7)
+    
+    assert len(ranking) == data.USER.nunique() * 4
+    assert ranking[["USER", "ITEM", "rank"]].values.tolist() == (
+        expected[["USER", "ITEM", "rank"]].values.tolist()
+    )
+    np.testing.assert_allclose(ranking.RATING, expected.RATING)
+
+
+def test_factor_scorer_matches_keras():
+    from recoflow.models import ExplicitMatrixFactorisation, ExplicitMatrixFactorisationBias
+    from recoflow.recommend import GetFactorScorer
+    
+    users, items = np.array([0, 3, 5, 5]), np.array([1, 0, 7, 2])
+    for model, min_rating, max_rating in [
+        (ExplicitMatrixFactorisation(6, 8, 4), None, None),
+        (ExplicitMatrixFactorisationBias(6, 8, 4, 1, 5), 1, 5),
+    ]:
+        scorer = GetFactorScorer(model, min_rating, max_rating)
+        expected = model.predict([users, items], verbose=0)
+        
+        np.testing.assert_allclose(scorer.predict([users, items]), expected, rtol=1e-5, atol=1e-6)
+        np.testing.assert_allclose(
+            scorer.score(users, np.arange(8))[np.arange(4), items], expected.ravel(), 
+            rtol=1e-5, atol=1e-6
+        )
+
+
+def test_topk_items():
+    from recoflow.utils import _GetTopKItems, _TopKDense
+    
+    df = pd.DataFrame({
+        "USER": [2, 1, 2, 1, 2, 1, 2],
+        "ITEM": [0, 1, 2, 3, 4, 5, 6],
+        "RATING": [3.0, 1.0, 5.0, np.nan, 3.0, 2.0, 3.0],
+    })
+    top_k = _GetTopKItems(df, "USER", "RATING", k=3)
+    
+    assert top_k.USER.tolist() == [1, 1, 1, 2, 2, 2]
+    assert top_k.ITEM.tolist() == [5, 1, 3, 2, 0, 4]
+    assert top_k["rank"].tolist() == [1, 2, 3, 1, 2, 3]
+    
+    indices, scores = _TopKDense(np.array([[3.0, 1.0, 3.0, 5.0], [0.0, 2.0, 2.0, 2.0]]), k=2)
+    assert indices.tolist() == [[3, 0], [1, 2]]
+    assert scores.tolist() == [[5.0, 3.0], [2.0, 2.0]]
+    
+    # k = 0 gives no columns, for narrow and wide rows
+    for n_cols in [4, 1000]:
+        indices, scores = _TopKDense(np.ones((2, n_cols)), k=0)
+        assert indices.shape == (2, 0) and scores.shape == (2, 0)
+
+
+def test_ranking_metrics_single_pass():
+    from recoflow import metrics
+    
+    rating_true = _SampleInteractions(seed=1)
+    rating_pred = _SampleInteractions(seed=2)
+    ranking_metrics = metrics.RankingMetrics(rating_true, rating_pred, k=[1, 5, 10])
+    
+    assert ranking_metrics.k.tolist() == [1, 5, 10]
+    for _, row in ranking_metrics.iterrows():
+        k = int(row["k"])
+        expected = [
+            metrics.PrecisionK(rating_true, rating_pred, k),
+            metrics.RecallK(rating_true, rating_pred, k),
+            metrics.MeanAveragePrecisionK(rating_true, rating_pred, k),
+            metrics.MeanReciprocalRankK(rating_true, rating_pred, k),
+            metrics.NDCGK(rating_true, rating_pred, k),
+        ]
+        np.testing.assert_allclose(row.values[1:], expected, atol=1e-4)
+
+
+def test_ndcg_graded():
+    from recoflow.metrics import NDCGK
+    
+    rating_true = pd.DataFrame({"USER": [1, 1, 2], "ITEM": [10, 11, 10], "RATING": [5, 3, 4]})
+    rating_pred = pd.DataFrame({"USER": [1, 1, 2, 2], "ITEM": [11, 10, 12, 10], "RATING": [0.9, 0.8, 0.7, 0.6]})
+    
+    binary = ((1 / np.log(2) + 1 / np.log(3)) / (1 / np.log(2) + 1 / np.log(3)) + (1 / np.log(3)) / (1 / np.log(2))) / 2
+    graded = ((3 / np.log(2) + 5 / np.log(3)) / (5 / np.log(2) + 3 / np.log(3)) + (4 / np.log(3)) / (4 / np.log(2))) / 2
+    assert np.isclose(NDCGK(rating_true, rating_pred, k=2), binary)
+    assert np.isclose(NDCGK(rating_true, rating_pred, k=2, graded=True), graded)
+
+
+def test_interaction_matrix():
+    from recoflow.preprocessing import InteractionMatrix
+    from recoflow.utils import _FilterBy
+    from recoflow.metrics import RankingMetrics
+    
+    df = _SampleInteractions()
+    interactions = InteractionMatrix.from_df(df, n_users=30, n_items=40)
+    
+    assert interactions.shape == (30, 40) and interactions.nnz == len(df)
+    assert interactions.csr.indices.dtype == np.int32 and interactions.csr.data.dtype == np.float32
+    assert interactions.seen(3).tolist() == sorted(df[df.USER == 3].ITEM)
+    assert interactions.to_df().sort_values(["USER", "ITEM"]).values.tolist() == (
+        df[["USER", "ITEM", "RATING"]].sort_values(["USER", "ITEM"]).values.tolist()
+    )
+    
+    pred = _SampleInteractions(seed=7)
+    assert _FilterBy(pred, interactions, ["USER", "ITEM"]).equals(_FilterBy(pred, df, ["USER", "ITEM"]))
+    assert RankingMetrics(interactions, pred, k=[1, 5]).equals(RankingMetrics(df, pred, k=[1, 5]))
+
+
+def test_filter_by_methods():
+    from recoflow.preprocessing import InteractionMatrix
+    from recoflow.utils import _FilterBy, _MaskSeen
+    
+    df = _SampleInteractions(seed=3)
+    filter_by_df = _SampleInteractions(seed=4)
+    expected = _FilterBy(df, filter_by_df, ["USER", "ITEM"], method="index")
+    
+    assert _FilterBy(df, filter_by_df, ["USER", "ITEM"], method="key").equals(expected)
+    assert _FilterBy(df, filter_by_df, ["USER", "ITEM"]).equals(expected)
+    
+    seen = InteractionMatrix.from_df(filter_by_df, n_users=30, n_items=40)
+    scores = _MaskSeen(np.zeros((3, 40)), np.array([4, 0, 9]), seen)
+    for row, user in enumerate([4, 0, 9]):
+        assert np.flatnonzero(np.isinf(scores[row])).tolist() == sorted(filter_by_df[filter_by_df.USER == user].ITEM)
+
+    # Compact unsigned ids at the dtype boundary (255 + 1 must not wrap to 0)
+    for dtype in [np.uint8, np.uint16, np.uint64]:
+        top = int(np.iinfo(dtype).max) if dtype != np.uint64 else 2 ** 40
+        pairs = pd.DataFrame({"USER": [0, 1, 1, 2, 2], "ITEM": [top, 0, top, 1, top - 1]}).astype(dtype)
+        seen = pd.DataFrame({"USER": [0, 1], "ITEM": [top, 0]}).astype(dtype)
+        filtered = _FilterBy(pairs, seen, ["USER", "ITEM"], method="key")
+        assert filtered.equals(_FilterBy(pairs, seen, ["USER", "ITEM"], method="index"))
+        assert filtered.values.tolist() == [[1, top], [2, 1], [2, top - 1]]
+
+
+def test_splitter():
+    from recoflow.preprocessing import ChronoSplit, StratifiedSplit, LeaveLastNSplit, RandomSplit
+    
+    df = _SampleInteractions()
+    train, test = ChronoSplit(df, [0.7, 0.3])
+    for user, group in df.sort_values("TIMESTAMP", kind="mergesort").groupby("USER"):
+        expected = RandomSplit(group, [0.7, 0.3])
+        assert train[train.USER == user].index.tolist() == expected[0].index.tolist()
+        assert test[test.USER == user].index.tolist() == expected[1].index.tolist()
+    
+    splits = StratifiedSplit(df, [0.6, 0.2, 0.2], by="ITEM")
+    assert sum(map(len, splits)) == len(df)
+    assert [split.split_index.unique().tolist() for split in splits] == [[0], [1], [2]]
+    
+    train, test = LeaveLastNSplit(df, n=2)
+    sizes = df.groupby("USER").size()
+    assert set(test.USER) == set(sizes[sizes > 2].index)
+    assert (test.groupby("USER").size() == 2).all()
+    assert (test.groupby("USER").TIMESTAMP.min() >= train.groupby("USER").TIMESTAMP.max()[test.USER.unique()]).all()
+
+
+def test_negative_samples():
+    from recoflow.utils import NegativeSamples
+    
+    df = _SampleInteractions()
+    columns = df.columns.tolist()
+    for sampling in ["uniform", "popularity"]:
+        df_sample = NegativeSamples(df, 3, ratio_neg_per_user=2, sampling=sampling)
+        
+        positives = df[df.RATING >= 3]
+        df_neg = df_sample[df_sample.rating == 0]
+        assert df.columns.tolist() == columns
+        assert (df_sample.rating == 1).sum() == len(positives)
+        assert not df_neg.duplicated().any()
+        assert df_neg.merge(positives, left_on=["user_id", "movie_id"], right_on=["USER", "ITEM"]).empty
+        
+        n_pos = positives.groupby("USER").size().reindex(df.USER.unique(), fill_value=0)
+        expected = np.minimum(np.maximum(np.round(n_pos * 2), 1), 40 - n_pos)
+        assert df_neg.groupby("user_id").size().reindex(n_pos.index).tolist() == expected.tolist()
+        assert df_sample.equals(NegativeSamples(df, 3, ratio_neg_per_user=2, sampling=sampling))
+
+
+def test_sample_negatives_exact():
+    from recoflow.utils import _SampleNegatives
+
+    # Positives hold most of the weight: rejection gives way to the exact sampling
+    n_users, n_items = 50, 30
+    pos_keys = (np.arange(n_users)[:, None] * n_items + np.arange(5)).ravel()
+    weights = np.r_[np.full(5, 100.0), np.arange(1, 26)]
+    need = np.r_[np.full(25, 3), np.full(25, 25)]
+    for max_rounds in [0, 10]:
+        users, items = _SampleNegatives(need, pos_keys, n_items, item_weights=weights,
+                                        max_rounds=max_rounds, block_size=7)
+        keys = users * n_items + items
+        assert (np.bincount(users, minlength=n_users) == need).all()
+        assert len(np.unique(keys)) == len(keys) and not np.isin(keys, pos_keys).any()
+
+
+def test_negative_sampling_sequence():
+    from recoflow.sequence import NegativeSamplingSequence
+    
+    df = _SampleInteractions()
+    sequence = NegativeSamplingSequence(df, n_items=40, ratio_neg=2, batch_size=64)
+    (users, items), labels = sequence[0]
+    assert len(users) == len(items) == len(labels) == 64
+    assert len(sequence) == int(np.ceil(len(sequence.labels) / 64))
+    
+    positives = set(zip(df.USER, df.ITEM))
+    negatives = set(zip(sequence.users[sequence.labels == 0], sequence.items[sequence.labels == 0]))
+    assert len(negatives) == (sequence.labels == 0).sum() == sequence.n_neg.sum()
+    assert not negatives & positives
+    
+    sequence.on_epoch_end()
+    assert set(zip(sequence.users[sequence.labels == 0], sequence.items[sequence.labels == 0])) != negatives
+    
+    # Popularity counts all the interactions (plus one), as in NegativeSamples
+    popular = NegativeSamplingSequence(df, n_items=40, rating_threshold=3, sampling="popularity")
+    assert (popular.item_weights == np.bincount(df.ITEM, minlength=40) + 1).all()
+
+
+def test_similarity_index(tmp_path):
+    from recoflow.recommend import SimilarityIndex, GetSimilar
+
+    rng = np.random.default_rng(0)
+    embedding = rng.normal(size=(500, 8))
+
+    for metric in ["cosine", "dot", "euclidean"]:
+        index = SimilarityIndex(metric=metric, n_lists=10, n_probe=10).build(embedding)
+        # Probing every list is an exact search
+        report = index.recall(k=5, n_probe=[1, 10], n_sample=100)
+        assert report["Recall@k"].iloc[-1] == 1.0
+        assert report["Recall@k"].iloc[0] <= 1.0
+
+    index = SimilarityIndex(n_lists=10, n_probe=10).build(embedding)
+    index.save(str(tmp_path / "index"))
+    loaded = SimilarityIndex.load(str(tmp_path / "index"))
+    assert isinstance(loaded.vectors, np.memmap)
+
+    indices = GetSimilar(embedding, k=3, index=loaded)
+    assert indices.shape == (500, 4)
+    assert (indices[:, 0] == np.arange(500)).all()
+
+    # The concatenated lists and the per list scoring give the same neighbours
+    queries, exclude = loaded.vectors[:50], loaded.ids[:50]
+    ids, scores = loaded.query(queries, k=5, n_probe=3, exclude=exclude, block_size=16)
+    by_list = np.full((50, 5), -1), np.full((50, 5), -np.inf, dtype=np.float32)
+    loaded._ScoreByList(queries, loaded._Probe(queries, 3), exclude, *by_list)
+    assert (ids == by_list[0]).all() and np.allclose(scores, by_list[1])
+
+    # Each row is the item itself, then its neighbours (the item is not among them)
+    dot_index = SimilarityIndex(metric="dot", n_lists=10, n_probe=10).build(embedding)
+    dot = GetSimilar(embedding, k=3, index=dot_index)
+    assert (dot[:, 0] == np.arange(500)).all()
+    assert not (dot[:, 1:] == np.arange(500)[:, None]).any()
+    assert (dot == GetSimilar(embedding, k=3, metric="dot")).all()
+
+    # The metric has to be the one of the index
+    assert (GetSimilar(embedding, k=3, metric="cosine", index=loaded) == indices).all()
+    with pytest.raises(ValueError):
+        GetSimilar(embedding, k=3, metric="euclidean", index=loaded)
+
+    ids, scores = loaded.query(embedding[:5], k=3, exclude=np.arange(5))
+    assert (ids != np.arange(5)[:, None]).all()
+    assert (np.diff(scores, axis=1) <= 0).all()
+
+
+def test_similar_topk_blocked():
+    from recoflow.recommend import GetSimilar, _GetSimilar, _SimilarTopK
+
+    rng = np.random.default_rng(1)
+    embedding = rng.normal(size=(200, 8))
+
+    normed = embedding / np.linalg.norm(embedding, axis=1, keepdims=True)
+    cosine = normed @ normed.T
+    np.fill_diagonal(cosine, -np.inf)
+    expected = np.argsort(-cosine, axis=1, kind="stable")[:, :4]
+
+    indices, scores = _SimilarTopK(embedding, 4, "cosine", block_size=17, n_jobs=3)
+    assert (indices == expected).all()
+    assert np.allclose(scores, np.take_along_axis(cosine, expected, axis=1), atol=1e-5)
+
+    # Self first, then the k neighbours
+    similar = GetSimilar(embedding, k=4)
+    assert (similar[:, 0] == np.arange(200)).all()
+    assert (similar[:, 1:] == expected).all()
+
+    # Euclidean differs from cosine for vectors of different norms
+    euclidean = GetSimilar(embedding * rng.uniform(0.1, 10, size=(200, 1)), k=4, metric="euclidean")
+    assert (euclidean[:, 0] == np.arange(200)).all()
+    assert not (euclidean[:, 1:] == expected).all()
+
+    # k = 1 is only the row itself
+    distances, indices = _GetSimilar(embedding, 1)
+    assert (indices == np.arange(200)[:, None]).all()
+    assert (distances == 0).all()
+
+
+def test_similar_items_table(tmp_path):
+    from recoflow.recommend import GetSimilar, BuildSimilarItems, SimilarItems
+    from sklearn.preprocessing import LabelEncoder
+
+    rng = np.random.default_rng(2)
+    embedding = rng.normal(size=(50, 8))
+    item_encoder = LabelEncoder().fit(["item_{:02d}".format(i) for i in range(50)])
+
+    path = str(tmp_path / "similar")
+    BuildSimilarItems(embedding, path, k=5, item_encoder=item_encoder)
+    table = SimilarItems(path)
+
+    assert len(table) == 50
+    assert table.neighbors.dtype == np.int32 and table.scores.dtype == np.float16
+    assert isinstance(table.neighbors, np.memmap)
+    assert (np.asarray(table[7]) == GetSimilar(embedding, k=5)[7]).all()
+
+    indices, scores = table.similar(7)
+    assert len(indices) == 5 and (np.diff(scores.astype(float)) <= 0).all()
+    assert (table.inverse_transform(table[7]) == item_encoder.inverse_transform(table[7])).all()
+
+    # Integer ids (in an object column, as read by pandas) stay integers
+    movie_ids = pd.Series(np.arange(50) + 1, dtype=object)
+    BuildSimilarItems(embedding, path, k=5, item_encoder=LabelEncoder().fit(movie_ids))
+    table = SimilarItems(path)
+    assert table.classes_.dtype.kind == "i"
+    items = pd.DataFrame({"movie_id": np.arange(50) + 1})
+    assert items.movie_id.isin(table.inverse_transform(table[49])).sum() == 6
+    assert table.inverse_transform(table[49])[0] == 50
+
+
+def test_id_encoder(tmp_path):
+    from recoflow.encoder import IdEncoder
+    from recoflow.preprocessing import EncodeUserItem
+    from sklearn.preprocessing import LabelEncoder
+
+    ids = np.array(["u3", "u1", "u2", "u1", "u9", "u3"])
+    encoder = IdEncoder()
+    codes = encoder.fit_transform(ids)
+    assert codes.dtype == np.int16
+    assert (codes == LabelEncoder().fit_transform(ids)).all()
+    assert (encoder.inverse_transform(codes) == ids).all()
+
+    # New ids are appended without changing the known codes
+    encoder.partial_fit(["u0", "u2", "u5"])
+    assert (encoder.transform(ids) == codes).all()
+    assert (encoder.transform(["u0", "u5"]) == [4, 5]).all()
+    with pytest.raises(ValueError):
+        encoder.transform(["u7"])
+    # Large batches are deduplicated with pandas, small ones with numpy
+    assert (encoder.transform(np.tile(ids, 20000)) == np.tile(codes, 20000)).all()
+
+    encoder.save(str(tmp_path / "users.npy"))
+    loaded = IdEncoder.load(str(tmp_path / "users.npy"))
+    assert (loaded.classes_ == encoder.classes_).all()
+
+    df = _SampleInteractions().rename(columns={"USER": "user_id", "ITEM": "movie_id"})
+    df["user_id"] += 100
+    encoded, n_users, n_items, user_encoder, item_encoder = EncodeUserItem(
+        df, "user_id", "movie_id", "RATING", "TIMESTAMP")
+    assert (encoded.USER == LabelEncoder().fit_transform(df.user_id)).all()
+    assert (user_encoder.inverse_transform(encoded.USER) == df.user_id).all()
+    assert n_items == df.movie_id.nunique()
+
+
+def test_grow_model_fold_in():
+    from recoflow.models import ExplicitMatrixFactorisationBias, GrowModel
+    from recoflow.recommend import GetFactorScorer
+
+    n_users, n_items, n_factors = 20, 30, 4
+    model = ExplicitMatrixFactorisationBias(n_users, n_items, n_factors, 1, 5)
+    old_items = model.get_layer("ItemEmbedding").get_weights()[0]
+
+    # New user 20 rates old items with scores from known factors
+    rng = np.random.RandomState(0)
+    true_factors = rng.normal(size=n_factors) * 0.5
+    scorer = GetFactorScorer(model, 1, 5)
+    scorer.user_embedding = np.vstack([scorer.user_embedding, true_factors])
+    scorer.user_bias = np.vstack([scorer.user_bias, [[0.0]]])
+    items = np.arange(n_items)
+    new = pd.DataFrame({
+        "USER": 20, "ITEM": items,
+        "RATING": scorer.predict([np.full(n_items, 20), items]).ravel(),
+    })
+
+    # The 2 new items have no interactions: they stay at the mean, with a warning
+    with pytest.warns(UserWarning, match="2 new item rows have no interactions"):
+        grown = GrowModel(model, 21, 32, 1, 5, init="fold_in", interactions=new, reg=1e-6)
+    user_embedding = grown.get_layer("UserEmbedding").get_weights()[0]
+    item_embedding = grown.get_layer("ItemEmbedding").get_weights()[0]
+
+    assert user_embedding.shape == (21, n_factors) and item_embedding.shape == (32, n_factors)
+    assert np.allclose(item_embedding[:n_items], old_items)
+    assert np.allclose(item_embedding[n_items:], old_items.mean(axis=0))
+    assert np.allclose(user_embedding[20], true_factors, atol=1e-2)
+
+
+def test_fold_in_recommender():
+    from recoflow.recommend import FactorScorer, FoldInRecommender
+
+    rng = np.random.RandomState(3)
+    scorer = FactorScorer(
+        rng.normal(size=(10, 4)), rng.normal(size=(50, 4)),
+        rng.normal(size=(10, 1)), rng.normal(size=(50, 1)), 1, 5,
+    )
+    # Ratings of user 3, who is then served as a new user
+    items = np.arange(0, 50, 2)
+    ratings = scorer.predict([np.full(len(items), 3), items]).ravel()
+
+    recommender = FoldInRecommender(scorer, reg=1e-6, ttl=60)
+    factors, bias = recommender.fold_in(items, ratings, user="new")
+    assert np.allclose(factors, scorer.user_embedding[3], atol=1e-3)
+    assert np.isclose(bias, scorer.user_bias[3, 0], atol=1e-3)
+    assert recommender.fold_in(items, ratings, user="new")[0] is factors
+
+    # New ratings within the ttl are not served from the cache
+    more_items = np.append(items, 1)
+    more_ratings = scorer.predict([np.full(len(more_items), 7), more_items]).ravel()
+    refolded, _ = recommender.fold_in(more_items, more_ratings, user="new")
+    assert not np.allclose(refolded, factors)
+    assert np.allclose(refolded, recommender.fold_in(more_items, more_ratings)[0])
+    with pytest.warns(UserWarning, match="No interactions"):
+        assert (recommender.fold_in([], [])[0] == 0).all()
+
+    top_k = recommender.recommend(items, ratings, k=5, user="new")
+    expected = scorer.score([3])[0]
+    expected[items] = -np.inf
+    assert list(top_k.ITEM) == list(np.argsort(-expected)[:5])
+    assert list(top_k["rank"]) == [1, 2, 3, 4, 5]
+
+    recommender.invalidate("new")
+    assert "new" not in recommender._cache
+
+
+def test_alternating_least_squares():
+    from recoflow.models import AlternatingLeastSquares, _ALSSolve
+    from recoflow.preprocessing import InteractionMatrix
+    from recoflow.recommend import FactorScorer, GetSimilar, ItemEmbedding
+
+    df = _SampleInteractions()
+    R = InteractionMatrix.from_df(df, 30, 40).csr.astype(np.float32)
+    Y = np.random.RandomState(0).normal(size=(40, 3)).astype(np.float32)
+
+    # Conjugate gradient with as many steps as factors solves the normal equations
+    for implicit in [False, True]:
+        X = np.zeros((30, 3), dtype=np.float32)
+        _ALSSolve(R, X, Y, 0.5, implicit, 2.0, 10, 7, 2)
+        u = 4
+        cols = R.indices[R.indptr[u] : R.indptr[u + 1]]
+        ratings = R.data[R.indptr[u] : R.indptr[u + 1]]
+        if implicit:
+            confidence = 1 + 2.0 * ratings
+            A = Y.T @ Y + Y[cols].T @ ((confidence - 1)[:, None] * Y[cols]) + 0.5 * np.eye(3)
+            b = Y[cols].T @ confidence
+        else:
+            A = Y[cols].T @ Y[cols] + 0.5 * np.eye(3)
+            b = Y[cols].T @ ratings
+        assert np.allclose(X[u], np.linalg.solve(A, b), atol=1e-4)
+
+    model = AlternatingLeastSquares(df, n_factors=3, n_iter=5)
+    assert isinstance(model, FactorScorer)
+    assert ItemEmbedding(model).shape == (40, 3)
+    assert GetSimilar(ItemEmbedding(model), k=2).shape == (40, 3)
+
+
+def test_sar():
+    from recoflow.models import SAR
+    from recoflow.recommend import GetRankingTopK
+    from recoflow.metrics import RankingMetrics
+
+    df = _SampleInteractions()
+    X = np.zeros((30, 40))
+    X[df.USER, df.ITEM] = 1
+    cooccurrence = X.T @ X
+    counts = np.diag(cooccurrence)
+    jaccard = cooccurrence / (counts[:, None] + counts[None, :] - cooccurrence)
+    affinity = np.zeros((30, 40))
+    affinity[df.USER, df.ITEM] = df.RATING
+
+    model = SAR(df, similarity="jaccard", n_users=30, n_items=40)
+    assert np.allclose(model.score(np.arange(30)), affinity @ jaccard, atol=1e-5)
+    pairs = [np.array([0, 5]), np.array([3, 7])]
+    assert np.allclose(model.predict(pairs).ravel(), (affinity @ jaccard)[[0, 5], [3, 7]], atol=1e-5)
+    users, items = np.repeat(np.arange(30), 40)[::-1], np.tile(np.arange(40), 30)
+    assert np.allclose(model.predict([users, items], block_size=7).ravel(), (affinity @ jaccard)[users, items], atol=1e-5)
+
+    # Each item keeps its k most similar items
+    model = SAR(df, similarity="lift", k=3, n_users=30, n_items=40)
+    assert (np.diff(model.similarity.tocsc().indptr) <= 3).all()
+
+    top_k = GetRankingTopK(model, df, df, k=5, block_size=10)
+    assert len(RankingMetrics(df, top_k, k=5)) == 1
+
+
+def test_ranked_baselines():
+    from recoflow.models import Popularity, GenrePopularity, RandomRecommender
+    from recoflow.recommend import GetRankingTopK
+
+    df = _SampleInteractions()
+    for model in [Popularity(df, time_decay=10 ** 5, n_items=40), RandomRecommender(40)]:
+        expected = GetRankingTopK(model, df, df, k=5, block_size=7)
+        top_k = model.recommend(df, k=5, block_size=7)
+        pd.testing.assert_frame_equal(
+            top_k[["USER", "ITEM", "rank"]], expected[["USER", "ITEM", "rank"]], check_dtype=False)
+        assert np.allclose(top_k.RATING, expected.RATING)
+
+    # Users get the items of their most frequent genre first
+    genres = pd.DataFrame({"ITEM": np.arange(40), "genre_label": np.arange(40) % 2})
+    model = GenrePopularity(df, genres, n_users=30, n_items=40)
+    top_k = model.recommend(df, k=3)
+    user_genre = df.assign(genre=df.ITEM % 2).groupby("USER").genre.agg(lambda x: x.value_counts().sort_index().idxmax())
+    assert (top_k.ITEM % 2 == user_genre.loc[top_k.USER].values).all()
+
+    # Genres are counted one by one: "Action" users get "Action|Thriller" items first
+    flags = {0: "10", 1: "11", 2: "01"}
+    genres = pd.DataFrame({"ITEM": np.arange(40), "genre": [flags[item % 3] for item in range(40)]})
+    interactions = pd.DataFrame({"USER": [0, 0, 1, 1, 2], "ITEM": [0, 3, 2, 5, 1]})
+    model = GenrePopularity(interactions, genres, n_users=3, n_items=40)
+    top_k = model.recommend(interactions, k=6)
+    assert (top_k[top_k.USER == 0].ITEM % 3 != 2).all()
+    assert (top_k[top_k.USER == 1].ITEM % 3 != 0).all()
+
+    # Unknown users fall back to the global popularity
+    popularity = Popularity(interactions, n_items=40)
+    assert (model.score([3, 100]) == popularity.score([0, 0])).all()
+    assert (model.recommend(interactions, k=5, users=[100]).ITEM.values == popularity.rankings[0, :5]).all()
+
+
+def test_export_load_model(tmp_path):
+    from recoflow.encoder import IdEncoder
+    from recoflow.recommend import FactorScorer, ExportModel, LoadModel, GetRankingTopK
+
+    rng = np.random.RandomState(4)
+    scorer = FactorScorer(
+        rng.normal(size=(30, 3)).astype(np.float32), rng.normal(size=(40, 3)).astype(np.float32),
+        rng.normal(size=(30, 1)).astype(np.float32), rng.normal(size=(40, 1)).astype(np.float32), 1, 5,
+    )
+    item_encoder = IdEncoder().fit(["movie_{}".format(i) for i in range(40)])
+
+    ExportModel(scorer, str(tmp_path / "model"), item_encoder=item_encoder)
+    loaded = LoadModel(str(tmp_path / "model"))
+    assert isinstance(loaded.item_embedding, np.memmap)
+    assert loaded.user_encoder is None
+    assert (loaded.item_encoder.transform(["movie_7"]) == item_encoder.transform(["movie_7"])).all()
+    assert np.allclose(loaded.score(np.arange(30)), scorer.score(np.arange(30)))
+
+    df = _SampleInteractions()
+    pd.testing.assert_frame_equal(
+        GetRankingTopK(loaded, df, df, k=3, block_size=8), GetRankingTopK(scorer, df, df, k=3, block_size=8))
+
+    ExportModel(scorer, str(tmp_path / "model16"), dtype="float16")
+    loaded = LoadModel(str(tmp_path / "model16"))
+    assert loaded.item_embedding.dtype == np.float32
+    assert np.allclose(loaded.score(np.arange(30)), scorer.score(np.arange(30)), atol=1e-2)
+
+
+def test_lazy_imports():
+    import subprocess
+    import sys
+
+    # Using metrics, splitters, scoring or ALS must not import keras, matplotlib or altair
+    script = (
+        "import sys, recoflow\n"
+        "from recoflow.metrics import RankingMetrics\n"
+        "from recoflow.preprocessing import LeaveLastNSplit\n"
+        "from recoflow.recommend import LoadModel\n"
+        "from recoflow.models import AlternatingLeastSquares\n"
+        "print(' '.join(m for m in ['tensorflow', 'keras', 'matplotlib', 'altair'] if m in sys.modules))\n"
+    )
+    output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True)
+    assert output.stdout.strip() == ""
+
+    # Serving a loaded model needs numpy only
+    script = (
+        "import sys\n"
+        "from recoflow.serving import LoadModel, FactorScorer\n"
+        "print(' '.join(m for m in ['pandas', 'scipy', 'keras'] if m in sys.modules))\n"
+    )
+    output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True)
+    assert output.stdout.strip() == ""
+
+    import recoflow
+    assert recoflow.metrics.RankingMetrics is not None
+
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "data")
+
+
+def test_load_movielens_offline(tmp_path):
+    import shutil
+    from recoflow.datasets import LoadMovieLens
+
+    users, items, ratings = LoadMovieLens(DATA_DIR, cache_dir=str(tmp_path / "cache"))
+    assert ratings.shape == (100000, 4) and items.shape[0] == 1682 and users.shape[0] == 943
+    assert ratings.rating.dtype == np.int8 and ratings.user_id.dtype == np.int32
+    assert users.occupation.dtype == "category"
+
+    # Without the raw files, the gzip CSVs of data/ are parsed with the same dtypes
+    csv_dir = tmp_path / "csv"
+    csv_dir.mkdir()
+    shutil.copy(os.path.join(DATA_DIR, "ratings.csv.gz"), str(csv_dir))
+    (csv_ratings,) = LoadMovieLens(str(csv_dir), tables=["ratings"], cache_dir=str(tmp_path / "cache_csv"))
+    pd.testing.assert_frame_equal(csv_ratings, ratings)
+
+    with pytest.raises(FileNotFoundError):
+        LoadMovieLens(str(csv_dir), tables=["users"], cache_dir=str(tmp_path / "cache_csv"))
+
+
+def test_load_movielens_cache(tmp_path):
+    pytest.importorskip("pyarrow", exc_type=ImportError)
+    from recoflow.datasets import LoadMovieLens
+
+    for cache_format in ["parquet", "feather"]:
+        cache_dir = str(tmp_path / cache_format)
+        users, items, ratings = LoadMovieLens(DATA_DIR, cache_dir=cache_dir, cache_format=cache_format)
+        assert len(os.listdir(cache_dir)) == 3
+
+        cached = LoadMovieLens(DATA_DIR, cache_dir=cache_dir, cache_format=cache_format)
+        pd.testing.assert_frame_equal(cached[2], ratings)
+        assert cached[0].occupation.dtype == "category"
+
+        (projected,) = LoadMovieLens(
+            DATA_DIR, cache_dir=cache_dir, tables=["ratings"], columns={"ratings": ["user_id", "rating"]},
+            cache_format=cache_format)
+        assert list(projected.columns) == ["user_id", "rating"]
+
+
+def test_ingest_interactions(tmp_path):
+    from recoflow.preprocessing import IngestInteractions, InteractionStore, InteractionMatrix
+    from recoflow.preprocessing import ChronoSplit, LeaveLastNSplit
+
+    df = _SampleInteractions()
+    log = df.rename(columns={"USER": "user", "ITEM": "item", "RATING": "rating", "TIMESTAMP": "ts"})
+    log["user"] = "u" + log.user.astype(str)
+    log.to_csv(str(tmp_path / "log.csv"), index=False)
+
+    store = IngestInteractions(
+        str(tmp_path / "log.csv"), str(tmp_path / "store"), "user", "item", "rating", "ts", chunk_size=37)
+    assert len(store) == len(df)
+    assert store["USER"].dtype == np.int32 and store["TIMESTAMP"].dtype == np.int64
+    assert isinstance(store["ITEM"], np.memmap)
+
+    # Codes are in order of appearance and decode back to the log
+    assert (store.user_encoder.inverse_transform(store["USER"]) == log.user.values).all()
+    assert (store.item_encoder.inverse_transform(store["ITEM"]) == log.item.values).all()
+    assert (store["RATING"] == log.rating.values).all()
+
+    # Split indices match the in-memory splitters
+    encoded = store.to_df()
+    for split_index, splits in [
+        (store.split_index([0.7, 0.3], chrono=True), ChronoSplit(encoded, [0.7, 0.3])),
+        (store.split_index(leave_n=2, chrono=True), LeaveLastNSplit(encoded, n=2)),
+    ]:
+        expected = pd.concat(splits).split_index.sort_index().values
+        assert (split_index == expected).all()
+
+    # Splitting the groups in partitions of about 40 rows gives the same split
+    for by, chrono, leave_n in [("USER", True, 2), ("ITEM", False, None)]:
+        ratios = None if leave_n else [0.6, 0.2, 0.2]
+        assert (store.split_index(ratios, by, chrono, leave_n, chunk_size=40)
+                == store.split_index(ratios, by, chrono, leave_n)).all()
+
+    # An (empty) encoder given by the caller is the one extended
+    from recoflow.encoder import IdEncoder
+    user_encoder = IdEncoder(sort=False)
+    IngestInteractions([log], str(tmp_path / "given"), "user", "item", user_encoder=user_encoder)
+    assert (user_encoder.classes_ == store.user_encoder.classes_).all()
+
+    train = store.interaction_matrix(store.split_index(leave_n=1, chrono=True) == 0)
+    assert isinstance(train, InteractionMatrix) and train.shape == (store.n_users, store.n_items)
+    assert sum(len(chunk) for chunk in InteractionStore(str(tmp_path / "store")).chunks(50)) == len(df)
+
+
+def test_id_encoder_partial_fit_chunks(monkeypatch):
+    from recoflow.encoder import IdEncoder
+
+    # Counts the hash maps built from the full classes
+    builds = []
+    build_lookup = IdEncoder._BuildLookup
+    monkeypatch.setattr(IdEncoder, "_BuildLookup", lambda self: builds.append(1) or build_lookup(self))
+
+    rng = np.random.default_rng(0)
+    ids = rng.integers(0, 5000, 20000)
+    encoder = IdEncoder(sort=False)
+    codes = [encoder.partial_fit(chunk).transform(chunk) for chunk in np.array_split(ids, 400)]
+    assert len(builds) == 1
+    assert (encoder.classes_ == pd.unique(ids)).all()
+    assert (np.concatenate(codes) == pd.factorize(ids)[0]).all()
+
+    # Reading the classes between chunks does not rebuild the hash map either
+    encoder.partial_fit([7000, 7001])
+    assert encoder.classes_[-2:].tolist() == [7000, 7001]
+    assert (encoder.transform([7001, int(ids[0])]) == [len(encoder) - 1, 0]).all()
+    assert len(builds) == 1
+
+def test_lean_dtypes(tmp_path):
+    from recoflow.preprocessing import Downcast, EncodeUserItem, RandomSplit, LeaveLastNSplit
+    from recoflow.preprocessing import IngestInteractions, InteractionStore
+    from recoflow.utils import MemoryReport, NegativeSamples
+
+    df = pd.DataFrame({"a": [1, 200], "b": [-1, 40000], "c": [0.5, 1.5], "d": ["x", "y"]})
+    assert list(Downcast(df).dtypes) == [np.int16, np.int32, np.float32, np.dtype(object)]
+
+    raw = _SampleInteractions().rename(columns={"USER": "user_id", "ITEM": "movie_id"})
+    encoded, *_ = EncodeUserItem(raw, "user_id", "movie_id", "RATING", "TIMESTAMP")
+    lean, *_ = EncodeUserItem(raw, "user_id", "movie_id", "RATING", "TIMESTAMP", lean=True)
+    assert list(lean.columns) == ["RATING", "TIMESTAMP", "USER", "ITEM"]
+    assert lean.RATING.dtype == np.int8 and lean.TIMESTAMP.dtype == np.int32
+    assert (lean.values == encoded[lean.columns].values).all()
+
+    # Same splits, with an int8 split_index
+    for split, split_lean in [
+        (RandomSplit(encoded, [0.8, 0.2]), RandomSplit(lean, [0.8, 0.2], lean=True)),
+        (LeaveLastNSplit(encoded, n=2), LeaveLastNSplit(lean, n=2, lean=True)),
+    ]:
+        for part, part_lean in zip(split, split_lean):
+            assert part_lean.split_index.dtype == np.int8
+            assert (part.index == part_lean.index).all()
+
+    assert NegativeSamples(lean[["USER", "ITEM", "RATING"]], 3, lean=True).rating.dtype == np.int8
+
+    # Default dtypes are unchanged, lean is opt-in (and kept by the store)
+    for split in RandomSplit(encoded, [0.8, 0.2]) + LeaveLastNSplit(encoded, n=2):
+        assert split.split_index.dtype == np.int64
+    chunks = np.array_split(encoded, 4)
+    store = IngestInteractions(chunks, str(tmp_path / "store"), "USER", "ITEM", "RATING", "TIMESTAMP")
+    lean_store = IngestInteractions(chunks, str(tmp_path / "lean"), "USER", "ITEM", "RATING", "TIMESTAMP", lean=True)
+    assert store.split_index(leave_n=1, chrono=True).dtype == np.int64
+    assert lean_store.split_index(leave_n=1, chrono=True).dtype == np.int8
+    assert InteractionStore(str(tmp_path / "lean")).split_index([0.5, 0.5]).dtype == np.int8
+    assert (lean_store.split_index([0.5, 0.5]) == store.split_index([0.5, 0.5])).all()
+
+    report = MemoryReport({"encoded": encoded, "lean": lean, "splits": RandomSplit(lean, [0.8, 0.2], lean=True)})
+    assert report.loc["lean", "bytes"] < report.loc["encoded", "bytes"] / 2
+    assert report.loc["splits", "rows"] == len(lean)